@@ -0,0 +1,186 @@
+import os
+import argparse
+
+import numpy as np
+
+from box_ops import box_iou
+from evaluate import load_submission
+
+# --- 設定區塊 (Config Block) ---
+# 推論後端：torch (原本的 eager PyTorch)、torchscript、onnx (ONNX Runtime，CPU 上通常明顯快於 eager)
+BACKENDS = ('torch', 'torchscript', 'onnx')
+DEFAULT_BACKEND = 'torch'
+# 匯出檔與 best.pt 放在同一個資料夾 (Ultralytics 的預設位置)，例如 best.onnx / best.torchscript
+EXPORT_SUFFIXES = {'torchscript': '.torchscript', 'onnx': '.onnx'}
+# TTA 的縮放與翻轉 (與 Ultralytics DetectionModel._predict_augment 相同)；匯出的圖不含 TTA，由這裡在圖外進行
+TTA_SCALES = (1, 0.83, 0.67)
+TTA_FLIPS = (None, 3, None)  # 3 = 左右翻轉
+TTA_DETECT_LAYERS = 3        # P3-P5 偵測頭
+# --- 設定區塊 ---
+
+
+def exported_weights_path(model_path, backend):
+    """backend 對應的權重檔：torch 為 best.pt 本身，其餘為同資料夾的匯出檔。"""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend!r}; choose from {BACKENDS}.')
+    if backend == 'torch':
+        return model_path
+    return os.path.splitext(model_path)[0] + EXPORT_SUFFIXES[backend]
+
+
+def resolve_weights(model_path, backend):
+    """回傳 backend 要載入的權重檔；匯出檔不存在時提示先執行 export。"""
+    path = exported_weights_path(model_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{path} not found; run: python src/backends.py export --model-path {model_path} '
+                                f'--backends {backend}')
+    return path
+
+
+def export_weights(model_path, backends=('onnx', 'torchscript'), imgsz=960, opset=None):
+    """
+    由 best.pt 一次匯出多個後端 (於 CPU 上匯出)。
+    一律以 dynamic=True 匯出：批次大小與輸入尺寸可變，letterbox 與 eager 推論相同 (最小填充)，輸出才會一致。
+    """
+    from ultralytics import YOLO
+
+    outputs = {}
+    for backend in backends:
+        if backend == 'torch':
+            continue
+        kwargs = dict(format=backend, imgsz=imgsz, dynamic=True, device='cpu')
+        if backend == 'onnx':
+            kwargs.update(simplify=True, opset=opset)
+        path = YOLO(model_path).export(**kwargs)
+        expected = exported_weights_path(model_path, backend)
+        if os.path.abspath(str(path)) != os.path.abspath(expected):
+            os.replace(str(path), expected)
+        outputs[backend] = expected
+        print(f'Exported {backend}: {expected}')
+    return outputs
+
+
+def model_forward(model, im, augment=False):
+    """
+    AutoBackend 的前向。eager PyTorch 由模型自己做 TTA；匯出的圖不支援 augment，
+    因此以相同的縮放 / 翻轉在圖外多次前向後合併 (augmented_forward)，結果與 eager TTA 一致。
+    """
+    if augment and getattr(model, 'format', 'pt') != 'pt':
+        return augmented_forward(model, im)
+    return model(im, augment=augment)
+
+
+def augmented_forward(model, im):
+    """圖外 TTA：對應 DetectionModel._predict_augment / _descale_pred / _clip_augmented。"""
+    import torch
+    from ultralytics.utils.torch_utils import scale_img
+
+    stride = model.stride
+    gs = int(stride.max()) if isinstance(stride, torch.Tensor) else int(stride)
+    img_size = im.shape[-2:]
+    outputs = []
+    for scale, flip in zip(TTA_SCALES, TTA_FLIPS):
+        xi = scale_img(im.flip(flip) if flip else im, scale, gs=gs)
+        y = model(xi)
+        y = y[0] if isinstance(y, (list, tuple)) else y
+        y = y.clone()
+        y[:, :4] /= scale
+        x, yc, wh, cls = y.split((1, 1, 2, y.shape[1] - 4), 1)
+        if flip == 2:
+            yc = img_size[0] - yc
+        elif flip == 3:
+            x = img_size[1] - x
+        outputs.append(torch.cat((x, yc, wh, cls), 1))
+    # 去掉大尺度輸出的最後一層 (大物件) 與小尺度輸出的第一層 (小物件)
+    grid = sum(4 ** x for x in range(TTA_DETECT_LAYERS))
+    outputs[0] = outputs[0][..., :-(outputs[0].shape[-1] // grid)]
+    outputs[-1] = outputs[-1][..., (outputs[-1].shape[-1] // grid) * 4 ** (TTA_DETECT_LAYERS - 1):]
+    return torch.cat(outputs, -1)
+
+
+def compare_images(a, b, match_iou=0.5):
+    """
+    以同類別、IoU 最大的一對一配對比較兩組 (N, 6) 偵測結果 (依 a 的信心值順序貪婪配對)。
+    回傳 (配對數, 只在 a, 只在 b, 最大 conf 差, 最大座標差 (像素), 未配對框的最大 conf)。
+    """
+    if len(a) == 0 or len(b) == 0:
+        unmatched = np.concatenate([a[:, 4], b[:, 4]])
+        return 0, len(a), len(b), 0.0, 0.0, float(unmatched.max()) if len(unmatched) else 0.0
+    iou = box_iou(a[:, :4], b[:, :4])
+    iou[a[:, 5][:, None] != b[:, 5][None, :]] = 0.0
+    used = np.zeros(len(b), dtype=bool)
+    pairs = []
+    for i in np.argsort(-a[:, 4], kind='stable'):
+        candidates = np.where(used, -1.0, iou[i])
+        j = int(np.argmax(candidates))
+        if candidates[j] >= match_iou:
+            used[j] = True
+            pairs.append((i, j))
+    ia = np.array([i for i, _ in pairs], dtype=np.int64)
+    ib = np.array([j for _, j in pairs], dtype=np.int64)
+    only_a = np.setdiff1d(np.arange(len(a)), ia)
+    only_b = np.flatnonzero(~used)
+    conf_diff = float(np.abs(a[ia, 4] - b[ib, 4]).max()) if len(pairs) else 0.0
+    box_diff = float(np.abs(a[ia, :4] - b[ib, :4]).max()) if len(pairs) else 0.0
+    unmatched = np.concatenate([a[only_a, 4], b[only_b, 4]])
+    return len(pairs), len(only_a), len(only_b), conf_diff, box_diff, float(unmatched.max()) if len(unmatched) else 0.0
+
+
+def compare_submissions(csv_a, csv_b, conf_tol=1e-3, box_tol=2.0):
+    """
+    比較兩個提交 CSV (例如 torch 與 onnx 後端) 是否在容忍範圍內相同。
+    座標在 CSV 中已取整數，因此 box_tol 以像素計；門檻附近的框可能只出現在其中一邊，會列為未配對。
+    """
+    preds_a, preds_b = load_submission(csv_a), load_submission(csv_b)
+    report = {'images': 0, 'identical_images': 0, 'matched': 0, 'only_a': 0, 'only_b': 0,
+              'max_conf_diff': 0.0, 'max_box_diff': 0.0, 'max_unmatched_conf': 0.0,
+              'missing_images': sorted(set(preds_a) ^ set(preds_b), key=str)}
+    for image_id in set(preds_a) & set(preds_b):
+        a, b = preds_a[image_id], preds_b[image_id]
+        matched, only_a, only_b, conf_diff, box_diff, unmatched_conf = compare_images(a, b)
+        report['images'] += 1
+        report['identical_images'] += int(a.shape == b.shape and np.array_equal(a, b))
+        report['matched'] += matched
+        report['only_a'] += only_a
+        report['only_b'] += only_b
+        report['max_conf_diff'] = max(report['max_conf_diff'], conf_diff)
+        report['max_box_diff'] = max(report['max_box_diff'], box_diff)
+        report['max_unmatched_conf'] = max(report['max_unmatched_conf'], unmatched_conf)
+    report['within_tolerance'] = (not report['missing_images'] and report['only_a'] == 0 and report['only_b'] == 0
+                                  and report['max_conf_diff'] <= conf_tol and report['max_box_diff'] <= box_tol)
+    return report
+
+
+def print_comparison(report, csv_a, csv_b):
+    print(f"\n--- {csv_a} vs {csv_b} ---")
+    print(f"images: {report['images']} (identical rows: {report['identical_images']}, "
+          f"missing on one side: {len(report['missing_images'])})")
+    print(f"boxes matched: {report['matched']}, only in first: {report['only_a']}, only in second: {report['only_b']} "
+          f"(highest unmatched conf: {report['max_unmatched_conf']:.4f})")
+    print(f"max conf diff: {report['max_conf_diff']:.6f}, max box diff: {report['max_box_diff']:.2f} px")
+    print(f"within tolerance: {report['within_tolerance']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export best.pt to TorchScript / ONNX and compare submissions across backends.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help="One-shot export of best.pt for the torchscript / onnx backends.")
+    export.add_argument('--model-path', type=str, nargs='+', required=True, help="Path(s) to the trained best.pt weights.")
+    export.add_argument('--backends', type=str, nargs='+', default=['onnx', 'torchscript'], choices=BACKENDS[1:], help="Backends to export.")
+    export.add_argument('--imgsz', type=int, default=960, help="Export image size (the graph stays dynamic).")
+    export.add_argument('--opset', type=int, default=None, help="ONNX opset (default: Ultralytics' choice).")
+
+    compare = subparsers.add_parser('compare', help="Check that two submission CSVs agree within a tolerance.")
+    compare.add_argument('csv', type=str, nargs=2, help="Two submission CSVs (e.g., torch and onnx backends).")
+    compare.add_argument('--conf-tol', type=float, default=1e-3, help="Maximum confidence difference of matched boxes.")
+    compare.add_argument('--box-tol', type=float, default=2.0, help="Maximum coordinate difference of matched boxes (pixels).")
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        for model_path in args.model_path:
+            export_weights(model_path, args.backends, args.imgsz, args.opset)
+    else:
+        report = compare_submissions(args.csv[0], args.csv[1], args.conf_tol, args.box_tol)
+        print_comparison(report, args.csv[0], args.csv[1])
+        raise SystemExit(0 if report['within_tolerance'] else 1)
@@ -0,0 +1,259 @@
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+import cv2
+import numpy as np
+
+import inference
+import conver_to_yolo
+import split_dataset
+from image_io import ImageMetaCache
+from postprocess import denormalize_to_kaggle_format_np
+from benchmark_postprocess import make_fake_result
+
+# --- 設定區塊 (Config Block) ---
+NUM_IMAGES = 200
+IMAGE_W, IMAGE_H = 1280, 720
+BOXES_PER_IMAGE = 20
+REPEATS = 3
+TINY_MODEL = 'yolo11n.yaml'  # 隨機初始化的最小模型，只用於量測推論流程的吞吐量
+INFERENCE_IMGSZ = 320
+# --- 設定區塊 ---
+
+
+def make_synthetic_dataset(root, num_images, img_w, img_h, boxes_per_image, seed=0):
+    """
+    在 root 下產生與比賽資料相同格式的假資料：img/00000001.jpg ... 與 gt.txt (<frame>,<x>,<y>,<w>,<h>)。
+    圖片為平滑的隨機雜訊，JPEG 壓縮後的大小接近真實影像。回傳 (gt_file, image_dir)。
+    """
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.join(root, 'img')
+    os.makedirs(image_dir, exist_ok=True)
+    rows = []
+    for frame in range(1, num_images + 1):
+        small = rng.integers(0, 256, size=(img_h // 16, img_w // 16, 3), dtype=np.uint8)
+        image = cv2.resize(small, (img_w, img_h), interpolation=cv2.INTER_LINEAR)
+        cv2.imwrite(os.path.join(image_dir, f"{frame:08d}.jpg"), image)
+
+        wh = rng.uniform(20, 200, size=(boxes_per_image, 2))
+        xy = rng.uniform(0, 1, size=(boxes_per_image, 2)) * (np.array([img_w, img_h]) - wh)
+        for (x, y), (w, h) in zip(xy.tolist(), wh.tolist()):
+            rows.append(f"{frame},{x:.1f},{y:.1f},{w:.1f},{h:.1f}")
+
+    gt_file = os.path.join(root, 'gt.txt')
+    with open(gt_file, 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+    return gt_file, image_dir
+
+
+def time_stage(fn, repeats, setup=None):
+    """執行 fn repeats 次 (每次之前呼叫 setup，不計時)，回傳每次的秒數列表。stdout 會被丟棄。"""
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, items):
+    best = min(timings)
+    return {
+        'seconds_min': best,
+        'seconds_median': float(np.median(timings)),
+        'items': items,
+        'items_per_s': items / best if best > 0 else None,
+        'repeats': len(timings),
+    }
+
+
+def bench_convert(gt_file, image_dir, labels_dir, num_images, repeats):
+    # force=True：每次都重新轉換，避免量到的是增量略過的時間
+    return summarize(time_stage(
+        lambda: conver_to_yolo.main(gt_file, image_dir, labels_dir, force=True),
+        repeats,
+    ), num_images)
+
+
+def bench_split(image_dir, labels_dir, target_root, num_images, repeats, mode):
+    return summarize(time_stage(
+        lambda: split_dataset.split_and_move_files(image_dir, labels_dir, target_root, 0.2, 42, mode),
+        repeats,
+        setup=lambda: shutil.rmtree(target_root, ignore_errors=True),
+    ), num_images)
+
+
+def bench_postprocess(num_boxes, img_w, img_h, repeats):
+    """PredictionString 產生 (向量化) 與逐框 / 向量化座標反正規化，皆以每張圖片 num_boxes 個框量測。"""
+    image_meta = ImageMetaCache()
+    img_path = 'benchmark.jpg'
+    image_meta.put(img_path, img_w, img_h)
+    result = make_fake_result(num_boxes, img_w, img_h, 'cpu')
+    xywhn = result.boxes.xywhn.numpy().astype(np.float64)
+
+    def denormalize_per_box():
+        for x, y, w, h in xywhn.tolist():
+            inference.denormalize_to_kaggle_format(x, y, w, h, img_w, img_h)
+
+    loops = 20
+    return {
+        'generate_prediction_string': summarize(time_stage(
+            lambda: [inference.generate_prediction_string(result, img_path, image_meta) for _ in range(loops)],
+            repeats), loops),
+        'denormalize_per_box': summarize(time_stage(
+            lambda: [denormalize_per_box() for _ in range(loops)], repeats), loops),
+        'denormalize_vectorized': summarize(time_stage(
+            lambda: [denormalize_to_kaggle_format_np(xywhn, img_w, img_h) for _ in range(loops)], repeats), loops),
+    }
+
+
+def bench_inference(image_dir, output_csv, model_cfg, imgsz, repeats, streaming):
+    """以 CPU 上的小模型跑完整推論流程 (讀圖、推論、後處理、寫 CSV)。"""
+    from ultralytics import YOLO
+
+    model = YOLO(model_cfg)
+    image_paths = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith('.jpg')
+    )
+    # 推論設定沿用 inference.py 的模組常數；這裡改成 CPU 友善的尺寸並關閉 TTA
+    inference.IMG_SIZE = imgsz
+    inference.USE_TTA = False
+
+    def run():
+        rows = []
+        for img_path, result in inference.iter_predictions(model, image_paths, 'cpu', streaming):
+            prediction_string = inference.generate_prediction_string(result, img_path) if result is not None else ""
+            rows.append(f"{inference.extract_pure_id(os.path.basename(img_path))},{prediction_string}")
+        with open(output_csv, 'w') as f:
+            f.write("Image_ID,PredictionString\n" + "\n".join(rows) + "\n")
+
+    # 第一次執行包含模型初始化 / 記憶體配置，不列入計時
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    return summarize(time_stage(run, repeats), len(image_paths))
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    info = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def compare_reports(current, baseline_path):
+    """與先前的 JSON 報告比較每個階段的最佳秒數，印出相對變化 (正值 = 變慢)。"""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    def flatten(stages, prefix=''):
+        for name, value in stages.items():
+            if 'seconds_min' in value:
+                yield prefix + name, value['seconds_min']
+            else:
+                yield from flatten(value, prefix + name + '.')
+
+    old = dict(flatten(baseline['stages']))
+    print(f"\nCompared with {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    for name, seconds in flatten(current['stages']):
+        if name in old and old[name] > 0:
+            print(f"  {name:<45} {old[name]:9.4f}s -> {seconds:9.4f}s ({(seconds / old[name] - 1) * 100:+.1f}%)")
+
+
+def main(args):
+    config = {
+        'num_images': args.num_images,
+        'image_size': [args.img_w, args.img_h],
+        'boxes_per_image': args.boxes_per_image,
+        'repeats': args.repeats,
+        'split_mode': args.split_mode,
+        'model': args.model,
+        'inference_imgsz': args.imgsz,
+        'streaming': args.stream,
+    }
+    report = {'environment': environment_info(), 'config': config, 'stages': {}}
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='hw1_bench_')
+    try:
+        print(f"Generating {args.num_images} synthetic {args.img_w}x{args.img_h} images in {work_dir}...")
+        start = time.perf_counter()
+        gt_file, image_dir = make_synthetic_dataset(work_dir, args.num_images, args.img_w, args.img_h, args.boxes_per_image)
+        print(f"  done in {time.perf_counter() - start:.1f}s")
+        labels_dir = os.path.join(work_dir, 'yolo_labels')
+        stages = report['stages']
+
+        print("Benchmarking label conversion...")
+        stages['convert'] = bench_convert(gt_file, image_dir, labels_dir, args.num_images, args.repeats)
+        print("Benchmarking dataset split...")
+        stages['split'] = bench_split(image_dir, labels_dir, os.path.join(work_dir, 'yolo_dataset'),
+                                      args.num_images, args.repeats, args.split_mode)
+        print("Benchmarking post-processing...")
+        stages['postprocess'] = bench_postprocess(args.boxes_per_image, args.img_w, args.img_h, args.repeats)
+        if not args.skip_inference:
+            print(f"Benchmarking end-to-end inference ({args.model}, imgsz={args.imgsz}, CPU)...")
+            stages['inference'] = bench_inference(image_dir, os.path.join(work_dir, 'submission.csv'),
+                                                  args.model, args.imgsz, args.repeats, args.stream)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\n--- Results (best of repeats) ---")
+    for name, value in report['stages'].items():
+        for sub, stats in ([(name, value)] if 'seconds_min' in value else [(f"{name}.{k}", v) for k, v in value.items()]):
+            print(f"  {sub:<45} {stats['seconds_min']:9.4f}s  {stats['items_per_s']:10.1f} items/s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        compare_reports(report, args.compare)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CPU-only throughput benchmark for the convert -> split -> post-process -> inference pipeline.")
+    parser.add_argument('--num-images', type=int, default=NUM_IMAGES, help="Number of synthetic images.")
+    parser.add_argument('--img-w', type=int, default=IMAGE_W, help="Synthetic image width.")
+    parser.add_argument('--img-h', type=int, default=IMAGE_H, help="Synthetic image height.")
+    parser.add_argument('--boxes-per-image', type=int, default=BOXES_PER_IMAGE, help="Ground-truth / predicted boxes per image.")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="Timed repetitions per stage (the best one is reported).")
+    parser.add_argument('--split-mode', type=str, default='copy', choices=split_dataset.SPLIT_MODES, help="Split mode to benchmark.")
+    parser.add_argument('--model', type=str, default=TINY_MODEL, help="Model config or weights used for the inference stage.")
+    parser.add_argument('--imgsz', type=int, default=INFERENCE_IMGSZ, help="Inference image size for the inference stage.")
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction, default=inference.USE_STREAMING, help="Use the background-loader inference path.")
+    parser.add_argument('--skip-inference', action='store_true', help="Skip the end-to-end inference stage (no ultralytics model needed).")
+    parser.add_argument('--work-dir', type=str, default=None, help="Keep the synthetic data in this directory instead of a temporary one.")
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help="Path of the JSON report.")
+    parser.add_argument('--compare', type=str, default=None, help="Previous JSON report to compare against.")
+
+    main(parser.parse_args())
@@ -0,0 +1,57 @@
+import argparse
+import time
+from types import SimpleNamespace
+
+import torch
+from ultralytics.engine.results import Boxes
+
+from image_io import ImageMetaCache
+from inference import generate_prediction_string, generate_prediction_string_per_box
+
+
+def make_fake_result(num_boxes, img_w, img_h, device, seed=0):
+    """產生一張含 num_boxes 個隨機框的假推論結果 (x1 y1 x2 y2 conf cls)。"""
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(num_boxes, 2, generator=g) * torch.tensor([img_w * 0.9, img_h * 0.9])
+    wh = torch.rand(num_boxes, 2, generator=g) * torch.tensor([img_w * 0.1, img_h * 0.1]) + 1
+    conf = torch.rand(num_boxes, 1, generator=g)
+    cls = torch.zeros(num_boxes, 1)
+    data = torch.cat([xy, xy + wh, conf, cls], dim=1).to(device)
+    orig_shape = (img_h, img_w)
+    return SimpleNamespace(boxes=Boxes(data, orig_shape), orig_shape=orig_shape)
+
+
+def time_fn(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    return (time.perf_counter() - start) / repeats, out
+
+
+def main(num_boxes, img_w, img_h, repeats, device):
+    image_meta = ImageMetaCache()
+    img_path = 'benchmark.jpg'
+    image_meta.put(img_path, img_w, img_h)
+    result = make_fake_result(num_boxes, img_w, img_h, device)
+
+    per_box_s, per_box_out = time_fn(lambda: generate_prediction_string_per_box(result, img_path, image_meta), repeats)
+    vector_s, vector_out = time_fn(lambda: generate_prediction_string(result, img_path, image_meta), repeats)
+
+    print(f"Boxes per image: {num_boxes} (device: {device}, image: {img_w}x{img_h})")
+    print(f"Per-box path   : {per_box_s * 1000:.2f} ms/image")
+    print(f"Vectorized path: {vector_s * 1000:.2f} ms/image")
+    print(f"Speedup        : {per_box_s / max(vector_s, 1e-12):.1f}x")
+    print(f"Identical output: {per_box_out == vector_out}")
+    return {'per_box_ms': per_box_s * 1000, 'vectorized_ms': vector_s * 1000, 'identical': per_box_out == vector_out}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark per-box vs vectorized PredictionString generation.")
+    parser.add_argument('--num-boxes', type=int, default=3000, help="Number of boxes per synthetic image.")
+    parser.add_argument('--img-w', type=int, default=1920, help="Synthetic image width.")
+    parser.add_argument('--img-h', type=int, default=1080, help="Synthetic image height.")
+    parser.add_argument('--repeats', type=int, default=20, help="Number of timed repetitions.")
+    parser.add_argument('--device', type=str, default='cpu', help="Device for the box tensors (e.g., 'cpu' or 'cuda:0').")
+
+    args = parser.parse_args()
+    main(args.num_boxes, args.img_w, args.img_h, args.repeats, args.device)
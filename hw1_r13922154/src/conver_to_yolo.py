@@ -1,9 +1,19 @@
 import os
 import argparse
-from PIL import Image
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_io import read_image_size
+from label_store import LabelStore, label_store_path
+from video_io import FIRST_FRAME_NUMBER, count_video_frames, frame_number_of, is_video, video_info
 
 # --- 設定區塊 (Config Block) ---
 CLASS_ID = 0  # 您的單一類別 ID，固定為 0
+NUM_WORKERS = min(32, (os.cpu_count() or 4) * 4)  # 讀取檔頭為 I/O 密集，執行緒數可高於核心數
+# 標籤輸出格式：'txt' 每張圖片一個 .txt；'packed' 單一打包檔 (<output-labels-dir>.labels.npz)；'both' 兩者皆寫
+LABEL_FORMAT = 'both'
 # --- 設定區塊 ---
 
 def convert_bbox_to_yolo(x_min, y_min, width, height, img_w, img_h):
@@ -14,75 +24,216 @@ def convert_bbox_to_yolo(x_min, y_min, width, height, img_w, img_h):
     h_norm = height / img_h
     return f"{CLASS_ID} {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}"
 
-def main(gt_file, image_dir, yolo_labels_dir):
+def normalize_bboxes(bboxes, img_w, img_h):
+    """將 (N, 4) 的 (x_min, y_min, width, height) 轉為 (N, 4) 正規化 (x_center, y_center, w, h)。"""
+    bboxes = np.asarray(bboxes, dtype=np.float64)
+    x_center = (bboxes[:, 0] + bboxes[:, 2] / 2) / img_w
+    y_center = (bboxes[:, 1] + bboxes[:, 3] / 2) / img_h
+    w_norm = bboxes[:, 2] / img_w
+    h_norm = bboxes[:, 3] / img_h
+    return np.stack([x_center, y_center, w_norm, h_norm], axis=1)
+
+def convert_bboxes_to_yolo(bboxes, img_w, img_h):
+    """convert_bbox_to_yolo 的向量化版本：bboxes 為 (N, 4) 的 (x_min, y_min, width, height)。"""
+    xywhn = normalize_bboxes(bboxes, img_w, img_h)
+    return [
+        f"{CLASS_ID} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+        for x, y, w, h in xywhn.tolist()
+    ]
+
+def _parse_gt_lines(gt_file):
+    """逐行解析 gt.txt (僅在整批讀取失敗時使用)，略過格式錯誤的行。"""
+    rows = []
+    with open(gt_file, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                # <frame>, <bb_left>, <bb_top>, <bb_width>, <bb_height>
+                data = [float(x.strip()) for x in line.strip().split(',')]
+                if len(data) != 5:
+                    print(f"Skipping malformed line: {line.strip()}")
+                    continue
+                rows.append(data)
+            except Exception as e:
+                print(f"Skipping line due to error: {e}. Line: {line.strip()}")
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+def load_gt(gt_file):
+    """以 NumPy 一次讀入整個 gt.txt，回傳 (N, 5) 陣列；有格式錯誤的行時退回逐行解析。"""
+    try:
+        data = np.loadtxt(gt_file, delimiter=',', dtype=np.float64, ndmin=2)
+    except ValueError:
+        return _parse_gt_lines(gt_file)
+    if data.size == 0:
+        return np.zeros((0, 5), dtype=np.float64)
+    if data.shape[1] != 5:
+        return _parse_gt_lines(gt_file)
+    return data
+
+def group_by_frame(data):
+    """依 frame 欄位向量化分組，回傳 {frame_name: (N, 4) bboxes}。"""
+    if len(data) == 0:
+        return {}
+    frames = data[:, 0].astype(np.int64)
+    order = np.argsort(frames, kind='stable')
+    sorted_frames = frames[order]
+    unique_frames, starts = np.unique(sorted_frames, return_index=True)
+    groups = np.split(data[order, 1:], starts[1:])
+    # 假設您的圖片命名格式是 8 位數字 (e.g., 00000001.jpg)
+    return {f"{frame:08d}.jpg": bboxes for frame, bboxes in zip(unique_frames.tolist(), groups)}
+
+def _is_up_to_date(label_path, img_mtime, gt_mtime):
+    """標籤檔比 gt.txt 與圖片 (或影片) 都新時視為已是最新，可略過。"""
+    try:
+        label_mtime = os.path.getmtime(label_path)
+    except OSError:
+        return False
+    return label_mtime > gt_mtime and label_mtime > img_mtime
+
+def _load_previous_store(store_path, gt_mtime):
+    """讀取上次的打包檔，回傳 (LabelStore, 修改時間)；不存在、比 gt.txt 舊或無法讀取時回傳 None。"""
+    try:
+        store_mtime = os.path.getmtime(store_path)
+        if store_mtime <= gt_mtime:
+            return None
+        return LabelStore.load(store_path), store_mtime
+    except Exception:
+        return None
+
+def _convert_frame(frame_name, bboxes, image_dir, yolo_labels_dir, gt_mtime, force, label_format, video_meta=None,
+                   previous=None):
+    """
+    轉換單一 frame，回傳 (status, packed)：status 為 'written' / 'skipped' / 'missing' / 'error'，
+    packed 為打包格式所需的 ((n, 5) 標籤, (width, height))，不需要時為 None。
+    於工作執行緒中執行：只讀取圖片檔頭取得尺寸。
+    image_dir 為影片時 video_meta 為 (影格數, (width, height), 影片修改時間)，不需讀取任何影格。
+    previous 為 _load_previous_store 的結果：已是最新的 frame 直接沿用其中的標籤與尺寸，不再讀取檔頭。
+    """
+    img_path = os.path.join(image_dir, frame_name)
+    label_path = os.path.join(yolo_labels_dir, frame_name.replace('.jpg', '.txt'))
+    write_txt = label_format in ('txt', 'both')
+    write_packed = label_format in ('packed', 'both')
+
+    if video_meta is not None:
+        frame_count, video_size, img_mtime = video_meta
+        if not FIRST_FRAME_NUMBER <= frame_number_of(frame_name) < FIRST_FRAME_NUMBER + frame_count:
+            return 'missing', None
+    elif not os.path.exists(img_path):
+        return 'missing', None
+    try:
+        if video_meta is None:
+            img_mtime = os.path.getmtime(img_path)
+        txt_up_to_date = write_txt and not force and _is_up_to_date(label_path, img_mtime, gt_mtime)
+        if txt_up_to_date and not write_packed:
+            return 'skipped', None
+        if write_packed and previous is not None and (txt_up_to_date or not write_txt):
+            store, store_mtime = previous
+            name = os.path.splitext(frame_name)[0]
+            if store_mtime > img_mtime and name in store:
+                return 'skipped', (store.get(name), store.size_of(name))
+
+        # **自動讀取圖片寬度和高度** (只解析檔頭；影片的每張影格尺寸相同)
+        IMAGE_W, IMAGE_H = video_size if video_meta is not None else read_image_size(img_path)
+
+        packed = None
+        if write_packed:
+            xywhn = normalize_bboxes(bboxes, IMAGE_W, IMAGE_H)
+            labels = np.concatenate([np.full((len(xywhn), 1), CLASS_ID), xywhn], axis=1).astype(np.float32)
+            packed = (labels, (IMAGE_W, IMAGE_H))
+
+        if not write_txt:
+            return 'written', packed
+        if txt_up_to_date:
+            return 'skipped', packed
+
+        # 寫入 YOLO 標籤檔案
+        with open(label_path, 'w') as f:
+            f.write('\n'.join(convert_bboxes_to_yolo(bboxes, IMAGE_W, IMAGE_H)))
+        return 'written', packed
+    except Exception as e:
+        print(f"Error processing {frame_name}: {e}. Skipping conversion for this image.")
+        return 'error', None
+
+def main(gt_file, image_dir, yolo_labels_dir, num_workers=NUM_WORKERS, force=False, label_format=LABEL_FORMAT):
     # 創建標籤目錄
     os.makedirs(yolo_labels_dir, exist_ok=True)
 
-    # 1. 讀取 gt.txt 並分組標註
-    annotations = {}
+    # 1. 一次讀取 gt.txt 並依 frame 分組
     print(f"Reading {gt_file}...")
     try:
-        with open(gt_file, 'r') as f:
-            for line in f:
-                # 假設 gt.txt 中的數據是逗號分隔
-                try:
-                    # <frame>, <bb_left>, <bb_top>, <bb_width>, <bb_height>
-                    data = [float(x.strip()) for x in line.strip().split(',')]
-                    if len(data) != 5:
-                        print(f"Skipping malformed line: {line.strip()}")
-                        continue
-                        
-                    frame, bb_left, bb_top, bb_width, bb_height = data
-                    # 假設您的圖片命名格式是 8 位數字 (e.g., 00000001.jpg)
-                    frame_name = f"{int(frame):08d}.jpg" 
-
-                    # 將原始像素座標存儲起來，稍後再轉換
-                    if frame_name not in annotations:
-                        annotations[frame_name] = []
-                    annotations[frame_name].append((bb_left, bb_top, bb_width, bb_height))
-                    
-                except Exception as e:
-                    print(f"Skipping line due to error: {e}. Line: {line.strip()}")
-    except FileNotFoundError:
+        gt_mtime = os.path.getmtime(gt_file)
+        annotations = group_by_frame(load_gt(gt_file))
+    except (FileNotFoundError, OSError):
         print(f"Error: GT file not found at {gt_file}")
         return
 
-    # 2. 遍歷每個圖片，讀取尺寸並寫入 YOLO 標籤檔案
-    print("Processing images and converting annotations...")
-    for frame_name, bboxes in annotations.items():
-        img_path = os.path.join(image_dir, frame_name)
-        label_filename = frame_name.replace('.jpg', '.txt')
-        label_path = os.path.join(yolo_labels_dir, label_filename)
+    # image_dir 也可以是影片 (.mp4 / .avi)：影格尺寸與數量取自容器標頭，不需先拆成 JPEG
+    video_meta = None
+    if is_video(image_dir):
+        try:
+            frame_count, width, height, _ = video_info(image_dir)
+            # 標頭影格數常是估計值：gt.txt 有超出的影格時改以實際解碼數量為準，避免真實影格被當成缺少
+            last_frame = max((frame_number_of(name) for name in annotations), default=0)
+            if last_frame >= FIRST_FRAME_NUMBER + frame_count:
+                decoded_count = count_video_frames(image_dir)
+                if decoded_count != frame_count:
+                    print(f"Warning: {image_dir} decodes to {decoded_count} frames, header reports {frame_count}")
+                frame_count = decoded_count
+        except OSError as e:
+            print(f"Error: {e}")
+            return
+        video_meta = (frame_count, (width, height), os.path.getmtime(image_dir))
+        print(f"Video {image_dir}: {frame_count} frames of {width}x{height}")
 
-        if not os.path.exists(img_path):
-            # print(f"Warning: Image not found at {img_path}. Skipping.")
-            continue
+    # 已是最新的打包檔：未變動的 frame 沿用其中的標籤與尺寸
+    store_path = label_store_path(yolo_labels_dir)
+    previous = None
+    if label_format in ('packed', 'both') and not force:
+        previous = _load_previous_store(store_path, gt_mtime)
 
-        try:
-            # **自動讀取圖片寬度和高度**
-            with Image.open(img_path) as img:
-                IMAGE_W, IMAGE_H = img.size
-            
-            yolo_lines = []
-            for bb_left, bb_top, bb_width, bb_height in bboxes:
-                # 轉換並添加
-                yolo_line = convert_bbox_to_yolo(bb_left, bb_top, bb_width, bb_height, IMAGE_W, IMAGE_H)
-                yolo_lines.append(yolo_line)
-
-            # 寫入 YOLO 標籤檔案
-            with open(label_path, 'w') as f:
-                f.write('\n'.join(yolo_lines))
-                
-        except Exception as e:
-            print(f"Error processing {frame_name}: {e}. Skipping conversion for this image.")
-            
+    # 2. 以工作池平行讀取圖片尺寸並寫入 YOLO 標籤檔案；已是最新的標籤檔直接略過
+    print(f"Processing {len(annotations)} frames with {num_workers} workers (force={force}, format={label_format})...")
+    counts = Counter()
+    packed_names, packed_labels, packed_sizes = [], [], []
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        futures = [
+            (frame_name, pool.submit(_convert_frame, frame_name, bboxes, image_dir, yolo_labels_dir, gt_mtime, force, label_format, video_meta, previous))
+            for frame_name, bboxes in annotations.items()
+        ]
+        for frame_name, future in futures:
+            status, packed = future.result()
+            counts[status] += 1
+            if packed is not None:
+                packed_names.append(os.path.splitext(frame_name)[0])
+                packed_labels.append(packed[0])
+                packed_sizes.append(packed[1])
+
+    # 3. 打包格式：所有標籤存成單一檔案 (見 label_store.py)
+    #    沒有任何 frame 變動且 frame 集合相同時保留原檔，不重寫
+    if label_format in ('packed', 'both'):
+        if previous is not None and counts['written'] == 0 and packed_names == previous[0].names:
+            print(f"Packed label store {store_path} is up to date")
+        else:
+            LabelStore.from_arrays(packed_names, packed_labels, packed_sizes).save(store_path)
+            print(f"Packed {len(packed_names)} frames into {store_path}")
+    elif os.path.exists(store_path):
+        # 只寫 .txt 時移除舊的打包檔，避免切分與訓練優先讀到過期標籤
+        os.remove(store_path)
+        print(f"Removed stale packed label store {store_path}")
+
+    print(f"Written: {counts['written']}, up-to-date (skipped): {counts['skipped']}, "
+          f"missing image: {counts['missing']}, errors: {counts['error']}")
     print("\nData conversion complete. Labels are stored in the output directory.")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Convert raw bounding box annotations to YOLO format.")
     parser.add_argument('--gt-file', type=str, required=True, help="Path to the original gt.txt file.")
-    parser.add_argument('--image-dir', type=str, required=True, help="Path to the training image directory (e.g., data/train/img).")
+    parser.add_argument('--image-dir', type=str, required=True, help="Path to the training image directory (e.g., data/train/img) or the source video (.mp4 / .avi).")
     parser.add_argument('--output-labels-dir', type=str, default='yolo_labels', help="Directory to save the converted YOLO .txt label files.")
+    parser.add_argument('--num-workers', type=int, default=NUM_WORKERS, help="Number of worker threads for reading image sizes and writing labels.")
+    parser.add_argument('--force', action='store_true', help="Rewrite every label file even if it is newer than gt.txt and the image.")
+    parser.add_argument('--label-format', type=str, default=LABEL_FORMAT, choices=('txt', 'packed', 'both'), help="Write per-image .txt files, a single packed label store, or both.")
     
     args = parser.parse_args()
-    main(args.gt_file, args.image_dir, args.output_labels_dir)
+    main(args.gt_file, args.image_dir, args.output_labels_dir, args.num_workers, args.force, args.label_format)
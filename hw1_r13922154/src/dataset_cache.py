@@ -0,0 +1,314 @@
+import os
+import glob
+import math
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import ultralytics.data.build as ultralytics_build
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from image_io import imread_reduced
+from label_store import LabelStore, label_store_path
+
+# --- 設定區塊 (Config Block) ---
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+NUM_WORKERS = os.cpu_count() or 4  # 建立快取時的解碼執行緒數 (cv2 解碼時會釋放 GIL)
+REDUCED_DECODE = False             # JPEG 以 DCT 縮放直接解碼到接近 imgsz 再縮放 (image_io.imread_reduced)，長邊 >= 2 * imgsz 時才有效果
+# --- 設定區塊 ---
+
+# 快取由兩個檔案組成：
+#   <prefix>.bin  所有圖片 (已依 imgsz 縮放的 uint8 BGR) 依序串接的原始位元組，以 np.memmap 讀取
+#   <prefix>.npz  索引：每張圖片的 offset / 縮放後尺寸 / 原始尺寸 / mtime
+# 標籤不存入快取，訓練時一律由 get_labels 讀取 (打包檔 label_store.py，不存在或過期時讀取 .txt)
+
+
+def default_cache_prefix(img_path, imgsz):
+    """快取檔放在圖片資料夾 (或清單檔) 旁，e.g., yolo_dataset/images/train_memmap960"""
+    base = os.path.normpath(img_path)
+    if base.endswith('.txt'):
+        base = base[:-4]
+    return f"{base}_memmap{imgsz}"
+
+
+def list_image_files(img_path):
+    """與 Ultralytics 相同的圖片來源：資料夾 (遞迴) 或 .txt 圖片清單。"""
+    if os.path.isdir(img_path):
+        files = glob.glob(os.path.join(img_path, '**', '*.*'), recursive=True)
+    else:
+        parent = os.path.dirname(img_path) + os.sep
+        with open(img_path, 'r') as f:
+            lines = [x.strip() for x in f.read().strip().splitlines()]
+        files = [parent + x[2:] if x.startswith('./') else x for x in lines]
+    return sorted({f for f in files if f.lower().endswith(IMAGE_EXTENSIONS)})
+
+
+def label_path_for(image_path):
+    """與 Ultralytics 相同的規則：把路徑中最後一個 /images/ 換成 /labels/，副檔名改為 .txt。"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return sb.join(image_path.rsplit(sa, 1)).rsplit('.', 1)[0] + '.txt'
+
+
+def read_yolo_labels(label_path):
+    """讀取 YOLO 標籤檔為 (N, 5) float32 (cls, x_c, y_c, w, h)；檔案不存在時為空陣列。"""
+    if not os.path.exists(label_path):
+        return np.zeros((0, 5), dtype=np.float32)
+    with open(label_path, 'r') as f:
+        rows = [line.split() for line in f if line.strip()]
+    return np.array(rows, dtype=np.float32).reshape(-1, 5) if rows else np.zeros((0, 5), dtype=np.float32)
+
+
+def image_stem(image_path):
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+def label_store_is_stale(store_path, label_dir, image_files):
+    """
+    打包檔比標籤資料夾 (新增 / 刪除標籤檔)、任何一張圖片或任何一個 .txt 標籤檔 (原地修改，
+    或符號連結指向的來源標籤被修改) 舊時視為過期。只有打包格式、沒有 .txt 的圖片不檢查標籤檔。
+    """
+    store_mtime = os.stat(store_path).st_mtime_ns
+    if os.path.isdir(label_dir) and os.stat(label_dir).st_mtime_ns > store_mtime:
+        return True
+    for image_path in image_files:
+        try:
+            if os.stat(image_path).st_mtime_ns > store_mtime:
+                return True
+        except OSError:
+            return True
+        try:
+            if os.stat(label_path_for(image_path)).st_mtime_ns > store_mtime:
+                return True
+        except OSError:
+            pass
+    return False
+
+
+def load_label_store_for(image_files):
+    """找出這些圖片的標籤資料夾所對應的打包檔 (label_store.py)；不存在或已過期時回傳 None。"""
+    if not image_files:
+        return None
+    label_dir = os.path.dirname(label_path_for(image_files[0]))
+    store_path = label_store_path(label_dir)
+    if not os.path.exists(store_path):
+        return None
+    if label_store_is_stale(store_path, label_dir, image_files):
+        print(f"Packed label store {store_path} is older than its label folder or images, falling back to .txt labels")
+        return None
+    return LabelStore.load(store_path)
+
+
+def load_resized(image_path, imgsz, augment=True, reduced_decode=REDUCED_DECODE):
+    """
+    與 Ultralytics BaseDataset.load_image (rect_mode) 相同的縮放：長邊縮放到 imgsz，保持長寬比；
+    訓練 (augment) 或放大時使用 INTER_LINEAR，否則 INTER_AREA。
+    reduced_decode 時 JPEG 先以 DCT 縮放解碼到不小於目標的尺寸，輸出尺寸與 (h0, w0) 仍以原圖計算。
+    回傳 (縮放後影像, (h0, w0))；無法讀取時回傳 (None, None)。
+    """
+    if reduced_decode:
+        im, size0 = imread_reduced(image_path, imgsz)
+    else:
+        im = cv2.imread(image_path)
+        size0 = (im.shape[1], im.shape[0]) if im is not None else None
+    if im is None:
+        return None, None
+    w0, h0 = size0
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        interp = cv2.INTER_LINEAR if (augment or r > 1) else cv2.INTER_AREA
+        if im.shape[:2] != (h, w):
+            im = cv2.resize(im, (w, h), interpolation=interp)
+    return np.ascontiguousarray(im), (h0, w0)
+
+
+def build_dataset_cache(img_path, imgsz, prefix=None, num_workers=NUM_WORKERS, augment=True, reduced_decode=REDUCED_DECODE):
+    """
+    將 img_path 下所有圖片預先解碼、縮放並依序寫入單一 .bin 檔，索引寫入 .npz (標籤不在快取中，訓練時由 get_labels 讀取)。
+    回傳快取 prefix。
+    """
+    if prefix is None:
+        prefix = default_cache_prefix(img_path, imgsz)
+    image_files = list_image_files(img_path)
+    print(f"Building memmap cache for {len(image_files)} images (imgsz={imgsz}) -> {prefix}.bin")
+
+    keys, offsets, shapes, orig_shapes, mtimes = [], [], [], [], []
+    offset = 0
+    chunk = max(1, num_workers) * 4  # 分段提交，限制尚未寫出的已解碼影像數量
+    with open(prefix + '.bin', 'wb') as f, ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        for start in range(0, len(image_files), chunk):
+            paths = image_files[start:start + chunk]
+            for image_path, (im, hw0) in zip(paths, pool.map(lambda p: load_resized(p, imgsz, augment, reduced_decode), paths)):
+                if im is None:
+                    print(f"Warning: cannot read {image_path}. Skipping.")
+                    continue
+                f.write(im.tobytes())
+                keys.append(os.path.realpath(image_path))
+                offsets.append(offset)
+                shapes.append(im.shape[:2])
+                orig_shapes.append(hw0)
+                mtimes.append(os.stat(image_path).st_mtime_ns)
+                offset += im.nbytes
+
+    np.savez(
+        prefix + '.npz',
+        keys=np.array(keys, dtype=str),
+        offsets=np.array(offsets, dtype=np.int64),
+        shapes=np.array(shapes, dtype=np.int64).reshape(-1, 2),
+        orig_shapes=np.array(orig_shapes, dtype=np.int64).reshape(-1, 2),
+        mtimes=np.array(mtimes, dtype=np.int64),
+        imgsz=imgsz,
+        augment=augment,
+    )
+    print(f"Memmap cache complete: {len(keys)} images, {offset / 1e9:.2f} GB")
+    return prefix
+
+
+class DatasetCache:
+    """唯讀存取 build_dataset_cache 產生的快取；圖片以 np.memmap 取得，不需解碼。"""
+
+    def __init__(self, prefix):
+        with np.load(prefix + '.npz') as index:
+            self.keys = index['keys'].tolist()
+            self.offsets = index['offsets']
+            self.shapes = index['shapes']
+            self.orig_shapes = index['orig_shapes']
+            self.mtimes = index['mtimes']
+            self.imgsz = int(index['imgsz'])
+            self.augment = bool(index['augment'])
+        self.data = np.memmap(prefix + '.bin', dtype=np.uint8, mode='r') if self.keys else np.zeros(0, np.uint8)
+        self._row_of = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row_of(self, image_path):
+        """回傳圖片在快取中的列；不在快取中或圖片已被修改時回傳 -1。"""
+        row = self._row_of.get(os.path.realpath(image_path), -1)
+        if row >= 0:
+            try:
+                if os.stat(image_path).st_mtime_ns != self.mtimes[row]:
+                    return -1
+            except OSError:
+                return -1
+        return row
+
+    def image(self, row):
+        """回傳縮放後影像 (h, w, 3) 的唯讀 memmap 檢視。"""
+        h, w = self.shapes[row]
+        start = self.offsets[row]
+        return self.data[start:start + h * w * 3].reshape(h, w, 3)
+
+
+class PackedLabelYOLODataset(YOLODataset):
+    """
+    標籤資料夾有打包檔 (label_store.py) 時直接從中建立標籤，不再逐一開啟、解析 .txt 及驗證圖片；
+    打包檔缺少任何一張圖片時退回 Ultralytics 原本的流程。
+    """
+
+    def get_labels(self):
+        store = load_label_store_for(self.im_files)
+        if store is None:
+            return super().get_labels()
+        names = [image_stem(f) for f in self.im_files]
+        missing = sum(name not in store for name in names)
+        if missing:
+            print(f"{self.prefix}packed label store is missing {missing} images, falling back to .txt labels")
+            return super().get_labels()
+
+        self.label_files = [label_path_for(f) for f in self.im_files]
+        labels = []
+        for im_file, name in zip(self.im_files, names):
+            lb = store.get(name)
+            w, h = store.size_of(name)
+            labels.append(dict(
+                im_file=im_file,
+                shape=(h, w),
+                cls=lb[:, 0:1].copy(),
+                bboxes=lb[:, 1:].copy(),
+                segments=[],
+                keypoints=None,
+                normalized=True,
+                bbox_format='xywh',
+            ))
+        print(f"{self.prefix}loaded {len(labels)} labels from packed label store")
+        return labels
+
+
+class MemmapYOLODataset(PackedLabelYOLODataset):
+    """
+    從 memmap 快取讀取已縮放影像的 YOLODataset：訓練時不再解碼 JPG/PNG。
+    快取中沒有 (或已過期) 的圖片退回 Ultralytics 原本的讀取方式；快取不存在時會先建立。
+    """
+
+    def __init__(self, *args, img_path=None, imgsz=640, augment=True, **kwargs):
+        prefix = default_cache_prefix(img_path, imgsz)
+        if not os.path.exists(prefix + '.npz'):
+            build_dataset_cache(img_path, imgsz, prefix, augment=augment)
+        self.memmap_cache = DatasetCache(prefix)
+        super().__init__(*args, img_path=img_path, imgsz=imgsz, augment=augment, **kwargs)
+        self.memmap_rows = np.array([self.memmap_cache.row_of(f) for f in self.im_files], dtype=np.int64)
+        hits = int((self.memmap_rows >= 0).sum())
+        print(f"{self.prefix}memmap cache hits: {hits}/{len(self.im_files)}")
+
+    def load_image(self, i, rect_mode=True):
+        row = self.memmap_rows[i] if hasattr(self, 'memmap_rows') else -1
+        cache = self.memmap_cache
+        if row < 0 or not rect_mode or cache.imgsz != self.imgsz or cache.augment != self.augment:
+            return super().load_image(i, rect_mode)
+
+        # 增強會原地修改影像，因此複製一份 (從 page cache 複製遠比解碼便宜)
+        im = np.array(cache.image(row))
+        h0, w0 = cache.orig_shapes[row]
+
+        # 與 Ultralytics 相同：維護 mosaic 使用的 buffer，但不在 RAM 保留影像
+        if self.augment:
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, (int(h0), int(w0)), im.shape[:2]
+
+
+@contextmanager
+def _dataset_class(dataset_class):
+    """暫時將 build_yolo_dataset 使用的 YOLODataset 換成 dataset_class。"""
+    original = ultralytics_build.YOLODataset
+    ultralytics_build.YOLODataset = dataset_class
+    try:
+        yield
+    finally:
+        ultralytics_build.YOLODataset = original
+
+
+class PackedLabelDetectionTrainer(DetectionTrainer):
+    """使用打包標籤的 DetectionTrainer，以 model.train(trainer=PackedLabelDetectionTrainer) 啟用。"""
+
+    dataset_class = PackedLabelYOLODataset
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        # 交由 Ultralytics 的 build_yolo_dataset 建立 (cache / rect / stride / fraction 等設定與上游一致)，只換掉資料集類別
+        with _dataset_class(self.dataset_class):
+            return super().build_dataset(img_path, mode, batch)
+
+
+class MemmapDetectionTrainer(PackedLabelDetectionTrainer):
+    """使用 MemmapYOLODataset 的 DetectionTrainer，以 model.train(trainer=MemmapDetectionTrainer) 啟用。"""
+
+    dataset_class = MemmapYOLODataset
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-decode and resize a YOLO image folder into a memory-mapped cache.")
+    parser.add_argument('--img-path', type=str, required=True, help="Image folder or image list .txt (e.g., yolo_dataset/images/train).")
+    parser.add_argument('--imgsz', type=int, default=960, help="Training image size; must match the imgsz used by train.py.")
+    parser.add_argument('--num-workers', type=int, default=NUM_WORKERS, help="Number of decode threads.")
+    parser.add_argument('--val', action='store_true', help="Build a validation cache (INTER_AREA resizing, no augmentation).")
+    parser.add_argument('--reduced-decode', action=argparse.BooleanOptionalAction, default=REDUCED_DECODE, help="Decode JPEGs directly near --imgsz with DCT scaling before the final resize.")
+
+    args = parser.parse_args()
+    build_dataset_cache(args.img_path, args.imgsz, num_workers=args.num_workers, augment=not args.val,
+                        reduced_decode=args.reduced_decode)
@@ -0,0 +1,216 @@
+import time
+
+import numpy as np
+
+from backends import DEFAULT_BACKEND, model_forward, resolve_weights
+from box_ops import weighted_box_fusion
+from profiling import NULL_PROFILER
+
+# --- 設定區塊 (Config Block) ---
+WBF_IOU = 0.55  # 加權框融合 (WBF) 時同一物件的 IoU 門檻
+# --- 設定區塊 ---
+
+
+class EnsembleBoxes:
+    """與 Ultralytics Boxes 相容的最小介面：data 為 (N, 6) x1 y1 x2 y2 conf cls (原圖像素座標)。"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class EnsembleResult:
+    """
+    單張圖片的融合結果，提供 postprocess.boxes_to_numpy 與 profiling 需要的屬性：
+    boxes.data、orig_shape (h, w)、speed (ms，與 Ultralytics 相同的 preprocess / inference / postprocess)。
+    model_speed 為每個模型分攤到這張圖片的前向 + NMS 時間 (ms)。
+    """
+
+    def __init__(self, data, orig_shape, speed, model_speed, path=None):
+        self.boxes = EnsembleBoxes(data)
+        self.orig_shape = orig_shape
+        self.speed = speed
+        self.model_speed = model_speed
+        self.path = path
+
+
+class EnsembleModel:
+    """
+    多模型集成推論：N 個權重只載入一次，每個批次只解碼與 letterbox 一次，
+    同一個輸入張量依序交給每個模型前向 + NMS，再以加權框融合 (box_ops.weighted_box_fusion) 合併。
+    predict() 與 YOLO.predict 的常用參數相容 (source / stream / imgsz / conf / iou / augment / max_det / batch)，
+    因此可以直接取代 inference.py 中的 YOLO 模型。
+    每個模型的耗時與框數累計於 model_stats，結束時以 print_model_report() 印出，方便判斷哪個模型值得保留。
+    backend 選擇 eager PyTorch 或 best.pt 旁的 TorchScript / ONNX 匯出檔 (backends.py)。
+    """
+
+    def __init__(self, model_paths, device='cpu', weights=None, wbf_iou=WBF_IOU, profiler=NULL_PROFILER,
+                 backend=DEFAULT_BACKEND):
+        from ultralytics.nn.autobackend import AutoBackend
+        from ultralytics.utils.torch_utils import select_device
+
+        if weights is not None and len(weights) != len(model_paths):
+            raise ValueError(f'Got {len(weights)} ensemble weights for {len(model_paths)} models.')
+        # backend 為 torchscript / onnx 時載入 best.pt 旁的匯出檔 (backends.py)
+        self.model_paths = [resolve_weights(path, backend) for path in model_paths]
+        self.backend = backend
+        self.weights = [1.0] * len(model_paths) if weights is None else [float(w) for w in weights]
+        self.wbf_iou = wbf_iou
+        self.profiler = profiler
+        self.device = select_device(device, verbose=False)
+        self.models = []
+        for path in self.model_paths:
+            model = AutoBackend(model=path, device=self.device, fuse=True, verbose=False, end2end=False)
+            model.eval()
+            self.models.append(model)
+        # 所有模型共用同一個 letterbox：取最大的 stride，讓輸入尺寸對每個模型都合法
+        self.stride = max(int(max(m.stride)) if hasattr(m.stride, '__len__') else int(m.stride) for m in self.models)
+        self.names = self.models[0].names
+        for path, model in zip(self.model_paths[1:], self.models[1:]):
+            if model.names != self.names:
+                print(f'Warning: class names of {path} differ from {self.model_paths[0]}; fusing by class index.')
+        self.model_stats = [{'forward_s': 0.0, 'nms_s': 0.0, 'boxes': 0, 'images': 0} for _ in self.models]
+        self.fusion_s = 0.0
+
+    def __len__(self):
+        return len(self.models)
+
+    def predict(self, source, stream=False, imgsz=640, conf=None, iou=0.7, augment=False, max_det=300, batch=None,
+                verbose=False, **kwargs):
+        """
+        source 可為圖片路徑、BGR 陣列或兩者的列表。與 Ultralytics 相同：路徑列表預設每批 1 張，陣列列表一次處理。
+        device 等其他參數被忽略 (模型在建構時已放到指定裝置)。
+        """
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        if batch is None:
+            batch = 1 if sources and isinstance(sources[0], str) else max(1, len(sources))
+        conf = 0.25 if conf is None else conf  # Ultralytics predict 的預設值
+        results = self._iter_results(sources, batch, imgsz, conf, iou, augment, max_det)
+        return results if stream else list(results)
+
+    def _iter_results(self, sources, batch, imgsz, conf, iou, augment, max_det):
+        for i in range(0, len(sources), batch):
+            yield from self._predict_batch(sources[i:i + batch], imgsz, conf, iou, augment, max_det)
+
+    def _predict_batch(self, sources, imgsz, conf, iou, augment, max_det):
+        import torch
+        from ultralytics.data.augment import LetterBox
+        from ultralytics.utils import nms, ops
+        from ultralytics.utils.checks import check_imgsz
+        from ultralytics.utils.patches import imread
+
+        paths = [s if isinstance(s, str) else None for s in sources]
+        images = [imread(s) if isinstance(s, str) else s for s in sources]
+        for path, im in zip(paths, images):
+            if im is None:
+                raise FileNotFoundError(f'Image Not Found {path}')
+        n = len(images)
+
+        # 解碼後的前處理只做一次 (與 Ultralytics BasePredictor.pre_transform / preprocess 相同)
+        start = time.perf_counter()
+        shape = check_imgsz(imgsz, stride=self.stride, min_dim=2)
+        same_shapes = len({im.shape for im in images}) == 1
+        letterbox = LetterBox(shape, auto=same_shapes, stride=self.stride)
+        batch = np.stack([letterbox(image=im) for im in images])
+        tensor = torch.from_numpy(batch).to(self.device).permute(0, 3, 1, 2).flip(1).contiguous().float().div_(255)
+        preprocess_s = time.perf_counter() - start
+        self.profiler.record('letterbox', preprocess_s, start)
+
+        per_model = []  # 每個模型：每張圖片的 (K, 6) numpy 陣列
+        model_seconds = []
+        for k, model in enumerate(self.models):
+            stats = self.model_stats[k]
+            start = time.perf_counter()
+            with torch.inference_mode():
+                preds = model_forward(model, tensor, augment)
+                mid = time.perf_counter()
+                dets = nms.non_max_suppression(preds, conf, iou, None, False, max_det=max_det, nc=0,
+                                               end2end=getattr(model, 'end2end', False))
+                arrays = []
+                for det, im in zip(dets, images):
+                    det[:, :4] = ops.scale_boxes(tensor.shape[2:], det[:, :4], im.shape)
+                    arrays.append(det[:, :6].cpu().numpy().astype(np.float32))
+            end = time.perf_counter()
+            stats['forward_s'] += mid - start
+            stats['nms_s'] += end - mid
+            stats['boxes'] += sum(len(a) for a in arrays)
+            stats['images'] += n
+            self.profiler.record(f'model{k}', end - start, start)
+            per_model.append(arrays)
+            model_seconds.append(end - start)
+
+        start = time.perf_counter()
+        fused = [self._fuse([arrays[j] for arrays in per_model], max_det) for j in range(n)]
+        fusion_s = time.perf_counter() - start
+        self.fusion_s += fusion_s
+        self.profiler.record('fusion', fusion_s, start)
+
+        speed = {
+            'preprocess': preprocess_s * 1000 / n,
+            'inference': sum(model_seconds) * 1000 / n,
+            'postprocess': fusion_s * 1000 / n,
+        }
+        model_speed = [s * 1000 / n for s in model_seconds]
+        for path, im, data in zip(paths, images, fused):
+            yield EnsembleResult(data, im.shape[:2], dict(speed), model_speed, path)
+
+    def _fuse(self, arrays, max_det):
+        """合併同一張圖片在各模型的偵測結果；只有一個模型時直接回傳 (與單模型推論完全相同)。"""
+        if len(arrays) == 1:
+            return arrays[0]
+        data = np.concatenate(arrays)
+        if len(data) == 0:
+            return np.zeros((0, 6), dtype=np.float32)
+        box_weights = np.concatenate([np.full(len(a), w) for a, w in zip(arrays, self.weights)])
+        fused = weighted_box_fusion(data[:, :4], data[:, 4], data[:, 5], self.wbf_iou,
+                                    num_sources=len(arrays), weights=box_weights)
+        return fused[:max_det].astype(np.float32)
+
+    def model_report(self):
+        """每個模型的平均前向 / NMS 耗時 (ms/張) 與平均框數，以及融合耗時。"""
+        rows = []
+        for path, weight, stats in zip(self.model_paths, self.weights, self.model_stats):
+            images = max(stats['images'], 1)
+            rows.append({
+                'model': path,
+                'weight': weight,
+                'forward_ms_per_image': stats['forward_s'] * 1000 / images,
+                'nms_ms_per_image': stats['nms_s'] * 1000 / images,
+                'boxes_per_image': stats['boxes'] / images,
+            })
+        images = max(self.model_stats[0]['images'], 1) if self.model_stats else 1
+        return {'models': rows, 'fusion_ms_per_image': self.fusion_s * 1000 / images}
+
+    def print_model_report(self):
+        report = self.model_report()
+        total = sum(r['forward_ms_per_image'] + r['nms_ms_per_image'] for r in report['models']) or 1.0
+        print(f"\n--- Ensemble: per-model cost ({len(self.models)} models, WBF iou={self.wbf_iou}) ---")
+        print(f"{'#':>3} {'weight':>7} {'forward ms/img':>15} {'nms ms/img':>11} {'boxes/img':>10} {'share':>7}  model")
+        for k, r in enumerate(report['models']):
+            cost = r['forward_ms_per_image'] + r['nms_ms_per_image']
+            print(f"{k:>3} {r['weight']:>7g} {r['forward_ms_per_image']:>15.2f} {r['nms_ms_per_image']:>11.2f} "
+                  f"{r['boxes_per_image']:>10.1f} {cost / total:>7.1%}  {r['model']}")
+        print(f"WBF fusion: {report['fusion_ms_per_image']:.2f} ms/img")
+
+
+def fusion_params(model_paths, weights=None, wbf_iou=WBF_IOU):
+    """集成時影響結果的參數 (併入結果快取 / 原始偵測結果的參數)；單一模型時為空，與原本的鍵相同。"""
+    if len(model_paths) <= 1:
+        return {}
+    return dict(ensemble_weights=list(weights) if weights is not None else [1.0] * len(model_paths), wbf_iou=wbf_iou)
+
+
+def load_detector(model_paths, device, weights=None, wbf_iou=WBF_IOU, profiler=NULL_PROFILER, backend=DEFAULT_BACKEND):
+    """
+    單一權重且為 torch 後端時回傳原本的 YOLO 模型；多個權重或 torchscript / onnx 後端時回傳 EnsembleModel
+    (單一模型時即為共用前處理 / NMS 的一般推論，並在圖外支援 TTA)。兩者都以 .predict 推論。
+    """
+    if isinstance(model_paths, str):
+        model_paths = [model_paths]
+    if len(model_paths) == 1 and backend == DEFAULT_BACKEND:
+        from ultralytics import YOLO
+
+        return YOLO(model_paths[0]).to(device)
+    return EnsembleModel(model_paths, device, weights, wbf_iou, profiler, backend)
@@ -0,0 +1,250 @@
+import os
+import math
+import time
+import queue
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# --- 設定區塊 (Config Block) ---
+NUM_LOADER_WORKERS = os.cpu_count() or 4  # 解碼執行緒數 (PIL 解碼時會釋放 GIL)
+PREFETCH_BATCHES = 2                      # 佇列中最多預先準備好的批次數
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')       # 可用 DCT 縮放直接縮小解碼的格式
+# --- 設定區塊 ---
+
+_END_OF_STREAM = object()
+
+_EXIF_ORIENTATION = 0x0112
+_SWAPPED_ORIENTATIONS = (5, 6, 7, 8)  # 旋轉 90 / 270 度，寬高互換
+
+# JPEG 中帶有影像尺寸的 SOF 標記 (排除 DHT=C4, JPG=C8, DAC=CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(f):
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return width, height
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':  # 標記前可能有填充的 0xFF
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # 無長度欄位的標記
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_size(image_path):
+    """
+    只讀取檔頭取得圖片尺寸 (width, height)，不解碼像素。
+    支援 PNG / JPEG；其他格式或檔頭異常時退回 PIL (同樣只解析檔頭)。
+    """
+    with open(image_path, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        size = None
+        if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+            size = _png_size(f)
+        elif signature.startswith(b'\xff\xd8'):
+            size = _jpeg_size(f)
+    if size is not None:
+        return size
+    with Image.open(image_path) as img:
+        return img.size
+
+
+class ImageMetaCache:
+    """
+    每張圖片的尺寸 (width, height) 只取得一次，供反正規化與 CSV 輸出共用。
+    優先使用已登記的尺寸，其次為推論結果的 orig_shape，最後才讀取檔頭。
+    """
+
+    def __init__(self):
+        self._sizes = {}
+
+    def put(self, image_path, width, height):
+        self._sizes[image_path] = (int(width), int(height))
+
+    def get(self, image_path, result=None):
+        size = self._sizes.get(image_path)
+        if size is None:
+            orig_shape = getattr(result, 'orig_shape', None)
+            if orig_shape is not None:
+                size = (int(orig_shape[1]), int(orig_shape[0]))
+            else:
+                size = read_image_size(image_path)
+            self._sizes[image_path] = size
+        return size
+
+
+def exif_orientation(img):
+    return img.getexif().get(_EXIF_ORIENTATION, 1)
+
+
+def oriented_size(img):
+    """依 EXIF 轉正後的圖片尺寸 (w, h)；需在 draft 之前呼叫才是原圖尺寸。"""
+    width, height = img.size
+    return (height, width) if exif_orientation(img) in _SWAPPED_ORIENTATIONS else (width, height)
+
+
+def exif_transposed(img):
+    """
+    與 cv2.imread (Ultralytics 非串流路徑的讀圖方式) 相同，依 EXIF Orientation 轉正影像，
+    確保串流與非串流推論的框在同一個座標系；沒有旋轉時直接回傳原影像，不多複製一份。
+    """
+    return ImageOps.exif_transpose(img) if exif_orientation(img) != 1 else img
+
+
+def load_image_bgr(img_path):
+    """以 PIL 解碼圖片 (img_path 可為路徑或檔案物件)，依 EXIF 轉正後回傳 Ultralytics 預期的 BGR uint8 連續陣列 (H, W, 3)。"""
+    with Image.open(img_path) as img:
+        rgb = np.asarray(exif_transposed(img).convert('RGB'))
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+
+def reduction_factor(width, height, target_size):
+    """JPEG DCT 縮放可用的最大倍率 (1 / 2 / 4 / 8)，縮小後長邊仍不小於 target_size (letterbox 只會再縮小、不會放大)。"""
+    factor = 1
+    while factor < 8 and math.ceil(max(width, height) / (factor * 2)) >= target_size:
+        factor *= 2
+    return factor
+
+
+def load_image_bgr_reduced(img_path, target_size):
+    """
+    以 PIL draft (JPEG 的 DCT 縮放) 直接解碼到接近 target_size 的解析度 (長邊不小於 target_size)，
+    省下全解析度解碼與之後縮小的成本。回傳 (BGR 陣列, 原圖尺寸 (w, h))，兩者皆已依 EXIF 轉正；
+    非 JPEG 或原圖長邊不到 target_size 的兩倍時與 load_image_bgr 相同。
+    """
+    with Image.open(img_path) as img:
+        original_size = oriented_size(img)
+        width, height = img.size
+        r = target_size / max(width, height)
+        if r < 1:
+            # draft 選擇不小於要求尺寸的最大縮放倍率，其他格式則不做任何事
+            img.draft('RGB', (math.ceil(width * r), math.ceil(height * r)))
+        rgb = np.asarray(exif_transposed(img).convert('RGB'))
+    return np.ascontiguousarray(rgb[:, :, ::-1]), original_size
+
+
+def imread_reduced(image_path, target_size):
+    """
+    load_image_bgr_reduced 的 OpenCV 版本 (與 Ultralytics / cv2.imread 相同的解碼器)：
+    JPEG 以 IMREAD_REDUCED_COLOR_{2,4,8} (libjpeg 的 DCT 縮放) 解碼，原圖尺寸只讀檔頭。
+    回傳 (BGR 陣列, 原圖尺寸 (w, h))；無法讀取時回傳 (None, None)。
+    """
+    import cv2
+
+    factor, size = 1, None
+    if image_path.lower().endswith(JPEG_EXTENSIONS):
+        try:
+            size = read_image_size(image_path)
+            factor = reduction_factor(*size, target_size)
+        except Exception:
+            pass  # 檔頭異常時退回一般解碼
+    if factor == 1:
+        im = cv2.imread(image_path)
+        return (im, (im.shape[1], im.shape[0])) if im is not None else (None, None)
+    im = cv2.imread(image_path, getattr(cv2, f'IMREAD_REDUCED_COLOR_{factor}'))
+    if im is None:
+        return None, None
+    width, height = size
+    if (im.shape[1] > im.shape[0]) != (width > height) and width != height:
+        width, height = height, width  # cv2 依 EXIF 旋轉，檔頭的尺寸是旋轉前的
+    return im, (width, height)
+
+
+def _safe_load(img_path, decode_size=None, image_meta=None):
+    try:
+        if decode_size is None:
+            return load_image_bgr(img_path)
+        im, (width, height) = load_image_bgr_reduced(img_path, decode_size)
+        if image_meta is not None:
+            image_meta.put(img_path, width, height)
+        return im
+    except Exception as e:
+        print(f"Error decoding {os.path.basename(img_path)}: {e}")
+        return None
+
+
+def iter_prefetched_batches(image_paths, batch_size, num_workers=NUM_LOADER_WORKERS, prefetch=PREFETCH_BATCHES, profiler=None,
+                            decode_size=None, image_meta=None):
+    """
+    背景執行緒預先解碼下一批圖片，主執行緒以 generator 取用。
+    每次產出 (batch_paths, batch_images)；解碼失敗的圖片對應位置為 None。
+    佇列有界 (prefetch)，因此記憶體用量最多約為 (prefetch + 1) 個批次。
+    profiler (profiling.StageProfiler) 會記錄每張圖片的解碼時間 (decode) 與主執行緒等待批次的時間 (wait_batch)。
+    decode_size 不為 None 時以 load_image_bgr_reduced 縮小解碼，原圖尺寸登記於 image_meta (ImageMetaCache)。
+    """
+    batches = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item):
+        # 消費端提前結束時不要永久阻塞
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load(img_path):
+        if profiler is None:
+            return _safe_load(img_path, decode_size, image_meta)
+        with profiler.stage('decode'):
+            return _safe_load(img_path, decode_size, image_meta)
+
+    def producer():
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+                for i in range(0, len(image_paths), batch_size):
+                    batch_paths = image_paths[i:i + batch_size]
+                    batch_images = list(pool.map(load, batch_paths))
+                    if not put((batch_paths, batch_images)):
+                        return
+        except Exception as e:
+            put(e)
+            return
+        put(_END_OF_STREAM)
+
+    worker = threading.Thread(target=producer, name='image-prefetch', daemon=True)
+    worker.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            item = batches.get()
+            if profiler is not None:
+                profiler.record('wait_batch', time.perf_counter() - start, start)
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
@@ -1,10 +1,19 @@
 import os
+import argparse
+from types import SimpleNamespace
 import pandas as pd
-from ultralytics import YOLO
-from PIL import Image
 import warnings
-import torch
-import gc 
+
+from backends import BACKENDS, DEFAULT_BACKEND, resolve_weights
+from ensemble import WBF_IOU, fusion_params, load_detector
+from image_io import ImageMetaCache, iter_prefetched_batches, NUM_LOADER_WORKERS, PREFETCH_BATCHES
+from postprocess import boxes_to_numpy, build_prediction_string, rescale_boxes
+from profiling import NULL_PROFILER, StageProfiler, run_with_cprofile
+from result_cache import ResultCache, file_digest, file_digests
+from server import RemoteModel
+from temporal import DIFF_THRESHOLD, MAX_SKIP_INTERVAL, TemporalStats, iter_temporal_predictions
+from tta_cascade import CascadeStats, cascade_params, iter_cascade_predictions
+from video_io import FIRST_FRAME_NUMBER, frame_digests, frame_path, is_video, iter_video_batches, list_video_frames
 
 # 忽略不重要的 PyTorch/Ultralytics 警告
 # 修正：刪除不正確的語法 'warnings.filter sparingly'
@@ -29,6 +38,21 @@ BATCH_SIZE = 32
 # 5. *** 核心新增 ***: Test-Time Augmentation (TTA) 開關
 USE_TTA = True # 啟用 TTA (強烈推薦)
 
+# 6. 串流推論：背景執行緒預先解碼下一批，與目前批次的前向推論重疊
+USE_STREAMING = True
+
+# 7. 圖片尺寸快取：每張圖片只取得一次尺寸，反正規化與 CSV 輸出共用
+IMAGE_META = ImageMetaCache()
+
+# 8. 選擇性 TTA (tta_cascade.py)：先不做 TTA 推論，只有不確定的圖片 (中等信心框多、稀有類別、擁擠) 再以 TTA 重新推論
+TTA_CASCADE = False # 只在 USE_TTA = True 時有效
+
+# 9. 時間門控 (temporal.py)：測試集為連續影格，只對畫面有變化的關鍵影格執行偵測，其餘影格沿用 IoU 追蹤後的結果
+TEMPORAL_GATING = False
+
+# 10. 縮小解碼 (image_io.py)：JPEG 以 DCT 縮放 (PIL draft) 直接解碼到接近 IMG_SIZE 的解析度，偵測框再換回原圖座標
+REDUCED_DECODE = False # 需要串流模式 (啟用時強制串流)；影片輸入不適用
+
 # --- 輔助函數 (保持不變) ---
 
 def denormalize_to_kaggle_format(x_center_norm, y_center_norm, w_norm, h_norm, img_w, img_h):
@@ -53,18 +77,42 @@ def denormalize_to_kaggle_format(x_center_norm, y_center_norm, w_norm, h_norm, i
     
     return bb_left, bb_top, bb_width, bb_height
 
-def generate_prediction_string(results, img_path):
+def generate_prediction_string(results, img_path, image_meta=None):
     """
     處理 YOLOv11 推論結果，生成 Kaggle 要求的 PredictionString 格式。
     格式: <conf> <bb_left> <bb_top> <bb_width> <bb_height> <class> ...
+    圖片原始尺寸由 image_meta (ImageMetaCache) 提供，不再重新開啟圖片。
+    整組框一次搬到主機端後以 NumPy 向量化處理 (見 postprocess.py)。
+    """
+    return prediction_string_from_array(boxes_to_numpy(results.boxes), results.orig_shape, img_path, image_meta)
+
+def prediction_string_from_array(data, orig_shape, img_path, image_meta=None):
+    """generate_prediction_string 的陣列版本：data 為 (N, 6) x1 y1 x2 y2 conf cls，orig_shape 為推論時的 (h, w)。"""
+    if image_meta is None:
+        image_meta = IMAGE_META
+    try:
+        img_w, img_h = image_meta.get(img_path, SimpleNamespace(orig_shape=orig_shape))
+    except Exception as e:
+        print(f"Error reading image size for {os.path.basename(img_path)}: {e}")
+        return ""
+
+    return build_prediction_string(
+        data, orig_shape, img_w, img_h, CONFIDENCE_THRESHOLD, CLASS_ID_MAPPING
+    )
+
+def generate_prediction_string_per_box(results, img_path, image_meta=None):
+    """
+    逐框版本的 generate_prediction_string (原始實作)。
+    每個框各自呼叫 .item() / .tolist()，保留作為向量化版本的對照與基準測試用。
     """
     
     prediction_list = []
     
     # 獲取圖片原始尺寸，用於反正規化座標
+    if image_meta is None:
+        image_meta = IMAGE_META
     try:
-        with Image.open(img_path) as img:
-            img_w, img_h = img.size
+        img_w, img_h = image_meta.get(img_path, results)
     except Exception as e:
         print(f"Error reading image size for {os.path.basename(img_path)}: {e}")
         return ""
@@ -105,90 +153,296 @@ def extract_pure_id(filename):
     except ValueError:
         return base_name 
 
-def run_inference_and_export(best_model_path, test_image_dir, output_csv_file, inference_device):
-    if not os.path.exists(best_model_path):
-        print(f"錯誤: 模型權重未找到於 {best_model_path}")
+def inference_params():
+    """決定推論結果的參數 (結果快取的鍵之一；裝置與批次大小不影響結果，不列入)。"""
+    return dict(conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD, imgsz=IMG_SIZE, augment=USE_TTA)
+
+def image_sort_key(path):
+    """按照 Image ID 數字順序排序；檔名不是數字時依檔名排序。"""
+    try:
+        return int(os.path.splitext(os.path.basename(path))[0])
+    except ValueError:
+        return os.path.basename(path)
+
+def iter_predictions(model, image_paths, inference_device, streaming=USE_STREAMING, profiler=NULL_PROFILER, params=None,
+                     video=None, reduced_decode=False, video_extra_from=None):
+    """
+    逐張產出 (img_path, result)。
+    串流模式下由背景載入器解碼下一批圖片，模型以 stream=True 逐張回傳結果；
+    解碼失敗的圖片產出 (img_path, None)。
+    video 為影片路徑時 image_paths 為其影格的虛擬路徑 (video_io.py)，一律由背景執行緒依序解碼影片後串流推論；
+    影片中不存在的影格不會產出，video_extra_from 指定時另外產出該編號之後實際解得出的影格。
+    profiler 記錄模型呼叫 (predict) 的耗時，以及 Ultralytics 回報的 preprocess / forward / nms 時間。
+    params 可覆寫 inference_params() (例如 rescore.py 以極低門檻保存原始偵測結果)。
+    reduced_decode 時 (串流模式) 圖片縮小解碼到接近 imgsz，結果的框與 orig_shape 換回原圖尺寸。
+    """
+    predict_kwargs = dict(
+        verbose=False, 
+        device=inference_device, 
+        **(params or inference_params()) # conf / iou / imgsz / augment (TTA)
+    )
+    total_batches = (len(image_paths) + BATCH_SIZE - 1) // BATCH_SIZE
+    decode_size = predict_kwargs['imgsz'] if reduced_decode and video is None else None
+
+    if not streaming and video is None:
+        # 原始逐批路徑：由 Ultralytics 在主執行緒讀取圖片
+        for i in range(0, len(image_paths), BATCH_SIZE):
+            batch_paths = image_paths[i:i + BATCH_SIZE]
+            print(f"\n-> 正在推論批次 {i // BATCH_SIZE + 1}/{total_batches} ({len(batch_paths)} 張圖片)...")
+            # 非串流模式下 predict 也包含讀取與解碼圖片
+            with profiler.stage('predict'):
+                results = model.predict(source=batch_paths, stream=False, **predict_kwargs)
+            for img_path, result in zip(batch_paths, results):
+                profiler.record_ultralytics_speed(result)
+                yield img_path, result
         return
 
-    print(f"從 {best_model_path} 載入模型...")
-    model = YOLO(best_model_path).to(inference_device)
+    if video is not None:
+        batches = iter_video_batches(video, image_paths, BATCH_SIZE, PREFETCH_BATCHES, profiler if profiler.enabled else None,
+                                     video_extra_from)
+    else:
+        batches = iter_prefetched_batches(image_paths, BATCH_SIZE, NUM_LOADER_WORKERS, PREFETCH_BATCHES,
+                                          profiler if profiler.enabled else None, decode_size, IMAGE_META)
+    for batch_num, (batch_paths, batch_images) in enumerate(batches, start=1):
+        print(f"\n-> 正在推論批次 {batch_num}/{total_batches} ({len(batch_paths)} 張圖片)...")
+
+        decoded = [im for im in batch_images if im is not None]
+        # 傳入已解碼的陣列時 result.path 不再是原始路徑，因此以輸入順序對應
+        results = iter(model.predict(source=decoded, stream=True, **predict_kwargs)) if decoded else iter(())
+        for img_path, im in zip(batch_paths, batch_images):
+            if im is None:
+                yield img_path, None
+                continue
+            with profiler.stage('predict'):
+                result = next(results)
+            profiler.record_ultralytics_speed(result)
+            if decode_size is not None:
+                result = to_original_size(result, IMAGE_META.get(img_path, result))
+            yield img_path, result
+
+def to_original_size(result, original_size):
+    """縮小解碼的推論結果換回原圖座標 (框與 orig_shape)，結果快取、反正規化與 CSV 輸出因此不受影響。"""
+    h, w = result.orig_shape[:2]
+    if (w, h) == tuple(original_size):
+        return result
+    data = rescale_boxes(boxes_to_numpy(result.boxes), (w, h), original_size)
+    return SimpleNamespace(boxes=SimpleNamespace(data=data), orig_shape=(original_size[1], original_size[0]),
+                           speed=getattr(result, 'speed', {}))
+
+def run_inference_and_export(best_model_path, test_image_dir, output_csv_file, inference_device, streaming=USE_STREAMING,
+                             profile_report=None, chrome_trace=None, cache_dir=None, ensemble_weights=None, wbf_iou=WBF_IOU,
+                             backend=DEFAULT_BACKEND, server=None, tta_cascade=TTA_CASCADE, temporal=TEMPORAL_GATING,
+                             diff_threshold=DIFF_THRESHOLD, max_skip=MAX_SKIP_INTERVAL, reduced_decode=REDUCED_DECODE):
+    if server:
+        # 常駐推論服務 (server.py)：模型已在服務端載入，權重、後端與集成設定以服務回報的為準
+        try:
+            remote = RemoteModel(server)
+            health = remote.client.health()
+        except (OSError, RuntimeError) as e:
+            print(f"錯誤: 無法連線到推論服務 {server}: {e}")
+            return
+        model_paths = backend_paths = health['weights']
+        backend, fusion = health['backend'], health['fusion']
+        streaming = False  # 只送出圖片路徑，解碼在服務端進行
+    else:
+        # best_model_path 可為多個權重 (列表)：以 ensemble.py 集成推論，並以加權框融合合併各模型的結果
+        model_paths = [best_model_path] if isinstance(best_model_path, str) else list(best_model_path)
+        for model_path in model_paths:
+            if not os.path.exists(model_path):
+                print(f"錯誤: 模型權重未找到於 {model_path}")
+                return
+        # 推論後端 (backends.py)：torchscript / onnx 使用 best.pt 旁的匯出檔 (以 backends.py export 產生)
+        try:
+            backend_paths = [resolve_weights(model_path, backend) for model_path in model_paths]
+        except FileNotFoundError as e:
+            print(f"錯誤: {e}")
+            return
+        fusion = fusion_params(model_paths, ensemble_weights, wbf_iou)
+
+    # 各階段耗時 (見 profiling.py)；結束時印出摘要，並可另存 JSON 報告 / Chrome trace
+    profiler = StageProfiler()
     
-    if not os.path.isdir(test_image_dir):
+    # test_image_dir 也可以是影片 (.mp4 / .avi)：直接解碼影格推論，不需先拆成 JPEG
+    video = test_image_dir if is_video(test_image_dir) else None
+    if video is None and not os.path.isdir(test_image_dir):
         print(f"錯誤: 測試圖片目錄未找到於 {test_image_dir}")
         return
+    if video is not None:
+        streaming = True  # 影片一律由背景執行緒解碼後以陣列推論 (使用推論服務時亦同)
+        reduced_decode = False  # 影格由 OpenCV 解碼，沒有 DCT 縮放可用
+    elif reduced_decode:
+        streaming = True  # 縮小解碼在背景載入器中進行 (使用推論服務時改送出已解碼的陣列)
+    if video is not None and temporal:
+        print("錯誤: 時間門控 (--temporal) 需要逐張的圖片檔，目前不支援影片輸入。")
+        return
 
-    image_paths = [os.path.join(test_image_dir, f) 
-                   for f in os.listdir(test_image_dir) 
-                   if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    with profiler.stage('list_files'):
+        if video is not None:
+            try:
+                image_paths = list_video_frames(video)
+            except OSError as e:
+                print(f"錯誤: {e}")
+                return
+        else:
+            image_paths = [os.path.join(test_image_dir, f) 
+                           for f in os.listdir(test_image_dir) 
+                           if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
 
     if not image_paths:
         print("錯誤: 在測試目錄中未找到任何圖片。")
         return
+    header_frames = len(image_paths)  # 影片：標頭記錄的影格數 (可能只是估計值)
 
     # 按照 Image ID 數字順序排序
-    def sort_key(path):
-        try:
-            return int(os.path.splitext(os.path.basename(path))[0])
-        except ValueError:
-            return os.path.basename(path)
-
-    image_paths.sort(key=sort_key) 
+    image_paths.sort(key=image_sort_key) 
     
-    print(f"找到 {len(image_paths)} 張圖片。開始推論 (設備: {inference_device}, 尺寸: {IMG_SIZE}, TTA: {USE_TTA})...")
+    # 選擇性 TTA：只有第一輪 (無 TTA) 判定為不確定的圖片才以 TTA 重新推論
+    cascade = CascadeStats() if tta_cascade and USE_TTA else None
+    # 時間門控：只有關鍵影格執行偵測
+    temporal_stats = TemporalStats() if temporal else None
 
-    submission_data = []
-    total_images = len(image_paths)
-    total_batches = (total_images + BATCH_SIZE - 1) // BATCH_SIZE
+    # 結果快取 (result_cache.py)：以模型權重、推論參數與圖片內容為鍵，只推論新的或變動過的圖片
+    cache = None
+    pending_paths = image_paths
+    if cache_dir:
+        cache_params = dict(inference_params(), **fusion)
+        if cascade is not None:
+            cache_params.update(tta_cascade=cascade_params())
+        if reduced_decode:
+            cache_params.update(reduced_decode=True)
+        cache = ResultCache(cache_dir, backend_paths, cache_params)
+        with profiler.stage('hash_images'):
+            if video is not None:
+                video_digest = file_digest(video)
+                digests = dict(zip(image_paths, frame_digests(image_paths, video_digest)))
+                # 上次執行補上的、標頭影格數之後的影格已在快取中時一併列入
+                while True:
+                    path = frame_path(video, FIRST_FRAME_NUMBER + len(image_paths))
+                    digest = frame_digests([path], video_digest)[0]
+                    if digest not in cache:
+                        break
+                    image_paths.append(path)
+                    digests[path] = digest
+            else:
+                digests = dict(zip(image_paths, file_digests(image_paths, NUM_LOADER_WORKERS)))
+        pending_paths = [p for p in image_paths if digests[p] not in cache]
+        print(f"結果快取 {cache_dir}: {len(image_paths) - len(pending_paths)} 張已有結果，{len(pending_paths)} 張需要推論。")
 
-    # *** 手動分批迭代的核心邏輯 ***
-    for i in range(0, total_images, BATCH_SIZE):
-        
-        batch_paths = image_paths[i:i + BATCH_SIZE]
-        current_batch_num = i // BATCH_SIZE + 1
-        
-        print(f"\n-> 正在推論批次 {current_batch_num}/{total_batches} ({len(batch_paths)} 張圖片)...")
-
-        # 進行推論
-        results = model.predict(
-            source=batch_paths,           
-            conf=CONFIDENCE_THRESHOLD, 
-            iou=IOU_THRESHOLD,
-            imgsz=IMG_SIZE, 
-            stream=False,                 
-            verbose=False, 
-            device=inference_device, 
-            augment=USE_TTA # 應用 TTA
-        )
-        
-        # 處理結果並收集數據
-        for result in results:
-            img_filename = os.path.basename(result.path)
-            image_id_for_kaggle = extract_pure_id(img_filename)
-            prediction_string = generate_prediction_string(result, result.path)
-            
-            submission_data.append({
-                'Image_ID': image_id_for_kaggle, 
-                'PredictionString': prediction_string
-            })
-        
-        # 記憶體釋放
-        if 'cuda' in inference_device:
-            torch.cuda.empty_cache()
-        gc.collect() 
+    predictions = {}
+    model = None
+    if pending_paths:
+        if server:
+            print(f"使用推論服務 {server} ({', '.join(model_paths)})...")
+            model = remote
+        else:
+            print(f"從 {', '.join(model_paths)} 載入模型...")
+            with profiler.stage('load_model'):
+                model = load_detector(model_paths, inference_device, ensemble_weights, wbf_iou, profiler, backend)
+
+        tta = 'cascade' if cascade is not None else USE_TTA
+        print(f"找到 {len(pending_paths)} 張圖片。開始推論 (設備: {inference_device}, 尺寸: {IMG_SIZE}, TTA: {tta}, 串流: {streaming}, 縮小解碼: {reduced_decode}, 後端: {backend})...")
+        extra_from = FIRST_FRAME_NUMBER + len(image_paths) if video is not None else None
+
+        def run(paths, params):
+            # 影片只在第一次解碼時讀到結尾並產出標頭影格數之後的影格 (選擇性 TTA 的第二輪不重複產出)
+            nonlocal extra_from
+            frames_from, extra_from = extra_from, None
+            return iter_predictions(model, paths, inference_device, streaming, profiler, params, video,
+                                    reduced_decode, frames_from)
+
+        if cascade is not None:
+            plain_run = run
+            run = lambda paths, params: iter_cascade_predictions(plain_run, paths, params, cascade)
+        if temporal_stats is not None:
+            detections = iter_temporal_predictions(run, pending_paths, inference_params(), diff_threshold, max_skip,
+                                                   temporal_stats, profiler)
+        else:
+            detections = run(pending_paths, inference_params())
+        for img_path, result in detections:
+            with profiler.stage('postprocess'):
+                predictions[img_path] = generate_prediction_string(result, img_path) if result is not None else ""
+            # 每張圖片推論完立即寫入快取，中斷後重新執行只需處理剩下的圖片 (時間門控沿用的結果不寫入)
+            if cache is not None and result is not None and not getattr(result, 'propagated', False):
+                if img_path not in digests:  # 影片標頭影格數之後多出的影格
+                    digests[img_path] = frame_digests([img_path], video_digest)[0]
+                with profiler.stage('cache_write'):
+                    cache.put(digests[img_path], boxes_to_numpy(result.boxes), result.orig_shape)
+            profiler.add_images(1)
+
+    if video is not None:
+        # 依實際解碼結果補上標頭之外多出的影格，並移除影片中不存在的影格
+        extra = sorted(set(predictions) - set(image_paths), key=image_sort_key)
+        image_paths = [p for p in image_paths if p in predictions or (cache is not None and digests[p] in cache)] + extra
+        if len(image_paths) != header_frames:
+            print(f"警告: 影片實際解碼出 {len(image_paths)} 張影格，與標頭記錄的 {header_frames} 張不同，CSV 依實際影格輸出。")
+
+    # 依 Image ID 順序組合所有結果 (未重新推論的圖片由快取產生)
+    submission_data = []
+    for img_path in image_paths:
+        prediction_string = predictions.get(img_path)
+        if prediction_string is None:
+            with profiler.stage('cache_read'):
+                data, orig_shape = cache.get(digests[img_path])
+                prediction_string = prediction_string_from_array(data, orig_shape, img_path)
+        submission_data.append({
+            'Image_ID': extract_pure_id(os.path.basename(img_path)), 
+            'PredictionString': prediction_string
+        })
+    if cache is not None:
+        cache.close()
 
     # 創建 Pandas DataFrame 並輸出為 CSV
-    submission_df = pd.DataFrame(submission_data)
-    submission_df.to_csv(output_csv_file, index=False, sep=',')
+    with profiler.stage('write_csv'):
+        submission_df = pd.DataFrame(submission_data)
+        submission_df.to_csv(output_csv_file, index=False, sep=',')
+    profiler.finish()
     
     print("\n--- 推論和導出任務完成 ---")
     print(f"成功導出 {len(submission_data)} 筆結果到 {output_csv_file}")
 
+    profiler.print_report()
+    if hasattr(model, 'print_model_report'):
+        model.print_model_report()
+    if cascade is not None and cascade.images:
+        cascade.print_report()
+    if temporal_stats is not None and temporal_stats.frames:
+        temporal_stats.print_report()
+    if profile_report:
+        profiler.save_report(profile_report)
+    if chrome_trace:
+        profiler.save_chrome_trace(chrome_trace)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run inference and generate Kaggle submission file.")
-    parser.add_argument('--model-path', type=str, required=True, help="Path to the best model weights file (e.g., runs/yolo11/final/weights/best.pt).")
-    parser.add_argument('--test-image-dir', type=str, required=True, help="Path to the test image directory (e.g., data/test/img).")
+    parser.add_argument('--model-path', type=str, nargs='+', default=None, help="Path to the best model weights file (e.g., runs/yolo11/final/weights/best.pt); several paths run a WBF ensemble.")
+    parser.add_argument('--test-image-dir', type=str, required=True, help="Path to the test image directory (e.g., data/test/img) or a test video (.mp4 / .avi) decoded frame by frame.")
     parser.add_argument('--output-csv', type=str, default='submission_final.csv', help="Name of the output CSV file for Kaggle submission.")
     parser.add_argument('--device', type=str, default='0', help="GPU device ID (e.g., '0' or '0,1') or 'cpu'.")
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction, default=USE_STREAMING, help="Decode the next batch in a background loader while the current one runs.")
+    
+    parser.add_argument('--profile-report', type=str, default=None, help="Write per-stage latency percentiles, throughput and peak memory to this JSON file.")
+    parser.add_argument('--chrome-trace', type=str, default=None, help="Write a Chrome trace (chrome://tracing / Perfetto) of every stage to this JSON file.")
+    parser.add_argument('--cprofile', type=str, default=None, help="Run under cProfile and write the stats to this .prof file.")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Per-image result cache; re-runs only infer new or changed images (e.g., inference_cache).")
+    parser.add_argument('--ensemble-weights', type=float, nargs='+', default=None, help="Per-model fusion weights for an ensemble (default: all 1).")
+    parser.add_argument('--wbf-iou', type=float, default=WBF_IOU, help="IoU threshold for weighted box fusion of ensemble outputs.")
+    parser.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=BACKENDS, help="Inference backend; torchscript / onnx load the files written by 'src/backends.py export'.")
+    parser.add_argument('--tta-cascade', action=argparse.BooleanOptionalAction, default=TTA_CASCADE, help="Run without TTA first and re-run only uncertain images with TTA (see src/tta_cascade.py).")
+    parser.add_argument('--temporal', action=argparse.BooleanOptionalAction, default=TEMPORAL_GATING, help="Run the detector only on keyframes whose downsampled frame difference changed; reuse tracked detections elsewhere (see src/temporal.py).")
+    parser.add_argument('--diff-threshold', type=float, default=DIFF_THRESHOLD, help="Mean absolute thumbnail difference (0-255) that triggers a new detection in --temporal mode.")
+    parser.add_argument('--max-skip', type=int, default=MAX_SKIP_INTERVAL, help="Maximum consecutive frames that reuse detections in --temporal mode.")
+    parser.add_argument('--reduced-decode', action=argparse.BooleanOptionalAction, default=REDUCED_DECODE, help="Decode JPEGs directly near the inference size (IMG_SIZE) with DCT scaling (PIL draft); boxes are mapped back to the original size. Forces streaming.")
+    parser.add_argument('--server', type=str, default=None, help="Send images to a running src/server.py (e.g., http://127.0.0.1:8765 or unix:/tmp/yolo.sock) instead of loading the model.")
     
     args = parser.parse_args()
-    run_inference_and_export(args.model_path, args.test_image_dir, args.output_csv, args.device)
+    if not args.model_path and not args.server:
+        parser.error("one of --model-path or --server is required")
+    run = lambda: run_inference_and_export(args.model_path, args.test_image_dir, args.output_csv, args.device, args.stream,
+                                           args.profile_report, args.chrome_trace, args.cache_dir,
+                                           args.ensemble_weights, args.wbf_iou, args.backend, args.server,
+                                           args.tta_cascade, args.temporal, args.diff_threshold, args.max_skip,
+                                           args.reduced_decode)
+    if args.cprofile:
+        run_with_cprofile(run, args.cprofile)
+    else:
+        run()
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+def boxes_to_numpy(boxes):
+    """
+    將整個 Boxes 的 data (N, 6: x1 y1 x2 y2 conf cls) 一次搬到主機端。
+    取代逐框 .item() / .tolist()，整張圖片只做一次 device -> host 同步。
+    """
+    data = boxes.data
+    if hasattr(data, 'cpu'):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32)
+    return data.reshape(-1, data.shape[-1]) if data.size else np.zeros((0, 6), dtype=np.float32)
+
+
+def rescale_boxes(data, from_size, to_size):
+    """
+    將 (N, 6) 偵測結果的 xyxy 由縮小解碼後的影像尺寸 from_size (w, h) 換回原圖尺寸 to_size (w, h)。
+    尺寸相同時原樣回傳。
+    """
+    if tuple(from_size) == tuple(to_size) or len(data) == 0:
+        return data
+    data = data.copy()
+    data[:, [0, 2]] *= to_size[0] / from_size[0]
+    data[:, [1, 3]] *= to_size[1] / from_size[1]
+    return data
+
+
+def xyxy_to_xywhn(xyxy, img_w, img_h):
+    """與 Ultralytics Boxes.xywhn 相同的 float32 運算順序，確保結果逐位元一致。"""
+    xyxy = np.asarray(xyxy, dtype=np.float32)
+    xywhn = np.empty_like(xyxy)
+    xywhn[:, 0] = (xyxy[:, 0] + xyxy[:, 2]) / 2
+    xywhn[:, 1] = (xyxy[:, 1] + xyxy[:, 3]) / 2
+    xywhn[:, 2] = xyxy[:, 2] - xyxy[:, 0]
+    xywhn[:, 3] = xyxy[:, 3] - xyxy[:, 1]
+    xywhn[:, [0, 2]] /= img_w
+    xywhn[:, [1, 3]] /= img_h
+    return xywhn
+
+
+def map_class_ids(cls, class_id_mapping):
+    """以查表方式將 YOLO 類別轉為 Kaggle 類別；不在對應表中的類別為 -1。"""
+    cls = np.asarray(cls).astype(np.int64)
+    mapped = np.full(cls.shape, -1, dtype=np.int64)
+    for cls_id_yolo, cls_id_kaggle in class_id_mapping.items():
+        mapped[cls == cls_id_yolo] = cls_id_kaggle
+    return mapped
+
+
+def denormalize_to_kaggle_format_np(xywhn, img_w, img_h):
+    """
+    denormalize_to_kaggle_format 的向量化版本。
+    輸入 (N, 4) 正規化 (x_c, y_c, w, h)，回傳 (N, 4) int64 的 (bb_left, bb_top, bb_width, bb_height)。
+    """
+    xywh = np.asarray(xywhn, dtype=np.float64) * np.array([img_w, img_h, img_w, img_h], dtype=np.float64)
+    ltwh = np.empty_like(xywh)
+    ltwh[:, 0] = np.maximum(0, xywh[:, 0] - xywh[:, 2] / 2)
+    ltwh[:, 1] = np.maximum(0, xywh[:, 1] - xywh[:, 3] / 2)
+    ltwh[:, 2:] = xywh[:, 2:]
+    # astype 與 int() 相同，皆為向零截斷
+    return ltwh.astype(np.int64)
+
+
+def format_prediction_rows(conf, ltwh, cls_kaggle):
+    """格式: <conf> <bb_left> <bb_top> <bb_width> <bb_height> <class> ..."""
+    left, top, width, height = ltwh.T.tolist() if len(ltwh) else ([], [], [], [])
+    return " ".join(
+        f"{c:.4f} {l} {t} {w} {h} {k}"
+        for c, l, t, w, h, k in zip(conf.tolist(), left, top, width, height, cls_kaggle.tolist())
+    )
+
+
+def build_prediction_string(data, orig_shape, img_w, img_h, conf_threshold, class_id_mapping):
+    """
+    由 boxes_to_numpy 的輸出產生 PredictionString：
+    信心值過濾、類別對應、反正規化、截斷與字串格式化全部以陣列運算完成。
+    orig_shape 為推論時的 (h, w)，用於正規化；(img_w, img_h) 為圖片原始尺寸，用於反正規化。
+    """
+    if len(data) == 0:
+        return ""
+    conf = data[:, -2].astype(np.float64)
+    cls_kaggle = map_class_ids(data[:, -1], class_id_mapping)
+
+    keep = (conf >= conf_threshold) & (cls_kaggle != -1)
+    if not keep.any():
+        return ""
+
+    xywhn = xyxy_to_xywhn(data[keep, :4], orig_shape[1], orig_shape[0])
+    ltwh = denormalize_to_kaggle_format_np(xywhn, img_w, img_h)
+    return format_prediction_rows(conf[keep], ltwh, cls_kaggle[keep])
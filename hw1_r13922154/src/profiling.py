@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# 報告中的百分位數
+PERCENTILES = (50, 95, 99)
+
+
+class StageProfiler:
+    """
+    記錄推論流程各階段的耗時 (每次呼叫一筆)，彙整為 p50 / p95 / p99、影像吞吐量、峰值 RSS 與峰值顯示卡記憶體，
+    並可輸出 JSON 報告或 Chrome trace (chrome://tracing / Perfetto)。
+    可跨執行緒使用 (背景解碼執行緒也會記錄)；enabled=False 時所有方法皆不做事。
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.durations = {}   # stage -> [seconds, ...]
+        self.events = []      # (stage, start_s, duration_s, thread_id)
+        self.num_images = 0
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._end = None
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, start)
+
+    def record(self, name, seconds, start=None):
+        """記錄一筆耗時；start 為 time.perf_counter() 的起點 (None 時只計入統計，不出現在 trace)。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.durations.setdefault(name, []).append(seconds)
+            if start is not None:
+                self.events.append((name, start - self._t0, seconds, threading.get_ident()))
+
+    def record_ultralytics_speed(self, result):
+        """Ultralytics 每張圖片的 result.speed (ms)：preprocess / inference (前向) / postprocess (NMS)。"""
+        speed = getattr(result, 'speed', None) or {}
+        for key, name in (('preprocess', 'preprocess'), ('inference', 'forward'), ('postprocess', 'nms')):
+            if speed.get(key) is not None:
+                self.record(name, speed[key] / 1000.0)
+
+    def add_images(self, count):
+        self.num_images += count
+
+    def finish(self):
+        self._end = time.perf_counter()
+
+    def report(self):
+        wall = (self._end or time.perf_counter()) - self._t0
+        stages = {}
+        for name, values in self.durations.items():
+            values = np.asarray(values, dtype=np.float64) * 1000.0
+            stats = {'count': int(len(values)), 'total_ms': float(values.sum()), 'mean_ms': float(values.mean())}
+            for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats[f'p{p}_ms'] = float(v)
+            stages[name] = stats
+        return {
+            'wall_s': wall,
+            'images': self.num_images,
+            'images_per_s': self.num_images / wall if wall > 0 else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_device_mem_mb': peak_device_memory_mb(),
+            'stages': stages,
+        }
+
+    def print_report(self):
+        report = self.report()
+        print("\n--- Inference profile ---")
+        print(f"Images: {report['images']}, wall: {report['wall_s']:.2f}s, "
+              f"throughput: {report['images_per_s'] or 0:.2f} img/s")
+        print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB" + (
+            f", peak device memory: {report['peak_device_mem_mb']:.0f} MB" if report['peak_device_mem_mb'] is not None else ""))
+        print(f"{'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, s in sorted(report['stages'].items(), key=lambda kv: -kv[1]['total_ms']):
+            print(f"{name:<14}{s['count']:>8}{s['total_ms'] / 1000:>10.2f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+        return report
+
+    def save_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Profile report written to {path}")
+
+    def save_chrome_trace(self, path):
+        """輸出 Chrome trace event 格式 (complete events, 單位 µs)，可用 chrome://tracing 或 ui.perfetto.dev 開啟。"""
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': dur * 1e6, 'pid': pid, 'tid': tid}
+                for name, start, dur, tid in self.events
+            ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"Chrome trace written to {path} ({len(events)} events)")
+
+
+# 未啟用時使用的共用實例
+NULL_PROFILER = StageProfiler(enabled=False)
+
+
+def peak_rss_mb():
+    # Linux 的 ru_maxrss 單位為 KB (macOS 為 bytes)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def peak_device_memory_mb():
+    try:
+        import torch
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+    return sum(torch.cuda.max_memory_allocated(i) for i in range(torch.cuda.device_count())) / 2 ** 20
+
+
+def run_with_cprofile(fn, output_path, top=30):
+    """
+    以 cProfile 執行 fn()，統計寫入 output_path (.prof，可用 snakeviz / pstats 檢視) 並印出累計時間最高的函式。
+    需要取樣式分析時，直接以 py-spy 啟動原本的指令即可 (py-spy record -o profile.svg -- python src/inference.py ...)。
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn)
+    finally:
+        profiler.dump_stats(output_path)
+        print(f"\ncProfile stats written to {output_path}")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
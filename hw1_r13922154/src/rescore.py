@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import inference
+from box_ops import batched_nms
+from dataset_cache import list_image_files, label_path_for, load_label_store_for, read_yolo_labels, image_stem
+from backends import BACKENDS, DEFAULT_BACKEND
+from ensemble import WBF_IOU, fusion_params, load_detector
+from evaluate import match_image, summarize, IOU_THRESHOLDS
+from postprocess import boxes_to_numpy, build_prediction_string
+
+# --- 設定區塊 (Config Block) ---
+# 原始偵測結果只推論一次：以極低的 conf 與寬鬆的 NMS 保存所有候選框，之後任何 conf / iou / max_det 組合都在 CPU 上離線重算。
+# 離線結果只是直接推論的近似 (需 iou <= RAW_IOU、conf >= RAW_CONF)，不保證相同：
+#   1. 對 NMS(RAW_IOU) 的輸出再做 NMS(t) 不等於直接 NMS(t)。例如信心值 A > B > C、t=0.5、IoU(A,B)=0.52、IoU(B,C)=0.92、IoU(A,C)=0.48：
+#      直接 NMS 中 B 被 A 抑制，C 得以保留；兩階段時 C 已先被 B 抑制，而 B 之後又被 A 抑制，C 因此消失。
+#   2. RAW_MAX_DET 在第二次 NMS 之前就截斷候選框，被截掉的框在離線重算時無法復原。
+RAW_CONF = 0.001
+RAW_IOU = 0.9
+RAW_MAX_DET = 1000
+DEFAULT_CONFS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25]
+DEFAULT_IOUS = [0.5, 0.6, 0.7]
+DEFAULT_MAX_DETS = [300]
+# --- 設定區塊 ---
+
+# 原始偵測結果的打包格式 (與 label_store.py 相同的 offset / count 索引)：
+#   paths       (M,)     圖片路徑
+#   sizes       (M, 2)   圖片原始尺寸 (width, height)，用於反正規化
+#   orig_shapes (M, 2)   推論時的影像尺寸 (h, w)，偵測座標即位於此尺寸
+#   offsets / counts (M,)
+#   dets        (N, 6)   float32 x1 y1 x2 y2 conf cls，每張圖片內依 conf 由高到低
+#   params      推論參數 (JSON 字串)
+
+
+class DetectionStore:
+    def __init__(self, paths, sizes, orig_shapes, offsets, counts, dets, params):
+        self.paths = list(paths)
+        self.sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+        self.orig_shapes = np.asarray(orig_shapes, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.dets = np.asarray(dets, dtype=np.float32).reshape(-1, 6)
+        self.params = params
+
+    @classmethod
+    def from_arrays(cls, paths, det_arrays, sizes, orig_shapes, params):
+        counts = np.array([len(x) for x in det_arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64) if len(counts) else np.zeros(0, np.int64)
+        dets = np.concatenate(det_arrays) if det_arrays else np.zeros((0, 6), dtype=np.float32)
+        return cls(paths, sizes, orig_shapes, offsets, counts, dets, params)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['paths'].tolist(), data['sizes'], data['orig_shapes'], data['offsets'], data['counts'],
+                       data['dets'], json.loads(str(data['params'])))
+
+    def save(self, path):
+        # 先寫入暫存檔再改名，避免中斷時留下損壞的檔案
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            paths=np.array(self.paths, dtype=str),
+            sizes=self.sizes,
+            orig_shapes=self.orig_shapes,
+            offsets=self.offsets,
+            counts=self.counts,
+            dets=self.dets,
+            params=json.dumps(self.params),
+        )
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, i):
+        return self.dets[self.offsets[i]:self.offsets[i] + self.counts[i]]
+
+
+def raw_params():
+    return dict(inference.inference_params(), conf=RAW_CONF, iou=RAW_IOU, max_det=RAW_MAX_DET)
+
+
+def dump_raw_detections(model_path, image_source, output_path, inference_device, streaming=inference.USE_STREAMING,
+                        ensemble_weights=None, wbf_iou=WBF_IOU, backend=DEFAULT_BACKEND):
+    """
+    以極低門檻推論 image_source (資料夾或 .txt 圖片清單，e.g., yolo_dataset/val.txt) 並保存原始偵測結果。
+    model_path 為多個權重時保存集成 (WBF) 融合後的結果。
+    """
+    model_paths = [model_path] if isinstance(model_path, str) else list(model_path)
+    image_paths = sorted(list_image_files(image_source), key=inference.image_sort_key)
+    if not image_paths:
+        print(f"Error: no images found in {image_source}")
+        return None
+    params = raw_params()
+    print(f"Dumping raw detections for {len(image_paths)} images ({params})...")
+    model = load_detector(model_paths, inference_device, ensemble_weights, wbf_iou, backend=backend)
+    params.update(fusion_params(model_paths, ensemble_weights, wbf_iou))
+
+    det_arrays, sizes, orig_shapes = [], [], []
+    for img_path, result in inference.iter_predictions(model, image_paths, inference_device, streaming, params=params):
+        if result is None:
+            det_arrays.append(np.zeros((0, 6), dtype=np.float32))
+            sizes.append((0, 0))
+            orig_shapes.append((0, 0))
+            continue
+        data = boxes_to_numpy(result.boxes)
+        det_arrays.append(data[np.argsort(-data[:, 4], kind='stable')])
+        sizes.append(inference.IMAGE_META.get(img_path, result))
+        orig_shapes.append(result.orig_shape[:2])
+
+    store = DetectionStore.from_arrays(image_paths, det_arrays, sizes, orig_shapes, params)
+    store.save(output_path)
+    print(f"Saved {len(store.dets)} raw detections for {len(store)} images to {output_path}")
+    return store
+
+
+def nms_sorted(dets, iou_threshold):
+    """
+    類別感知 NMS，回傳依 conf 由高到低的保留框。
+    低分框不會抑制高分框，因此 conf 門檻與 NMS 可交換：每個 IoU 門檻只需做一次 NMS，
+    任何 conf 門檻 / max_det 的結果都是這個列表的前綴。
+    """
+    if len(dets) == 0:
+        return dets
+    return dets[batched_nms(dets[:, :4], dets[:, 4], dets[:, 5], iou_threshold)]
+
+
+def prefix_length(kept, conf_threshold, max_det):
+    return min(int(np.count_nonzero(kept[:, 4] >= conf_threshold)), max_det)
+
+
+def load_ground_truth(store):
+    """store 中每張圖片的 GT (M, 5) cls x1 y1 x2 y2，座標與偵測結果相同 (推論時的影像尺寸)。"""
+    label_store = load_label_store_for(store.paths)
+    gts = []
+    for i, path in enumerate(store.paths):
+        labels = label_store.get(image_stem(path)) if label_store is not None else None
+        if labels is None:
+            labels = read_yolo_labels(label_path_for(path))
+        h, w = store.orig_shapes[i]
+        xywh = labels[:, 1:].astype(np.float64) * np.array([w, h, w, h], dtype=np.float64)
+        gts.append(np.concatenate([labels[:, :1], xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1))
+    return gts
+
+
+def sweep(store, confs, ious, max_dets):
+    """對每個 (conf, iou, max_det) 組合計算 mAP50:95 / mAP50；每個 IoU 門檻的 NMS 與 GT 配對只做一次。"""
+    gts = load_ground_truth(store)
+    gt_cls = np.concatenate([gt[:, 0] for gt in gts]) if gts else np.zeros(0)
+    results = []
+    for iou in ious:
+        kept = [nms_sorted(store.get(i), iou) for i in range(len(store))]
+        tps = [match_image(k.astype(np.float64), gt) for k, gt in zip(kept, gts)]
+        for max_det in max_dets:
+            for conf in confs:
+                lengths = [prefix_length(k, conf, max_det) for k in kept]
+                metrics = summarize(
+                    np.concatenate([tp[:n] for tp, n in zip(tps, lengths)]) if tps else np.zeros((0, len(IOU_THRESHOLDS)), bool),
+                    np.concatenate([k[:n, 4] for k, n in zip(kept, lengths)]) if kept else np.zeros(0),
+                    np.concatenate([k[:n, 5] for k, n in zip(kept, lengths)]) if kept else np.zeros(0),
+                    gt_cls,
+                )
+                results.append({'conf': conf, 'iou': iou, 'max_det': max_det, 'detections': int(sum(lengths)),
+                                'map50_95': metrics['map50_95'], 'map50': metrics['map50']})
+    return results
+
+
+def print_sweep(results):
+    print(f"\n{'conf':>8}{'iou':>6}{'max_det':>9}{'dets':>10}{'mAP50:95':>10}{'mAP50':>8}")
+    for r in sorted(results, key=lambda r: -r['map50_95']):
+        print(f"{r['conf']:>8g}{r['iou']:>6g}{r['max_det']:>9}{r['detections']:>10}{r['map50_95']:>10.4f}{r['map50']:>8.4f}")
+
+
+def export_csv(store, conf_threshold, iou_threshold, max_det, output_csv_file):
+    """以指定門檻從原始偵測結果產生提交 CSV (格式與 inference.py 相同)。"""
+    submission_data = []
+    # dump 時已按照 Image ID 數字順序排序
+    for i in range(len(store)):
+        kept = nms_sorted(store.get(i), iou_threshold)
+        data = kept[:prefix_length(kept, conf_threshold, max_det)]
+        prediction_string = build_prediction_string(
+            data, store.orig_shapes[i], *store.sizes[i], conf_threshold, inference.CLASS_ID_MAPPING
+        )
+        submission_data.append({
+            'Image_ID': inference.extract_pure_id(os.path.basename(store.paths[i])),
+            'PredictionString': prediction_string
+        })
+    pd.DataFrame(submission_data).to_csv(output_csv_file, index=False, sep=',')
+    print(f"Exported {len(submission_data)} rows (conf={conf_threshold}, iou={iou_threshold}, max_det={max_det}) to {output_csv_file}")
+
+
+def check_thresholds(store, confs, ious):
+    raw = store.params
+    if min(confs) < raw['conf'] or max(ious) > raw['iou']:
+        print(f"Warning: raw detections were saved with conf={raw['conf']}, iou={raw['iou']}; "
+              f"lower conf / higher iou settings cannot recover boxes that were already dropped.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Store raw detections once, then re-score conf / iou / max_det offline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    dump = subparsers.add_parser('dump', help="Run inference once with very low thresholds and save the raw detections.")
+    dump.add_argument('--model-path', type=str, nargs='+', required=True, help="Path to the trained YOLO model weights; several paths store the WBF ensemble output.")
+    dump.add_argument('--source', type=str, required=True, help="Image directory or image list (e.g., yolo_dataset/val.txt).")
+    dump.add_argument('--output', type=str, required=True, help="Raw detection store to write (e.g., raw_val.npz).")
+    dump.add_argument('--device', type=str, default=inference.INFERENCE_DEVICE, help="Device to use for inference.")
+    dump.add_argument('--stream', action=argparse.BooleanOptionalAction, default=inference.USE_STREAMING, help="Use the background-loader inference path.")
+    dump.add_argument('--ensemble-weights', type=float, nargs='+', default=None, help="Per-model fusion weights for an ensemble.")
+    dump.add_argument('--wbf-iou', type=float, default=WBF_IOU, help="IoU threshold for weighted box fusion.")
+    dump.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=BACKENDS, help="Inference backend (see src/backends.py).")
+
+    sweep_parser = subparsers.add_parser('sweep', help="Report val mAP50:95 for every conf / iou / max_det combination.")
+    sweep_parser.add_argument('--raw', type=str, required=True, help="Raw detection store of a labelled split.")
+    sweep_parser.add_argument('--conf', type=float, nargs='+', default=DEFAULT_CONFS, help="Confidence thresholds.")
+    sweep_parser.add_argument('--iou', type=float, nargs='+', default=DEFAULT_IOUS, help="NMS IoU thresholds.")
+    sweep_parser.add_argument('--max-det', type=int, nargs='+', default=DEFAULT_MAX_DETS, help="Maximum detections per image.")
+    sweep_parser.add_argument('--output', type=str, default=None, help="Optional JSON file for the sweep results.")
+
+    export = subparsers.add_parser('export', help="Write a submission CSV from raw detections with the given thresholds.")
+    export.add_argument('--raw', type=str, required=True, help="Raw detection store of the test images.")
+    export.add_argument('--conf', type=float, default=inference.CONFIDENCE_THRESHOLD, help="Confidence threshold.")
+    export.add_argument('--iou', type=float, default=inference.IOU_THRESHOLD, help="NMS IoU threshold.")
+    export.add_argument('--max-det', type=int, default=300, help="Maximum detections per image.")
+    export.add_argument('--output-csv', type=str, default='submission_rescored.csv', help="Output CSV file.")
+
+    args = parser.parse_args()
+    if args.command == 'dump':
+        dump_raw_detections(args.model_path, args.source, args.output, args.device, args.stream,
+                            args.ensemble_weights, args.wbf_iou, args.backend)
+    elif args.command == 'sweep':
+        store = DetectionStore.load(args.raw)
+        check_thresholds(store, args.conf, args.iou)
+        start = time.perf_counter()
+        results = sweep(store, args.conf, args.iou, args.max_det)
+        print_sweep(results)
+        print(f"\n{len(results)} settings evaluated on {len(store)} images in {time.perf_counter() - start:.2f}s")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    else:
+        store = DetectionStore.load(args.raw)
+        check_thresholds(store, [args.conf], [args.iou])
+        export_csv(store, args.conf, args.iou, args.max_det, args.output_csv)
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 每張圖片的推論結果快取 (只附加寫入，中斷不會損壞已寫入的結果)：
+#   <cache_dir>/data.bin     float32 偵測結果 (N, 6: x1 y1 x2 y2 conf cls)，依序附加
+#   <cache_dir>/index.jsonl  每筆一行 {"key", "offset", "rows", "orig_shape"}；行完整寫入才算有效
+# key = hash(模型權重內容, 推論參數, 圖片內容)，因此換模型 / 改參數 / 圖片內容變動時自然失效。
+DATA_FILE = 'data.bin'
+INDEX_FILE = 'index.jsonl'
+ROW_SIZE = 6
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """檔案內容的 BLAKE2b 雜湊 (hex)。"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digests(paths, num_workers=8):
+    """平行計算多個檔案的雜湊 (hashlib 處理大區塊時會釋放 GIL)。"""
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        return list(pool.map(file_digest, paths))
+
+
+def params_digest(params):
+    return hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    以 (模型雜湊, 參數雜湊) 為命名空間、圖片內容雜湊為鍵的推論結果快取。
+    get / put 的 data 為 boxes_to_numpy 的輸出 (N, 6)，orig_shape 為推論時的 (h, w)。
+    """
+
+    def __init__(self, cache_dir, model_path, params):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_path = os.path.join(cache_dir, DATA_FILE)
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        # model_path 可為多個權重 (集成推論)；單一權重時的鍵與原本相同
+        model_paths = [model_path] if isinstance(model_path, str) else list(model_path)
+        self.namespace = hashlib.blake2b(
+            (''.join(file_digest(p) for p in model_paths) + params_digest(params)).encode(), digest_size=16
+        ).hexdigest()
+        self.entries = self._load_index()
+        self._data_file = open(self.data_path, 'ab')
+        self._index_file = open(self.index_path, 'a')
+
+    def _load_index(self):
+        entries = {}
+        if not os.path.exists(self.index_path):
+            return entries
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 中斷時寫到一半的最後一行
+                if entry['offset'] + entry['rows'] * ROW_SIZE * 4 <= data_size:
+                    entries[entry['key']] = entry
+        return entries
+
+    def key_for(self, image_digest):
+        return f"{self.namespace}:{image_digest}"
+
+    def __contains__(self, image_digest):
+        return self.key_for(image_digest) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, image_digest):
+        """回傳 (data, orig_shape)；不存在時回傳 None。"""
+        entry = self.entries.get(self.key_for(image_digest))
+        if entry is None:
+            return None
+        data = np.fromfile(self.data_path, dtype=np.float32, count=entry['rows'] * ROW_SIZE, offset=entry['offset'])
+        return data.reshape(-1, ROW_SIZE), tuple(entry['orig_shape'])
+
+    def put(self, image_digest, data, orig_shape):
+        """附加一張圖片的結果：先寫資料再寫索引行，兩者都 flush 後才算完成。"""
+        data = np.asarray(data, dtype=np.float32)
+        if len(data):
+            data = data[:, [0, 1, 2, 3, -2, -1]]  # x1 y1 x2 y2 conf cls (略過追蹤 id 等額外欄位)
+        data = np.ascontiguousarray(data.reshape(-1, ROW_SIZE))
+        offset = self._data_file.tell()
+        self._data_file.write(data.tobytes())
+        self._data_file.flush()
+        entry = {
+            'key': self.key_for(image_digest),
+            'offset': offset,
+            'rows': len(data),
+            'orig_shape': [int(orig_shape[0]), int(orig_shape[1])],
+        }
+        self._index_file.write(json.dumps(entry) + '\n')
+        self._index_file.flush()
+        self.entries[entry['key']] = entry
+
+    def close(self):
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,431 @@
+import io
+import os
+import json
+import time
+import queue
+import base64
+import socket
+import argparse
+import threading
+import http.client
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import numpy as np
+
+# --- 設定區塊 (Config Block) ---
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BATCH_SIZE = 16     # 一個微批次最多的圖片數
+MAX_WAIT_MS = 10.0      # 第一張圖片到達後最多等待多久湊批次 (毫秒)
+REQUEST_TIMEOUT = 600   # 客戶端等待回應的秒數
+# 客戶端可逐次覆寫的推論參數；參數不同的請求不會併入同一個批次
+REQUEST_PARAM_KEYS = ('conf', 'iou', 'imgsz', 'augment', 'max_det')
+# --- 設定區塊 ---
+
+# 常駐推論服務 (HTTP，TCP 或 Unix socket)：
+#   GET  /health   模型、後端、預設參數與微批次統計
+#   POST /predict  {"images": [{"path": ...} | {"image": <base64 編碼的圖檔>} | {"array": <base64 BGR uint8>, "shape": [h, w, 3]}],
+#                   "params": {conf / iou / imgsz / augment / max_det，可省略}}
+#               -> {"results": [{"orig_shape": [h, w], "boxes": [[x1, y1, x2, y2, conf, cls], ...],
+#                                "prediction_string": ..., "queue_ms": ..., "batch_ms": ..., "batch_size": ...}]}
+# 同時到達的請求 (可來自多個客戶端) 由 MicroBatcher 合併成一批推論；批次內依影像尺寸分組，
+# 每張圖片的 letterbox 與單獨推論時相同，因此結果不受同批其他圖片影響。
+
+
+_STOP = object()  # close() 放入佇列的結束標記
+
+
+def _fail_futures(entries, error):
+    for entry in entries:
+        if entry is not _STOP and not entry[2].done():
+            entry[2].set_exception(error)
+
+
+class MicroBatcher:
+    """
+    動態微批次：單一背景執行緒擁有模型，從佇列取出第一張圖片後最多等待 max_wait_ms，
+    湊到 max_batch_size 張 (同一組推論參數) 就執行 run_batch(key, items)，再把結果分別交回每個 Future。
+    參數不同的圖片留到下一批，維持先到先處理。
+    """
+
+    def __init__(self, run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {'images': 0, 'batches': 0, 'queue_s': 0.0, 'batch_s': 0.0, 'batch_sizes': {}}
+        self._worker = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, key, items):
+        """送出一組圖片 (同一組參數 key)，回傳對應的 Future 列表；close() 之後不再接受。"""
+        futures = []
+        now = time.perf_counter()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('micro-batcher is closed')
+            for item in items:
+                future = Future()
+                self._queue.put((key, item, future, now))
+                futures.append(future)
+        return futures
+
+    def close(self):
+        """停止接受新圖片；已送出的圖片 (含參數不同而延後的) 推論完後結束背景執行緒。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)  # 持有鎖時放入，確保之後佇列中不會再有圖片
+        self._worker.join()
+
+    def _loop(self):
+        carry = deque()  # 參數不同、留到下一批的圖片
+        batch = []
+        stopping = False  # 已收到 close()：不再等待新圖片，處理完 carry 後結束
+        try:
+            while carry or not stopping:
+                first = carry.popleft() if carry else self._queue.get()
+                if first is _STOP:
+                    stopping = True
+                    continue
+                batch = [first]
+                try:
+                    key = first[0]
+                    # 不用 deque.remove：圖片為陣列，tuple 比較會逐元素比較陣列
+                    rest = deque()
+                    for entry in carry:
+                        (batch if len(batch) < self.max_batch_size and entry[0] == key else rest).append(entry)
+                    carry = rest
+                    deadline = first[3] + self.max_wait
+                    while not stopping and len(batch) < self.max_batch_size:
+                        try:
+                            entry = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                        except queue.Empty:
+                            break
+                        if entry is _STOP:
+                            stopping = True
+                            break
+                        (batch if entry[0] == key else carry).append(entry)
+                    self._run(key, batch)
+                except Exception as e:
+                    # 任何錯誤只讓這一批失敗，背景執行緒繼續服務其他請求
+                    _fail_futures(batch, e)
+                batch = []
+        finally:
+            # 背景執行緒結束時，仍在等待的請求一律以錯誤結束，不讓呼叫端永久阻塞
+            pending = list(batch) + list(carry)
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            _fail_futures(pending, RuntimeError('micro-batcher stopped before running this image'))
+
+    def _run(self, key, batch):
+        start = time.perf_counter()
+        try:
+            outputs = self.run_batch(key, [item for _, item, _, _ in batch])
+        except Exception as e:
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        if len(outputs) != len(batch):
+            raise RuntimeError(f'run_batch returned {len(outputs)} outputs for {len(batch)} images')
+        batch_s = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats
+            stats['images'] += len(batch)
+            stats['batches'] += 1
+            stats['queue_s'] += sum(start - queued for _, _, _, queued in batch)
+            stats['batch_s'] += batch_s
+            stats['batch_sizes'][len(batch)] = stats['batch_sizes'].get(len(batch), 0) + 1
+        for (_, _, future, queued), output in zip(batch, outputs):
+            future.set_result(dict(output, queue_ms=(start - queued) * 1000, batch_ms=batch_s * 1000,
+                                   batch_size=len(batch)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, batch_sizes=dict(sorted(self._stats['batch_sizes'].items())))
+        batches, images = max(stats['batches'], 1), max(stats['images'], 1)
+        stats.update(mean_batch_size=stats['images'] / batches, mean_queue_ms=stats.pop('queue_s') * 1000 / images,
+                     mean_batch_ms=stats.pop('batch_s') * 1000 / batches)
+        return stats
+
+
+class InferenceService:
+    """常駐的模型 (YOLO 或 ensemble.EnsembleModel) 與微批次器；影像解碼與結果格式化在各請求的執行緒中平行進行。"""
+
+    def __init__(self, model, device, default_params, weights, fusion=None, backend='torch',
+                 max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.device = device
+        self.default_params = dict(default_params)
+        self.weights = list(weights)
+        self.fusion = fusion or {}
+        self.backend = backend
+        self.started = time.time()
+        self.batcher = MicroBatcher(self._run_batch, max_batch_size, max_wait_ms)
+
+    def params_key(self, params):
+        merged = dict(self.default_params)
+        merged.update({k: v for k, v in (params or {}).items() if k in REQUEST_PARAM_KEYS})
+        return json.dumps(merged, sort_keys=True)
+
+    def _run_batch(self, key, images):
+        params = json.loads(key)
+        outputs = [None] * len(images)
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        for indices in groups.values():
+            results = self.model.predict(source=[images[i] for i in indices], stream=False, verbose=False,
+                                         device=self.device, **params)
+            for i, result in zip(indices, results):
+                data = result.boxes.data
+                data = data.cpu().numpy() if hasattr(data, 'cpu') else np.asarray(data)
+                outputs[i] = {'data': np.asarray(data, dtype=np.float32).reshape(-1, 6),
+                              'orig_shape': [int(x) for x in result.orig_shape[:2]]}
+        return outputs
+
+    def predict(self, images, params=None):
+        futures = self.batcher.submit(self.params_key(params), images)
+        return [future.result() for future in futures]
+
+    def health(self):
+        return {'status': 'ok', 'weights': self.weights, 'backend': self.backend, 'fusion': self.fusion,
+                'device': str(self.device), 'params': self.default_params,
+                'max_batch_size': self.batcher.max_batch_size, 'max_wait_ms': self.batcher.max_wait * 1000,
+                'uptime_s': time.time() - self.started, 'stats': self.batcher.stats()}
+
+    def close(self):
+        self.batcher.close()
+
+
+def decode_request_image(item):
+    """請求中的一張圖片 -> BGR uint8 陣列 (與串流推論相同，以 PIL 解碼)。"""
+    from image_io import load_image_bgr
+
+    if 'path' in item:
+        return load_image_bgr(item['path'])
+    if 'image' in item:
+        return load_image_bgr(io.BytesIO(base64.b64decode(item['image'])))
+    if 'array' in item:
+        return np.frombuffer(base64.b64decode(item['array']), dtype=np.uint8).reshape(item['shape'])
+    raise ValueError("each image needs 'path', 'image' or 'array'")
+
+
+def format_result(output, name):
+    """由 (N, 6) 結果產生與 inference.py 相同的 PredictionString。"""
+    from image_io import ImageMetaCache
+    from inference import prediction_string_from_array
+
+    data, orig_shape = output['data'], output['orig_shape']
+    # 每次使用新的尺寸快取：圖片尺寸取自本次推論的 orig_shape，常駐期間檔案被替換也不會用到舊尺寸
+    prediction_string = prediction_string_from_array(data, orig_shape, name, ImageMetaCache())
+    return {'orig_shape': orig_shape, 'boxes': data.tolist(), 'prediction_string': prediction_string,
+            'queue_ms': output['queue_ms'], 'batch_ms': output['batch_ms'], 'batch_size': output['batch_size']}
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    service = None
+    verbose = False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/predict':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            items = request['images']
+            images = [decode_request_image(item) for item in items]
+        except Exception as e:
+            self._send_json(400, {'error': f'bad request: {e}'})
+            return
+        try:
+            outputs = self.service.predict(images, request.get('params'))
+            results = [format_result(output, item.get('path', f'image_{i}')) for i, (item, output) in
+                       enumerate(zip(items, outputs))]
+        except Exception as e:
+            self._send_json(500, {'error': f'inference failed: {e}'})
+            return
+        self._send_json(200, {'results': results})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+class UnixThreadingHTTPServer(ThreadingHTTPServer):
+    """在 Unix domain socket 上提供相同的 HTTP 介面 (只限本機，不佔用 TCP 埠)。"""
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)  # 上次未正常結束留下的 socket 檔
+        self.socket.bind(self.server_address)
+        self.server_name, self.server_port = 'localhost', 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('unix', 0)
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    handler = type('Handler', (InferenceRequestHandler,), {'service': service, 'verbose': verbose})
+    if unix_socket:
+        return UnixThreadingHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def warm_up(model, device, params):
+    """以一張空白圖片推論一次，讓第一個真正的請求不必付出初始化成本。"""
+    size = params.get('imgsz', 640)
+    model.predict(source=[np.zeros((size, size, 3), dtype=np.uint8)], stream=False, verbose=False, device=device, **params)
+
+
+def serve(model_paths, device='cpu', backend='torch', ensemble_weights=None, wbf_iou=None, host=DEFAULT_HOST,
+          port=DEFAULT_PORT, unix_socket=None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, verbose=False):
+    from backends import resolve_weights
+    from ensemble import WBF_IOU, fusion_params, load_detector
+    from inference import inference_params
+
+    wbf_iou = WBF_IOU if wbf_iou is None else wbf_iou
+    weights = [os.path.abspath(resolve_weights(path, backend)) for path in model_paths]
+    print(f"Loading {', '.join(weights)} (backend: {backend}, device: {device})...")
+    model = load_detector(model_paths, device, ensemble_weights, wbf_iou, backend=backend)
+    params = inference_params()
+    warm_up(model, device, params)
+    service = InferenceService(model, device, params, weights, fusion_params(model_paths, ensemble_weights, wbf_iou),
+                               backend, max_batch_size, max_wait_ms)
+    server = make_server(service, host, port, unix_socket, verbose)
+    address = f'unix:{unix_socket}' if unix_socket else f'http://{host}:{server.server_port}'
+    print(f"Serving on {address} (max batch {service.batcher.max_batch_size}, max wait {max_wait_ms} ms). Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=REQUEST_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """常駐推論服務的客戶端；address 為 'http://host:port' 或 'unix:/path/to.sock'。"""
+
+    def __init__(self, address, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.address.startswith('unix:'):
+            return _UnixHTTPConnection(self.address[len('unix:'):], self.timeout)
+        url = urlparse(self.address if '://' in self.address else f'http://{self.address}')
+        return http.client.HTTPConnection(url.hostname, url.port or DEFAULT_PORT, timeout=self.timeout)
+
+    def _request(self, method, path, payload=None):
+        conn = self._connection()
+        try:
+            body = json.dumps(payload).encode() if payload is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'{}')
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"Inference server error ({response.status}): {data.get('error')}")
+        return data
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def predict(self, images, params=None):
+        """images 為 /predict 的圖片項目列表 (見 image_item)；回傳每張圖片的結果 dict。"""
+        return self._request('POST', '/predict', {'images': images, 'params': params or {}})['results']
+
+
+def image_item(source):
+    """路徑送出絕對路徑 (由服務端讀檔解碼)，陣列以原始 BGR 位元組送出。"""
+    if isinstance(source, str):
+        return {'path': os.path.abspath(source)}
+    array = np.ascontiguousarray(source, dtype=np.uint8)
+    return {'array': base64.b64encode(array.tobytes()).decode('ascii'), 'shape': list(array.shape)}
+
+
+class RemoteModel:
+    """
+    以常駐推論服務取代本機模型：predict() 與 YOLO.predict 的常用參數相容，
+    回傳的結果提供 boxes.data / orig_shape / speed，inference.py 的既有流程不需修改即可使用。
+    """
+
+    def __init__(self, address, timeout=REQUEST_TIMEOUT):
+        self.client = InferenceClient(address, timeout)
+
+    def predict(self, source, stream=False, **kwargs):
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        params = {k: v for k, v in kwargs.items() if k in REQUEST_PARAM_KEYS}
+        start = time.perf_counter()
+        outputs = self.client.predict([image_item(s) for s in sources], params) if sources else []
+        round_trip_ms = (time.perf_counter() - start) * 1000 / max(len(sources), 1)
+        results = []
+        for s, output in zip(sources, outputs):
+            data = np.asarray(output['boxes'], dtype=np.float32).reshape(-1, 6)
+            speed = {'inference': output['batch_ms'] / output['batch_size'], 'round_trip': round_trip_ms}
+            results.append(SimpleNamespace(boxes=SimpleNamespace(data=data), orig_shape=tuple(output['orig_shape']),
+                                           speed=speed, path=s if isinstance(s, str) else None,
+                                           prediction_string=output['prediction_string']))
+        return iter(results) if stream else results
+
+
+if __name__ == '__main__':
+    from backends import BACKENDS, DEFAULT_BACKEND
+    from ensemble import WBF_IOU
+
+    parser = argparse.ArgumentParser(description="Long-lived inference server with dynamic micro-batching (HTTP or Unix socket).")
+    parser.add_argument('--model-path', type=str, nargs='+', required=True, help="Path(s) to the model weights; several paths run a WBF ensemble.")
+    parser.add_argument('--device', type=str, default='cpu', help="Device to keep the model on (e.g., 'cpu' or '0').")
+    parser.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=BACKENDS, help="Inference backend (see src/backends.py).")
+    parser.add_argument('--ensemble-weights', type=float, nargs='+', default=None, help="Per-model fusion weights for an ensemble.")
+    parser.add_argument('--wbf-iou', type=float, default=WBF_IOU, help="IoU threshold for weighted box fusion.")
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help="Host to bind.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="TCP port to bind.")
+    parser.add_argument('--unix-socket', type=str, default=None, help="Serve on this Unix socket path instead of TCP.")
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE, help="Maximum images per micro-batch.")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS, help="Maximum time to wait for a micro-batch to fill.")
+    parser.add_argument('--verbose', action='store_true', help="Log every HTTP request.")
+    args = parser.parse_args()
+    serve(args.model_path, args.device, args.backend, args.ensemble_weights, args.wbf_iou, args.host, args.port,
+          args.unix_socket, args.max_batch_size, args.max_wait_ms, args.verbose)
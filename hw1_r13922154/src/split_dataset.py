@@ -4,8 +4,88 @@ import random
 import argparse
 from sklearn.model_selection import train_test_split
 
-def split_and_move_files(source_image, source_label, target_root, split_ratio, seed):
-    """將圖片和對應標籤檔隨機分割並移動到 train/val 目錄"""
+from label_store import LabelStore, label_store_path
+
+# 分割結果的實體化方式：
+#   copy     - 複製檔案 (原始行為)
+#   hardlink - 建立硬連結，不佔額外空間；跨檔案系統時退回複製
+#   symlink  - 建立符號連結；不支援時退回複製
+#   manifest - 不複製任何檔案，只寫出 YOLO 可直接讀取的 train.txt / val.txt 清單
+SPLIT_MODES = ('copy', 'hardlink', 'symlink', 'manifest')
+
+def place_file(src, dst, mode):
+    """依 mode 將 src 放到 dst (複製 / 硬連結 / 符號連結)，連結失敗時退回複製。"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # 例如跨檔案系統 (EXDEV)，退回複製
+    elif mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    shutil.copy(src, dst)
+
+def link_directory(src_dir, link_path):
+    """建立指向 src_dir 的目錄符號連結 (已存在的舊連結會被取代)。"""
+    if os.path.islink(link_path):
+        os.remove(link_path)
+    elif os.path.exists(link_path):
+        raise FileExistsError(f"{link_path} already exists and is not a symlink")
+    os.symlink(os.path.abspath(src_dir), link_path, target_is_directory=True)
+
+def load_source_store(source_label):
+    """來源標籤資料夾若有打包檔 (label_store.py)，載入後用於標籤查詢與分割；否則回傳 None。"""
+    store_path = label_store_path(source_label)
+    if not os.path.exists(store_path):
+        return None
+    print(f"Using packed label store {store_path}")
+    return LabelStore.load(store_path)
+
+def has_label(source_label, label_name, store=None):
+    """優先查打包檔 (不需逐檔 stat)，否則檢查 .txt 是否存在。"""
+    if store is not None and os.path.splitext(label_name)[0] in store:
+        return True
+    return os.path.exists(os.path.join(source_label, label_name))
+
+def write_subset_store(store, file_list, label_dir):
+    """寫出該子集的打包標籤 (e.g., yolo_dataset/labels/train.labels.npz)，供訓練時直接載入。"""
+    subset = store.subset([os.path.splitext(f)[0] for f in file_list])
+    subset.save(label_store_path(label_dir))
+    print(f"Wrote packed labels for {len(subset)} images to {label_store_path(label_dir)}.")
+
+def write_manifest(source_image, source_label, target_root, train_files, val_files, store=None):
+    """
+    manifest 模式：不複製任何圖片或標籤。
+    target_root/images/all 與 target_root/labels/all 為指向原始資料夾的符號連結，
+    train.txt / val.txt 列出 images/all 下的圖片路徑；YOLO 會把路徑中的 /images/ 換成 /labels/ 找到標籤。
+    """
+    os.makedirs(os.path.join(target_root, 'images'), exist_ok=True)
+    os.makedirs(os.path.join(target_root, 'labels'), exist_ok=True)
+    image_link = os.path.join(target_root, 'images', 'all')
+    link_directory(source_image, image_link)
+    link_directory(source_label, os.path.join(target_root, 'labels', 'all'))
+
+    for subset, file_list in (('train', train_files), ('val', val_files)):
+        manifest_path = os.path.join(target_root, f'{subset}.txt')
+        count = 0
+        with open(manifest_path, 'w') as f:
+            for image_name in file_list:
+                label_name = image_name.replace('.jpg', '.txt')
+                if not has_label(source_label, label_name, store):
+                    print(f"Warning: Missing label for {image_name}. Skipping both files.")
+                    continue
+                f.write(os.path.abspath(os.path.join(image_link, image_name)) + '\n')
+                count += 1
+        print(f"Wrote {count} entries to {manifest_path}.")
+
+def split_and_move_files(source_image, source_label, target_root, split_ratio, seed, mode='copy'):
+    """將圖片和對應標籤檔隨機分割並移動到 train/val 目錄 (或只寫出清單，見 SPLIT_MODES)"""
 
     if not os.path.isdir(source_image):
         print(f"Error: Source image directory not found at {source_image}")
@@ -33,6 +113,13 @@ def split_and_move_files(source_image, source_label, target_root, split_ratio, s
     print(f"Training set size: {len(train_files)}")
     print(f"Validation set size: {len(val_files)}")
 
+    store = load_source_store(source_label)
+
+    if mode == 'manifest':
+        write_manifest(source_image, source_label, target_root, train_files, val_files, store)
+        print("\nManifest split complete! Point the data yaml's train/val at train.txt / val.txt.")
+        return
+
     # 設置目標目錄
     target_dirs = {
         'train': {
@@ -62,20 +149,21 @@ def split_and_move_files(source_image, source_label, target_root, split_ratio, s
             src_lbl_path = os.path.join(source_label, label_name)
             dst_lbl_path = os.path.join(target_dirs[subset]['label'], label_name)
             
-            # 檢查標籤檔是否存在
-            if not os.path.exists(src_lbl_path):
+            # 檢查標籤檔是否存在 (打包檔或 .txt)
+            if not has_label(source_label, label_name, store):
                 print(f"Warning: Missing label for {image_name}. Skipping both files.")
                 continue
 
-            # 複製檔案（使用 copy 確保原始檔案保留）
+            # 複製或連結檔案（原始檔案皆保留）；只有打包標籤時不放置 .txt
             try:
-                shutil.copy(src_img_path, dst_img_path)
-                shutil.copy(src_lbl_path, dst_lbl_path)
+                place_file(src_img_path, dst_img_path, mode)
+                if os.path.exists(src_lbl_path):
+                    place_file(src_lbl_path, dst_lbl_path, mode)
                 count += 1
             except FileNotFoundError as e:
                 print(f"Error: {e}. Skipping file.")
         
-        print(f"Successfully moved/copied {count} file pairs to {subset}.")
+        print(f"Successfully placed {count} file pairs to {subset} (mode: {mode}).")
 
     print("\nMoving/Copying Training files...")
     move_files(train_files, 'train')
@@ -83,6 +171,13 @@ def split_and_move_files(source_image, source_label, target_root, split_ratio, s
     print("\nMoving/Copying Validation files...")
     move_files(val_files, 'val')
 
+    for subset, file_list in (('train', train_files), ('val', val_files)):
+        if store is not None:
+            write_subset_store(store, file_list, target_dirs[subset]['label'])
+        elif os.path.exists(label_store_path(target_dirs[subset]['label'])):
+            # 沒有來源打包檔時移除舊的子集打包檔，避免訓練讀到過期標籤
+            os.remove(label_store_path(target_dirs[subset]['label']))
+
     print("\nDataset split and organization complete!")
 
 if __name__ == '__main__':
@@ -92,6 +187,7 @@ if __name__ == '__main__':
     parser.add_argument('--target-root-dir', type=str, default='yolo_dataset', help="Root directory for the output train/val structure.")
     parser.add_argument('--split-ratio', type=float, default=0.20, help="Validation set proportion (e.g., 0.20 for 20%%).")
     parser.add_argument('--random-seed', type=int, default=42, help="Random seed for reproducible splitting.")
+    parser.add_argument('--mode', type=str, default='copy', choices=SPLIT_MODES, help="How to materialise the split: copy, hardlink, symlink, or manifest (train.txt/val.txt only).")
     
     args = parser.parse_args()
     
@@ -100,5 +196,6 @@ if __name__ == '__main__':
         args.source_label_dir, 
         args.target_root_dir, 
         args.split_ratio, 
-        args.random_seed
+        args.random_seed,
+        args.mode
     )
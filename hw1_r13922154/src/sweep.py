@@ -0,0 +1,298 @@
+import os
+import json
+import math
+import time
+import fcntl
+import random
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+# --- 設定區塊 (Config Block) ---
+# 預設搜尋空間：list = 從中選一個；dict 的 type 為 uniform / loguniform / int (low, high)
+DEFAULT_SEARCH_SPACE = {
+    'lr0': {'type': 'loguniform', 'low': 1e-4, 'high': 2e-3},
+    'box': {'type': 'uniform', 'low': 5.0, 'high': 12.0},
+    'iou': [0.5, 0.6, 0.7],
+    'mosaic': [0.0, 0.5, 1.0],
+    'imgsz': [640, 800, 960],
+}
+NUM_TRIALS = 16
+MIN_EPOCHS = 5          # 第一個 rung：每個 trial 至少訓練的 epoch 數
+MAX_EPOCHS = 60         # 單一 trial 的完整訓練長度 (取代 HYPERPARAMETERS['epochs'])
+REDUCTION_FACTOR = 3    # ASHA 的 eta：每個 rung 只有前 1/eta 的 trial 能繼續
+METRIC = 'metrics/mAP50-95(B)'
+RANDOM_SEED = 0
+# --- 設定區塊 ---
+
+
+# ---------- 搜尋空間 ----------
+
+def sample_params(space, rng):
+    params = {}
+    for key, spec in space.items():
+        if isinstance(spec, list):
+            params[key] = rng.choice(spec)
+        elif spec['type'] == 'uniform':
+            params[key] = rng.uniform(spec['low'], spec['high'])
+        elif spec['type'] == 'loguniform':
+            params[key] = math.exp(rng.uniform(math.log(spec['low']), math.log(spec['high'])))
+        elif spec['type'] == 'int':
+            params[key] = rng.randint(spec['low'], spec['high'])
+        else:
+            raise ValueError(f"Unknown search space type for {key}: {spec['type']}")
+    return params
+
+
+def load_search_space(path):
+    if path is None:
+        return DEFAULT_SEARCH_SPACE
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)  # JSON 也是合法的 YAML
+
+
+# ---------- ASHA ----------
+
+def rung_milestones(min_epochs, max_epochs, eta):
+    """ASHA 的 rung：min_epochs * eta^k (小於 max_epochs)，e.g., 5, 15, 45。"""
+    milestones = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        milestones.append(epochs)
+        epochs *= eta
+    return milestones
+
+
+def asha_should_continue(rung_metrics, metric, eta):
+    """
+    非同步 successive halving (Li et al., 2020) 的停止規則：
+    trial 到達某個 rung 時，若其指標不在該 rung 已回報結果的前 1/eta，即提前終止。
+    回報數少於 eta 時資訊不足，一律繼續。
+    """
+    if len(rung_metrics) < eta:
+        return True
+    k = max(1, len(rung_metrics) // eta)
+    cutoff = sorted(rung_metrics, reverse=True)[k - 1]
+    return metric >= cutoff
+
+
+# ---------- 狀態檔 (跨行程共用，亦用於中斷後續跑) ----------
+
+@contextmanager
+def locked_state(state_path):
+    """以檔案鎖讀取並寫回 sweep 狀態 (JSON)；區塊內對 state 的修改會在離開時存檔。"""
+    with open(state_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            yield state
+            tmp_path = state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, state_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def init_state(state_path, space, num_trials, min_epochs, max_epochs, eta, metric, seed):
+    """
+    建立或續用 sweep 狀態。已存在時沿用其設定；中斷時仍在執行的 trial 改回 pending (之後由 last.pt 續訓)。
+    num_trials 大於現有 trial 數時補上新的 trial (每個 trial 的參數由 seed 與編號決定，可重現)。
+    """
+    if not os.path.exists(state_path):
+        state = {
+            'config': {'space': space, 'min_epochs': min_epochs, 'max_epochs': max_epochs,
+                       'eta': eta, 'metric': metric, 'seed': seed},
+            'trials': [],
+        }
+        with open(state_path, 'w') as f:
+            json.dump(state, f, indent=2)
+
+    with locked_state(state_path) as state:
+        config = state['config']
+        for trial in state['trials']:
+            if trial['status'] == 'running':
+                trial['status'] = 'pending'
+        for trial_id in range(len(state['trials']), num_trials):
+            rng = random.Random(f"{config['seed']}-{trial_id}")
+            state['trials'].append({
+                'id': trial_id,
+                'name': f"trial_{trial_id:03d}",
+                'params': sample_params(config['space'], rng),
+                'status': 'pending',
+                'rungs': {},
+                'best': None,
+                'epochs_done': 0,
+                'save_dir': None,
+            })
+        return config
+
+
+def claim_next_trial(state_path, device):
+    with locked_state(state_path) as state:
+        for trial in state['trials']:
+            if trial['status'] == 'pending':
+                trial['status'] = 'running'
+                trial['device'] = device
+                return dict(trial)
+    return None
+
+
+def report_epoch(state_path, trial_id, epoch, metric_value):
+    """記錄一個 epoch 的驗證指標；到達 rung 時依 ASHA 規則決定是否繼續。回傳 False 表示應停止。"""
+    with locked_state(state_path) as state:
+        config = state['config']
+        trial = state['trials'][trial_id]
+        trial['epochs_done'] = epoch
+        trial['best'] = metric_value if trial['best'] is None else max(trial['best'], metric_value)
+        if epoch not in rung_milestones(config['min_epochs'], config['max_epochs'], config['eta']):
+            return True
+        trial['rungs'][str(epoch)] = metric_value
+        rung_metrics = [t['rungs'][str(epoch)] for t in state['trials'] if str(epoch) in t['rungs']]
+        keep = asha_should_continue(rung_metrics, metric_value, config['eta'])
+        if not keep:
+            trial['status'] = 'stopped'
+        return keep
+
+
+def finish_trial(state_path, trial_id, status=None, save_dir=None):
+    with locked_state(state_path) as state:
+        trial = state['trials'][trial_id]
+        if status is not None:
+            trial['status'] = status
+        elif trial['status'] == 'running':
+            trial['status'] = 'completed'
+        if save_dir is not None:
+            trial['save_dir'] = save_dir
+
+
+# ---------- 訓練 ----------
+
+def run_trial(trial, config, state_path, data_yaml, pretrained_pt, project, device, memmap_cache):
+    """
+    以 train.py 的設定 (HYPERPARAMETERS + trial 的參數) 訓練一個 trial。
+    每個 epoch 結束時回報驗證指標；被 ASHA 淘汰時設定 trainer.stop，Ultralytics 會在該 epoch 後結束。
+    有 last.pt 時 (中斷後續跑) 以 resume=True 接續。
+    """
+    from ultralytics import YOLO
+    from train import HYPERPARAMETERS, MODEL_CONFIG, load_backbone_weights_only
+    from dataset_cache import MemmapDetectionTrainer, PackedLabelDetectionTrainer
+
+    def on_fit_epoch_end(trainer):
+        value = float(trainer.metrics.get(config['metric'], 0.0))
+        if not report_epoch(state_path, trial['id'], trainer.epoch + 1, value):
+            print(f"[{trial['name']}] stopped by ASHA at epoch {trainer.epoch + 1} ({config['metric']}={value:.4f})")
+            trainer.stop = True
+
+    save_dir = os.path.join(project, trial['name'])
+    last_pt = os.path.join(save_dir, 'weights', 'last.pt')
+    trainer_cls = MemmapDetectionTrainer if memmap_cache else PackedLabelDetectionTrainer
+
+    if os.path.exists(last_pt):
+        print(f"[{trial['name']}] resuming from {last_pt}")
+        model = YOLO(last_pt)
+        model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+        model.train(resume=True, trainer=trainer_cls)
+    else:
+        model = YOLO(MODEL_CONFIG)
+        load_backbone_weights_only(model, pretrained_pt)
+        model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+        hyperparameters = {**HYPERPARAMETERS, **trial['params'], 'epochs': config['max_epochs']}
+        model.train(
+            data=data_yaml,
+            project=project,
+            name=trial['name'],
+            exist_ok=True,
+            device=device,
+            trainer=trainer_cls,
+            **hyperparameters
+        )
+    return save_dir
+
+
+def worker_loop(state_path, device, data_yaml, pretrained_pt, project, memmap_cache):
+    """單一裝置上的工作行程：反覆領取 pending 的 trial 並訓練，直到沒有剩餘的 trial。"""
+    with open(state_path, 'r') as f:
+        config = json.load(f)['config']
+    done = 0
+    while True:
+        trial = claim_next_trial(state_path, device)
+        if trial is None:
+            return done
+        print(f"[{trial['name']}] start on device {device}: {trial['params']}")
+        try:
+            save_dir = run_trial(trial, config, state_path, data_yaml, pretrained_pt, project, device, memmap_cache)
+            finish_trial(state_path, trial['id'], save_dir=save_dir)
+        except Exception as e:
+            print(f"[{trial['name']}] failed: {e}")
+            finish_trial(state_path, trial['id'], status='failed')
+        done += 1
+
+
+def print_leaderboard(state_path, top=10):
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+    metric = state['config']['metric']
+    trials = sorted(state['trials'], key=lambda t: -1 if t['best'] is None else t['best'], reverse=True)
+    print(f"\n--- Sweep leaderboard ({metric}) ---")
+    for t in trials[:top]:
+        best = 'n/a' if t['best'] is None else f"{t['best']:.4f}"
+        print(f"{t['name']}  {t['status']:<10} epochs={t['epochs_done']:<4} best={best}  {t['params']}")
+    return trials[0] if trials else None
+
+
+def run_sweep(data_yaml, pretrained_pt, project, devices, space, num_trials=NUM_TRIALS, min_epochs=MIN_EPOCHS,
+              max_epochs=MAX_EPOCHS, eta=REDUCTION_FACTOR, metric=METRIC, seed=RANDOM_SEED, memmap_cache=False):
+    """在 devices 上 (每個裝置一個工作行程) 執行 ASHA sweep；狀態存於 project/sweep_state.json，可中斷後續跑。"""
+    os.makedirs(project, exist_ok=True)
+    state_path = os.path.join(project, 'sweep_state.json')
+    config = init_state(state_path, space, num_trials, min_epochs, max_epochs, eta, metric, seed)
+    print(f"Sweep state: {state_path}")
+    print(f"Rungs (epochs): {rung_milestones(config['min_epochs'], config['max_epochs'], config['eta'])}, "
+          f"max epochs: {config['max_epochs']}, eta: {config['eta']}, workers: {devices}")
+
+    start = time.time()
+    # spawn：每個工作行程各自初始化 CUDA
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(devices), mp_context=context) as pool:
+        futures = [
+            pool.submit(worker_loop, state_path, device, data_yaml, pretrained_pt, project, memmap_cache)
+            for device in devices
+        ]
+        finished = sum(f.result() for f in futures)
+    print(f"\nSweep finished {finished} trials in {(time.time() - start) / 3600:.2f} h.")
+
+    best = print_leaderboard(state_path)
+    if best is not None and best['best'] is not None:
+        best_path = os.path.join(project, 'best_params.json')
+        with open(best_path, 'w') as f:
+            json.dump(best['params'], f, indent=2)
+        print(f"Best parameters written to {best_path}")
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ASHA hyperparameter sweep over train.py's HYPERPARAMETERS (resumable).")
+    parser.add_argument('--data-yaml', type=str, required=True, help="Path to the YOLO data configuration YAML file (e.g., pigs.yaml).")
+    parser.add_argument('--pretrained-pt', type=str, default='yolo11x.pt', help="Path to the YOLOv11x pretrained weights file.")
+    parser.add_argument('--project', type=str, default='runs/sweep', help="Sweep directory (trial runs and sweep_state.json).")
+    parser.add_argument('--devices', type=str, default='0', help="Comma-separated devices, one worker each (e.g., '0,1' or 'cpu').")
+    parser.add_argument('--workers-per-device', type=int, default=1, help="Concurrent trials per device (e.g., several CPU workers).")
+    parser.add_argument('--search-space', type=str, default=None, help="YAML/JSON search space; defaults to DEFAULT_SEARCH_SPACE.")
+    parser.add_argument('--num-trials', type=int, default=NUM_TRIALS, help="Total number of trials (raise it to extend a finished sweep).")
+    parser.add_argument('--min-epochs', type=int, default=MIN_EPOCHS, help="Epochs before the first ASHA rung.")
+    parser.add_argument('--max-epochs', type=int, default=MAX_EPOCHS, help="Epochs for a trial that is never stopped.")
+    parser.add_argument('--eta', type=int, default=REDUCTION_FACTOR, help="ASHA reduction factor.")
+    parser.add_argument('--metric', type=str, default=METRIC, help="Validation metric reported by Ultralytics to maximize.")
+    parser.add_argument('--seed', type=int, default=RANDOM_SEED, help="Seed for sampling trial parameters.")
+    parser.add_argument('--memmap-cache', action='store_true', help="Train from a pre-resized memory-mapped image cache.")
+
+    args = parser.parse_args()
+    devices = [d.strip() for d in args.devices.split(',') if d.strip()] * max(1, args.workers_per_device)
+    run_sweep(args.data_yaml, args.pretrained_pt, os.path.abspath(args.project), devices,
+              load_search_space(args.search_space), args.num_trials, args.min_epochs, args.max_epochs,
+              args.eta, args.metric, args.seed, args.memmap_cache)
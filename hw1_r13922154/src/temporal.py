@@ -0,0 +1,187 @@
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from box_ops import box_iou
+from image_io import NUM_LOADER_WORKERS, exif_transposed, oriented_size
+from postprocess import boxes_to_numpy
+
+# --- 設定區塊 (Config Block) ---
+# 時間門控：只有關鍵影格執行偵測，與上一個關鍵影格幾乎相同的影格沿用 (追蹤後的) 偵測結果
+DIFF_SIZE = 64            # 計算影格差異的灰階縮圖邊長 (JPEG 以 draft 模式直接縮小解碼)
+DIFF_THRESHOLD = 3.0      # 縮圖平均絕對差 (0-255) 超過此值視為畫面有變化，重新偵測
+MAX_SKIP_INTERVAL = 5     # 連續沿用結果的影格數上限，超過即強制重新偵測
+TRACK_IOU = 0.3           # 相鄰關鍵影格間以 IoU 配對同一隻豬的門檻
+# --- 設定區塊 ---
+
+
+def frame_index(img_path):
+    """影格編號 (檔名 00000123.jpg -> 123)；不是數字時為 None (不視為連續影格)。"""
+    try:
+        return int(os.path.splitext(os.path.basename(img_path))[0])
+    except ValueError:
+        return None
+
+
+def frame_thumbnail(img_path, size=DIFF_SIZE):
+    """
+    回傳 (原圖尺寸 (w, h), size x size 的灰階 float32 縮圖)；JPEG 以 draft 模式只解碼約 1/8 解析度。
+    與推論時的解碼相同，依 EXIF 轉正 (尺寸為轉正後的寬高)。
+    """
+    with Image.open(img_path) as img:
+        original_size = oriented_size(img)
+        img.draft('L', (size, size))
+        thumb = exif_transposed(img).convert('L').resize((size, size), Image.BILINEAR)
+    return original_size, np.asarray(thumb, dtype=np.float32)
+
+
+def _safe_thumbnail(img_path):
+    try:
+        return frame_thumbnail(img_path)
+    except Exception as e:
+        print(f"Error decoding {os.path.basename(img_path)}: {e}")
+        return None
+
+
+def select_keyframes(image_paths, thumbnails, threshold=DIFF_THRESHOLD, max_skip=MAX_SKIP_INTERVAL):
+    """
+    依序決定每個影格是否為關鍵影格，回傳 (keyframe_of, reasons)：
+    keyframe_of[i] 為影格 i 沿用結果的關鍵影格索引 (關鍵影格為自己)，reasons[i] 為成為關鍵影格的原因或 None。
+    差異分數與「上一個關鍵影格」比較，緩慢的累積變化也會觸發重新偵測。
+    """
+    keyframe_of, reasons = [], []
+    key = None
+    for i, (path, thumb) in enumerate(zip(image_paths, thumbnails)):
+        reason = None
+        if key is None or thumb is None or thumbnails[key] is None:
+            reason = 'first'
+        elif frame_index(path) is None or frame_index(path) != frame_index(image_paths[i - 1]) + 1:
+            reason = 'gap'
+        elif thumb[0] != thumbnails[key][0]:
+            reason = 'size'
+        elif i - key > max_skip:
+            reason = 'max_skip'
+        elif np.abs(thumb[1] - thumbnails[key][1]).mean() > threshold:
+            reason = 'changed'
+        if reason is not None:
+            key = i
+        keyframe_of.append(key)
+        reasons.append(reason)
+    return keyframe_of, reasons
+
+
+def match_boxes(a, b, iou_threshold=TRACK_IOU):
+    """同類別、IoU 最大者優先的一對一貪婪配對 (IoU 追蹤器)；回傳 [(i, j), ...] 與 a 中未配對的索引。"""
+    if len(a) == 0 or len(b) == 0:
+        return [], np.arange(len(a))
+    iou = box_iou(a[:, :4], b[:, :4])
+    iou[a[:, 5][:, None] != b[:, 5][None, :]] = 0.0
+    pairs = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        pairs.append((int(i), int(j)))
+        iou[i, :] = -1.0
+        iou[:, j] = -1.0
+    matched = {i for i, _ in pairs}
+    return pairs, np.array([i for i in range(len(a)) if i not in matched], dtype=np.int64)
+
+
+def propagate_detections(prev, nxt, alpha, iou_threshold=TRACK_IOU):
+    """
+    兩個關鍵影格之間的影格 (alpha 為相對位置，0-1)：配對到的框以線性內插移動座標與信心值；
+    prev 中未配對的框原樣保留 (中間影格與 prev 幾乎相同)，只出現在 nxt 的框不加入。
+    nxt 為 None (之後沒有關鍵影格) 時直接沿用 prev。
+    """
+    if nxt is None or len(prev) == 0:
+        return prev.copy()
+    pairs, _ = match_boxes(prev, nxt, iou_threshold)
+    out = prev.copy()
+    if pairs:
+        ia = np.array([i for i, _ in pairs])
+        ib = np.array([j for _, j in pairs])
+        out[ia, :5] = prev[ia, :5] + alpha * (nxt[ib, :5] - prev[ia, :5])
+    return out
+
+
+class TemporalStats:
+    """影格數、關鍵影格數 (依原因) 與沿用結果的影格數；差異分數的耗時記錄於 profiler 的 frame_diff。"""
+
+    def __init__(self):
+        self.frames = 0
+        self.keyframes = Counter()
+        self.reused = 0
+
+    def print_report(self):
+        keyframes = sum(self.keyframes.values())
+        reasons = ', '.join(f'{k}: {v}' for k, v in sorted(self.keyframes.items())) or '-'
+        print("\n--- Temporal frame-difference gating ---")
+        print(f"frames: {self.frames}, detector runs: {keyframes} ({reasons}), "
+              f"reused: {self.reused} ({self.reused / max(self.frames, 1):.1%} of frames skipped)")
+
+
+def iter_temporal_predictions(run, image_paths, params, threshold=DIFF_THRESHOLD, max_skip=MAX_SKIP_INTERVAL,
+                              stats=None, profiler=None, num_workers=NUM_LOADER_WORKERS):
+    """
+    時間門控推論：image_paths 需依影格順序排列；run(paths, params) 產出 (img_path, result)
+    (inference.iter_predictions，或再包一層選擇性 TTA)，只對關鍵影格呼叫。
+    其他影格在下一個關鍵影格的結果出來後，以 IoU 追蹤內插產生結果 (提供 boxes.data / orig_shape，
+    propagated=True；結果取決於相鄰影格而非圖片內容本身，因此不寫入以內容為鍵的結果快取)。
+    產出 (img_path, result)，順序不一定與輸入相同；解碼失敗的影格產出 (img_path, None)。
+    """
+    stats = TemporalStats() if stats is None else stats
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        if profiler is not None:
+            with profiler.stage('frame_diff'):
+                thumbnails = list(pool.map(_safe_thumbnail, image_paths))
+        else:
+            thumbnails = list(pool.map(_safe_thumbnail, image_paths))
+    keyframe_of, reasons = select_keyframes(image_paths, thumbnails, threshold, max_skip)
+    stats.frames += len(image_paths)
+    stats.keyframes.update(r for r in reasons if r is not None)
+    stats.reused += sum(r is None for r in reasons)
+
+    keyframes = [i for i, r in enumerate(reasons) if r is not None]
+    followers = {i: [] for i in keyframes}  # 關鍵影格 -> 沿用其結果的影格索引
+    for i, key in enumerate(keyframe_of):
+        if i != key:
+            followers[key].append(i)
+    next_keyframe = {a: b for a, b in zip(keyframes, keyframes[1:])}
+    index_of = {path: i for i, path in enumerate(image_paths)}
+
+    done = {}  # 已有結果的關鍵影格 -> (boxes 陣列, orig_shape)；只保留尚待內插的，不保留完整 Results
+
+    def linked(key):
+        # 下一個關鍵影格與 key 屬於同一段連續畫面 (因變化或跳過上限而重新偵測)，才能用來內插
+        nxt = next_keyframe.get(key)
+        return nxt if nxt is not None and reasons[nxt] in ('changed', 'max_skip') else None
+
+    def emit_followers(key):
+        prev, nxt = done.pop(key), linked(key)  # 之後只有下一個關鍵影格可能還需要 key 之後的結果
+        nxt_data = done[nxt][0] if nxt is not None and done[nxt] is not None else None
+        for i in followers[key]:
+            if prev is None:
+                yield image_paths[i], None
+                continue
+            alpha = (i - key) / (nxt - key) if nxt_data is not None else 0.0
+            data = propagate_detections(prev[0], nxt_data, alpha)
+            yield image_paths[i], SimpleNamespace(boxes=SimpleNamespace(data=data), orig_shape=prev[1],
+                                                  propagated=True)
+
+    position = 0  # 依序產出沿用結果的影格：keyframes[position] 之前的關鍵影格都已處理
+    for img_path, result in run([image_paths[i] for i in keyframes], params):
+        done[index_of[img_path]] = (boxes_to_numpy(result.boxes), result.orig_shape) if result is not None else None
+        yield img_path, result
+        while position < len(keyframes):
+            key = keyframes[position]
+            if key not in done or (linked(key) is not None and linked(key) not in done):
+                break
+            yield from emit_followers(key)
+            position += 1
+    for key in keyframes[position:]:
+        yield from emit_followers(key)
@@ -1,9 +1,12 @@
 import os
 import time
+import argparse
 from datetime import timedelta
 from ultralytics import YOLO
 import torch # 導入 PyTorch 進行權重操作
 
+from dataset_cache import MemmapDetectionTrainer, PackedLabelDetectionTrainer
+
 # --- 配置區 ---
 # 1. 數據與模型設定    
 MODEL_CONFIG = 'yolo11x.yaml' 
@@ -94,9 +97,11 @@ def load_backbone_weights_only(model: YOLO, pt_path: str):
     
     print("------------------------------------------\n")
 
-def train_model(data_yaml, pretrained_pt, device, project_name, experiment_name):
+def train_model(data_yaml, pretrained_pt, device, project_name, experiment_name, memmap_cache=False):
     print(f"Starting YOLO training with partial scratch initialization. Model: {MODEL_CONFIG} (Structure)")
     print(f"Data config: {data_yaml}")
+    if memmap_cache:
+        print("Using memory-mapped preprocessed image cache (dataset_cache.py); images are not decoded during training.")
 
     try:
         # 1. 載入模型配置 (使用 .yaml 確保 Neck/Head 隨機初始化)
@@ -119,6 +124,8 @@ def train_model(data_yaml, pretrained_pt, device, project_name, experiment_name)
         project=project_name,
         name=experiment_name,
         device=device,
+        # 標籤優先讀取打包檔；memmap 快取另外跳過每個 epoch 的 JPG 解碼
+        trainer=MemmapDetectionTrainer if memmap_cache else PackedLabelDetectionTrainer,
         
         # 傳遞超參數
         **HYPERPARAMETERS
@@ -146,6 +153,7 @@ if __name__ == '__main__':
     parser.add_argument('--device', type=str, default='0', help="GPU device ID (e.g., '0' or '0,1') or 'cpu'.")
     parser.add_argument('--project-name', type=str, default='runs/yolo11', help="Project directory name for saving results.")
     parser.add_argument('--experiment-name', type=str, default='yolo11x_final', help="Experiment name for the current run.")
+    parser.add_argument('--memmap-cache', action='store_true', help="Train from a pre-resized memory-mapped image cache (built on first use).")
     
     args = parser.parse_args()
-    train_model(args.data_yaml, args.pretrained_pt, args.device, args.project_name, args.experiment_name)
+    train_model(args.data_yaml, args.pretrained_pt, args.device, args.project_name, args.experiment_name, args.memmap_cache)
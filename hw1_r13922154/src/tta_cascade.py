@@ -0,0 +1,112 @@
+import time
+from collections import Counter
+
+import numpy as np
+
+from postprocess import boxes_to_numpy
+
+# --- 設定區塊 (Config Block) ---
+# 第一輪不做 TTA；符合任一條件的圖片視為「不確定」，以 TTA 重新推論並取代第一輪的結果
+MID_CONF_RANGE = (0.25, 0.6)  # 介於此範圍的框視為中等信心
+MID_CONF_SHARE = 0.3          # 信心值 >= 下限的框中，中等信心框的比例超過此值即升級
+RARE_CLASSES = ()             # 稀有類別編號 (單類別任務為空)；出現信心值 >= RARE_MIN_CONF 的稀有類別框即升級
+RARE_MIN_CONF = 0.1
+CROWD_MIN_BOXES = 25          # 信心值 >= MID_CONF_RANGE 下限的框數達到此值 (擁擠的豬欄) 即升級
+# --- 設定區塊 ---
+
+
+def cascade_params():
+    """影響升級判斷的參數 (併入結果快取的鍵)。"""
+    return dict(mid_conf_range=list(MID_CONF_RANGE), mid_conf_share=MID_CONF_SHARE, rare_classes=list(RARE_CLASSES),
+                rare_min_conf=RARE_MIN_CONF, crowd_min_boxes=CROWD_MIN_BOXES)
+
+
+def uncertainty_reasons(data):
+    """
+    由第一輪 (無 TTA) 的 (N, 6) 偵測結果判斷是否需要 TTA，回傳原因列表 (空列表表示確定)：
+    empty (沒有信心值達下限的框)、mid_conf (中等信心框比例過高)、rare_class、crowd。
+    """
+    conf, cls = data[:, 4], data[:, 5]
+    low, high = MID_CONF_RANGE
+    confident = conf >= low
+    reasons = []
+    if not confident.any():
+        reasons.append('empty')
+    elif np.count_nonzero(conf[confident] < high) / np.count_nonzero(confident) > MID_CONF_SHARE:
+        reasons.append('mid_conf')
+    if RARE_CLASSES and np.isin(cls[conf >= RARE_MIN_CONF], RARE_CLASSES).any():
+        reasons.append('rare_class')
+    if np.count_nonzero(confident) >= CROWD_MIN_BOXES:
+        reasons.append('crowd')
+    return reasons
+
+
+class CascadeStats:
+    """記錄兩輪推論的圖片數與耗時，估計相較於全部圖片都做 TTA 節省的時間。"""
+
+    def __init__(self):
+        self.images = 0
+        self.escalated = 0
+        self.reasons = Counter()
+        self.base_s = 0.0
+        self.tta_s = 0.0
+
+    def report(self):
+        report = {'images': self.images, 'escalated': self.escalated, 'reasons': dict(self.reasons),
+                  'base_s': self.base_s, 'tta_s': self.tta_s, 'full_tta_s': None, 'saved_s': None}
+        if self.escalated:
+            # 升級圖片的 TTA 平均耗時即為「每張都做 TTA」時每張圖片的成本
+            report['full_tta_s'] = self.tta_s / self.escalated * self.images
+            report['saved_s'] = report['full_tta_s'] - self.base_s - self.tta_s
+        return report
+
+    def print_report(self):
+        report = self.report()
+        share = report['escalated'] / max(report['images'], 1)
+        reasons = ', '.join(f'{k}: {v}' for k, v in sorted(report['reasons'].items())) or '-'
+        print("\n--- Selective TTA cascade ---")
+        print(f"escalated to TTA: {report['escalated']}/{report['images']} images ({share:.1%}; {reasons})")
+        print(f"plain pass: {report['base_s']:.2f} s, TTA pass: {report['tta_s']:.2f} s")
+        if report['saved_s'] is not None:
+            print(f"estimated TTA on every image: {report['full_tta_s']:.2f} s, "
+                  f"saved: {report['saved_s']:.2f} s ({report['saved_s'] / report['full_tta_s']:.1%})")
+
+
+def _timed(iterator):
+    """逐項產出 (取得該項花費的秒數, 項目)；只計算產生器內部的推論時間，不含呼叫端的後處理。"""
+    iterator = iter(iterator)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield time.perf_counter() - start, item
+
+
+def iter_cascade_predictions(run, image_paths, params, stats=None):
+    """
+    信心值門控的選擇性 TTA：run(paths, params) 產出 (img_path, result) (即 inference.iter_predictions)。
+    第一輪以 augment=False 推論全部圖片，確定的圖片立即產出；不確定的圖片第二輪以 augment=True 推論，
+    以 TTA 的結果取代第一輪。產出順序因此與輸入順序不同。
+    """
+    stats = CascadeStats() if stats is None else stats
+    escalate = []
+    for seconds, (img_path, result) in _timed(run(image_paths, dict(params, augment=False))):
+        stats.base_s += seconds
+        stats.images += 1
+        if result is not None:
+            reasons = uncertainty_reasons(boxes_to_numpy(result.boxes))
+            if reasons:
+                escalate.append(img_path)
+                stats.reasons.update(reasons)
+                continue
+        yield img_path, result
+
+    stats.escalated = len(escalate)
+    if not escalate:
+        return
+    print(f"\n-> {len(escalate)}/{stats.images} images escalated to TTA...")
+    for seconds, (img_path, result) in _timed(run(escalate, dict(params, augment=True))):
+        stats.tta_s += seconds
+        yield img_path, result
@@ -0,0 +1,177 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+
+# --- 設定區塊 (Config Block) ---
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+FIRST_FRAME_NUMBER = 1   # 影片第 0 張影格對應 gt.txt 的 <frame> 1 (即 00000001.jpg)
+PREFETCH_BATCHES = 2     # 背景解碼執行緒最多預先準備好的批次數
+# --- 設定區塊 ---
+
+_END_OF_STREAM = object()
+
+# 影片中的影格以「虛擬路徑」<影片路徑>/<frame:08d>.jpg 表示，與拆成 JPEG 時的檔名相同，
+# 因此 extract_pure_id / image_sort_key / 影格編號等既有邏輯不需修改，也不會寫出任何暫存檔。
+
+
+def is_video(path):
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def frame_name(frame_number):
+    """與 conver_to_yolo.group_by_frame 相同的影格檔名 (00000001.jpg)。"""
+    return f"{frame_number:08d}.jpg"
+
+
+def frame_path(video_path, frame_number):
+    return os.path.join(video_path, frame_name(frame_number))
+
+
+def frame_number_of(path):
+    return int(os.path.splitext(os.path.basename(path))[0])
+
+
+def video_info(video_path):
+    """回傳 (影格數, 寬, 高, fps)；影格數取自容器標頭，常是估計值 (見 count_video_frames)。"""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise OSError(f"cannot open video {video_path}")
+    try:
+        return (int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.get(cv2.CAP_PROP_FPS))
+    finally:
+        cap.release()
+
+
+def count_video_frames(video_path):
+    """依序 grab() 到影片結尾，回傳實際解得出的影格數 (需要解碼整部影片，只在標頭數量不可信時使用)。"""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise OSError(f"cannot open video {video_path}")
+    try:
+        count = 0
+        while cap.grab():
+            count += 1
+        return count
+    finally:
+        cap.release()
+
+
+def list_video_frames(video_path):
+    """
+    影片中所有影格的虛擬路徑 (依影格順序)，數量取自標頭；
+    實際影格數不同時由 iter_video_batches 補上多出的影格、略過不存在的影格。
+    """
+    frame_count = video_info(video_path)[0]
+    return [frame_path(video_path, FIRST_FRAME_NUMBER + i) for i in range(frame_count)]
+
+
+def frame_digests(frame_paths, video_digest):
+    """結果快取用的每張影格鍵：hash(影片內容雜湊, 影格編號)；影片內容不變時同一影格的鍵不變。"""
+    return [hashlib.blake2b(f'{video_digest}:{frame_number_of(p)}'.encode(), digest_size=16).hexdigest()
+            for p in frame_paths]
+
+
+def iter_video_batches(video_path, frame_paths, batch_size, prefetch=PREFETCH_BATCHES, profiler=None, extra_from=None):
+    """
+    與 image_io.iter_prefetched_batches 相同的介面：背景執行緒以 OpenCV 依序解碼影片，
+    每次產出 (batch_paths, batch_images) (BGR uint8)；frame_paths 為要推論的影格 (虛擬路徑)，
+    不需要的影格只 grab() 不轉換像素。影片在要求的影格之前就結束時 (標頭影格數高估)，不存在的影格不會產出。
+    extra_from 為影格編號時一路解碼到影片結尾，編號 >= extra_from 的影格 (不可與 frame_paths 重疊)
+    也一併產出，補上標頭影格數低估時多出的影格。
+    profiler 記錄每張影格的解碼時間 (decode) 與主執行緒等待批次的時間 (wait_batch)。
+    """
+    import cv2
+
+    wanted = sorted(frame_paths, key=frame_number_of)
+    batches = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item):
+        # 消費端提前結束時不要永久阻塞
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(cap):
+        start = time.perf_counter()
+        ok, image = cap.read()
+        if profiler is not None:
+            profiler.record('decode', time.perf_counter() - start, start)
+        return image if ok else None
+
+    def iter_frames(cap):
+        # 依序產出 (影格路徑, 影像)，影片結束即停止
+        position = FIRST_FRAME_NUMBER  # 下一次 grab() / read() 取得的影格編號
+        for done, path in enumerate(wanted):
+            target = frame_number_of(path)
+            while position < target and cap.grab():
+                position += 1
+            image = read(cap) if position == target else None
+            if image is None:
+                print(f"{os.path.basename(video_path)} ended before frame {target}: "
+                      f"skipping {len(wanted) - done} requested frames past the end")
+                return
+            position += 1
+            yield path, image
+        if extra_from is None:
+            return
+        while position < extra_from:
+            if not cap.grab():
+                return
+            position += 1
+        while True:
+            image = read(cap)
+            if image is None:
+                return
+            yield frame_path(video_path, position), image
+            position += 1
+
+    def producer():
+        cap = cv2.VideoCapture(video_path)
+        try:
+            if not cap.isOpened():
+                raise OSError(f"cannot open video {video_path}")
+            batch_paths, batch_images = [], []
+            for path, image in iter_frames(cap):
+                batch_paths.append(path)
+                batch_images.append(image)
+                if len(batch_paths) == batch_size:
+                    if not put((batch_paths, batch_images)):
+                        return
+                    batch_paths, batch_images = [], []
+            if batch_paths and not put((batch_paths, batch_images)):
+                return
+        except Exception as e:
+            put(e)
+            return
+        finally:
+            cap.release()
+        put(_END_OF_STREAM)
+
+    worker = threading.Thread(target=producer, name='video-decode', daemon=True)
+    worker.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            item = batches.get()
+            if profiler is not None:
+                profiler.record('wait_batch', time.perf_counter() - start, start)
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
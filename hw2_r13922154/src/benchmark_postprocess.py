@@ -0,0 +1,54 @@
+import argparse
+import time
+from types import SimpleNamespace
+
+import torch
+from ultralytics.engine.results import Boxes
+
+from inference import format_prediction_string, format_prediction_string_per_box
+
+# --- 設定 ---
+NUM_BOXES = 3000        # 每張假圖片的框數
+IMAGE_SIZE = (1920, 1080)
+NUM_CLASSES = 4
+REPEATS = 20
+# --- 結束設定 ---
+
+
+def make_fake_result(num_boxes, img_w, img_h, device, seed=0):
+    """產生一張含 num_boxes 個隨機框的假推論結果 (x1 y1 x2 y2 conf cls)。"""
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(num_boxes, 2, generator=g) * torch.tensor([img_w * 0.9, img_h * 0.9])
+    wh = torch.rand(num_boxes, 2, generator=g) * torch.tensor([img_w * 0.1, img_h * 0.1]) + 1
+    conf = torch.rand(num_boxes, 1, generator=g)
+    cls = torch.randint(0, NUM_CLASSES, (num_boxes, 1), generator=g).float()
+    data = torch.cat([xy, xy + wh, conf, cls], dim=1).to(device)
+    return SimpleNamespace(boxes=Boxes(data, (img_h, img_w)), orig_shape=(img_h, img_w))
+
+
+def time_fn(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    return (time.perf_counter() - start) / repeats, out
+
+
+def main(device='cpu'):
+    img_w, img_h = IMAGE_SIZE
+    result = make_fake_result(NUM_BOXES, img_w, img_h, device)
+
+    per_box_s, per_box_out = time_fn(lambda: format_prediction_string_per_box(result), REPEATS)
+    vector_s, vector_out = time_fn(lambda: format_prediction_string(result), REPEATS)
+
+    print(f"每張圖片框數: {NUM_BOXES} (device: {device})")
+    print(f"逐框版本  : {per_box_s * 1000:.2f} ms/張")
+    print(f"向量化版本: {vector_s * 1000:.2f} ms/張")
+    print(f"加速倍數  : {per_box_s / max(vector_s, 1e-12):.1f}x")
+    print(f"輸出一致  : {per_box_out == vector_out}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark per-box vs vectorized PredictionString generation.")
+    parser.add_argument('--device', type=str, default='cpu', help="Device for the box tensors (e.g., 'cpu' or 'cuda:0').")
+    args = parser.parse_args()
+    main(args.device)
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def box_area(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def box_iou(boxes_a, boxes_b):
+    """xyxy 格式的 IoU 矩陣 (N, M)。逐座標以 2D 廣播計算，不建立 (N, M, 2) 的中間陣列。"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    w = np.minimum(boxes_a[:, 2:3], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0:1], boxes_b[:, 0])
+    h = np.minimum(boxes_a[:, 3:4], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1:2], boxes_b[:, 1])
+    inter = np.clip(w, 0, None, out=w) * np.clip(h, 0, None, out=h)
+    union = box_area(boxes_a)[:, None] + box_area(boxes_b)[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def nms(boxes, scores, iou_threshold):
+    """貪婪 NMS，回傳保留框的索引 (依分數由高到低)。"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    areas = box_area(boxes)
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        lt = np.maximum(boxes[i, :2], boxes[rest, :2])
+        rb = np.minimum(boxes[i, 2:], boxes[rest, 2:])
+        wh = np.clip(rb - lt, 0, None)
+        inter = wh[:, 0] * wh[:, 1]
+        union = areas[i] + areas[rest] - inter
+        iou = np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, classes, iou_threshold):
+    """類別感知 NMS：以類別位移讓不同類別的框互不重疊後，只做一次 NMS。"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offset = np.asarray(classes, dtype=np.float64)[:, None] * (boxes.max() + 1)
+    return nms(boxes + offset, scores, iou_threshold)
+
+
+def weighted_box_fusion(boxes, scores, classes, iou_threshold=0.55, num_sources=1, weights=None):
+    """
+    加權框融合 (Weighted Box Fusion, Solovyev et al., 2021)。
+    先以類別感知 NMS 選出每群的代表框，其餘框依 IoU 歸入重疊最大的代表框 (同類別)，
+    群內座標以分數加權平均；分數為群內平均分數 * min(群大小, num_sources) / num_sources。
+    weights 為每個框的來源權重 (例如多模型融合時的模型權重)，預設皆為 1。
+    回傳 (N, 6) 陣列：x1 y1 x2 y2 conf cls。
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    classes = np.asarray(classes, dtype=np.float64).reshape(-1)
+    if len(boxes) == 0:
+        return np.zeros((0, 6), dtype=np.float64)
+    weights = np.ones_like(scores) if weights is None else np.asarray(weights, dtype=np.float64).reshape(-1)
+
+    leaders = batched_nms(boxes, scores, classes, iou_threshold)
+    iou = box_iou(boxes, boxes[leaders])
+    iou[classes[:, None] != classes[leaders][None, :]] = -1.0
+    cluster = np.argmax(iou, axis=1)
+    cluster[leaders] = np.arange(len(leaders))
+
+    w = scores * weights
+    k = len(leaders)
+    weight_sum = np.bincount(cluster, weights=w, minlength=k)
+    fused = np.zeros((k, 4), dtype=np.float64)
+    np.add.at(fused, cluster, boxes * w[:, None])
+    fused /= np.maximum(weight_sum, 1e-12)[:, None]
+
+    size = np.bincount(cluster, minlength=k)
+    mean_score = np.bincount(cluster, weights=scores * weights, minlength=k) / np.maximum(
+        np.bincount(cluster, weights=weights, minlength=k), 1e-12)
+    conf = mean_score * np.minimum(size, num_sources) / num_sources
+
+    out = np.concatenate([fused, conf[:, None], classes[leaders][:, None]], axis=1)
+    return out[np.argsort(-conf, kind="stable")]
@@ -1,105 +1,183 @@
 import os
-import cv2
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_io import read_image_size
+from label_store import LabelStore, label_store_path
 
 # --- 設定你的路徑 ---
 
 # 1. 原始資料夾：包含圖片 (img0001.png) 和原始標籤 (img0001.txt)
-INPUT_DIR = "../data/CVPDL_hw2/CVPDL_hw2/train" 
+INPUT_DIR = "../data/CVPDL_hw2/CVPDL_hw2/train"
 
 # 2. 輸出資料夾：儲存轉換後的 YOLO 格式標籤
 OUTPUT_DIR = "../data/train_yolo_labels"
 
+# 3. 平行處理的行程數
+NUM_WORKERS = os.cpu_count() or 4
+
+# 4. 標籤輸出格式：
+#   "txt"    - 每張圖片一個 YOLO .txt (原始行為)
+#   "packed" - 單一打包檔 (OUTPUT_DIR + ".labels.npz"，見 label_store.py)
+#   "both"   - 兩者皆寫
+LABEL_FORMAT = "both"
+
 # ----------------------
 
-# 確保輸出資料夾存在
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 支援的圖片格式 (同名時依此順序優先)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
 
-# 支援的圖片格式
-IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
 
-# 遍歷 INPUT_DIR 中的所有檔案
-print(f"開始轉換... 來源: '{INPUT_DIR}', 輸出: '{OUTPUT_DIR}'")
-file_list = os.listdir(INPUT_DIR)
+def build_directory_index(input_dir):
+    """
+    以單次 os.scandir 建立目錄索引，取代每個標籤逐一以 os.path.exists 探測三種副檔名。
+    回傳 (label_files, image_by_base)：原始標籤檔名列表，以及 base name -> 圖片路徑。
+    """
+    label_files = []
+    images = {}
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            base_filename, ext = os.path.splitext(entry.name)
+            if ext == ".txt":
+                label_files.append(entry.name)
+            elif ext in IMAGE_EXTENSIONS:
+                images.setdefault(base_filename, {})[ext] = entry.path
 
-for filename in file_list:
-    # 檢查是否為原始標籤 .txt 檔
-    if filename.endswith(".txt"):
-        base_filename = os.path.splitext(filename)[0] # e.g., "img0001"
-        gt_txt_path = os.path.join(INPUT_DIR, filename)
-        
-        # 1. 尋找對應的圖片檔案
-        image_path = None
+    image_by_base = {}
+    for base_filename, by_ext in images.items():
         for ext in IMAGE_EXTENSIONS:
-            potential_image_path = os.path.join(INPUT_DIR, base_filename + ext)
-            if os.path.exists(potential_image_path):
-                image_path = potential_image_path
+            if ext in by_ext:
+                image_by_base[base_filename] = by_ext[ext]
                 break
-        
+    return label_files, image_by_base
+
+
+def convert_label_file(gt_txt_path, image_path, output_dir, label_format=LABEL_FORMAT):
+    """
+    轉換單一原始標籤檔為 YOLO 格式 (於工作行程中執行)。
+    圖片尺寸只讀取檔頭，不解碼整張圖片。
+    回傳 (成功與否, packed)：packed 為打包格式所需的 ((n, 5) float32 標籤, (width, height))，不需要時為 None。
+    """
+    filename = os.path.basename(gt_txt_path)
+
+    # 2. 讀取圖片尺寸
+    try:
+        image_width, image_height = read_image_size(image_path)
+    except Exception as e:
+        print(f"錯誤：讀取 {image_path} 尺寸時發生問題: {e}。跳過 {filename}。")
+        return False, None
+
+    # 準備儲存轉換後的 YOLO 標籤 (字串與數值各一份)
+    yolo_labels = []
+    yolo_rows = []
+
+    # 3. 讀取原始 gt.txt
+    try:
+        with open(gt_txt_path, 'r') as f_in:
+            for line in f_in:
+                line = line.strip()
+                if not line:
+                    continue
+
+                parts = line.split(',')
+                if len(parts) != 5:
+                    print(f"警告：{filename} 中的行格式錯誤: {line}。跳過此行。")
+                    continue
+
+                # 讀取來源格式
+                class_label = int(parts[0])
+                tl_x = float(parts[1])
+                tl_y = float(parts[2])
+                w = float(parts[3])
+                h = float(parts[4])
+
+                # 4. 執行轉換計算
+                x_center = tl_x + (w / 2)
+                y_center = tl_y + (h / 2)
+
+                # 歸一化
+                x_center_norm = x_center / image_width
+                y_center_norm = y_center / image_height
+                w_norm = w / image_width
+                h_norm = h / image_height
+
+                # 格式化為 YOLO 字串
+                yolo_line = f"{class_label} {x_center_norm:.6f} {y_center_norm:.6f} {w_norm:.6f} {h_norm:.6f}"
+                yolo_labels.append(yolo_line)
+                yolo_rows.append((class_label, x_center_norm, y_center_norm, w_norm, h_norm))
+
+    except Exception as e:
+        print(f"錯誤：處理 {gt_txt_path} 時發生問題: {e}。跳過此檔案。")
+        return False, None
+
+    packed = None
+    if label_format in ("packed", "both"):
+        packed = (np.array(yolo_rows, dtype=np.float32).reshape(-1, 5), (image_width, image_height))
+    if label_format == "packed":
+        return True, packed
+
+    # 5. 寫入新的 YOLO 格式 txt 檔案
+    output_txt_path = os.path.join(output_dir, filename)
+    try:
+        with open(output_txt_path, 'w') as f_out:
+            for line in yolo_labels:
+                f_out.write(line + "\n")
+    except Exception as e:
+        print(f"錯誤：無法寫入 {output_txt_path}: {e}。")
+        return False, None
+    return True, packed
+
+
+def _convert_task(args):
+    return convert_label_file(*args)
+
+
+def main(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, num_workers=NUM_WORKERS, label_format=LABEL_FORMAT):
+    # 確保輸出資料夾存在
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"開始轉換... 來源: '{input_dir}', 輸出: '{output_dir}'")
+
+    # 1. 以單次掃描建立索引，尋找每個標籤對應的圖片檔案
+    label_files, image_by_base = build_directory_index(input_dir)
+    tasks = []
+    for filename in label_files:
+        base_filename = os.path.splitext(filename)[0] # e.g., "img0001"
+        image_path = image_by_base.get(base_filename)
+
         # 如果找不到圖片
         if image_path is None:
             print(f"警告：找到了 {filename}，但找不到對應的圖片檔案。跳過此檔案。")
             continue
+        tasks.append((os.path.join(input_dir, filename), image_path, output_dir, label_format))
 
-        # 2. 讀取圖片尺寸
-        try:
-            image = cv2.imread(image_path)
-            if image is None:
-                print(f"錯誤：無法讀取圖片 {image_path}。跳過 {filename}。")
-                continue
-            
-            image_height, image_width, _ = image.shape
-        except Exception as e:
-            print(f"錯誤：讀取 {image_path} 尺寸時發生問題: {e}。跳過 {filename}。")
-            continue
+    # 2~5. 以行程池平行轉換
+    print(f"共 {len(tasks)} 個標籤檔，使用 {num_workers} 個行程轉換 (格式: {label_format})...")
+    converted = 0
+    packed_names, packed_labels, packed_sizes = [], [], []
+    with ProcessPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        for task, (ok, packed) in zip(tasks, pool.map(_convert_task, tasks, chunksize=64)):
+            converted += ok
+            if packed is not None:
+                packed_names.append(os.path.splitext(os.path.basename(task[0]))[0])
+                packed_labels.append(packed[0])
+                packed_sizes.append(packed[1])
 
-        # 準備儲存轉換後的 YOLO 標籤
-        yolo_labels = []
-        
-        # 3. 讀取原始 gt.txt
-        try:
-            with open(gt_txt_path, 'r') as f_in:
-                for line in f_in:
-                    line = line.strip()
-                    if not line:
-                        continue
-                        
-                    parts = line.split(',')
-                    if len(parts) != 5:
-                        print(f"警告：{filename} 中的行格式錯誤: {line}。跳過此行。")
-                        continue
-                    
-                    # 讀取來源格式
-                    class_label = int(parts[0])
-                    tl_x = float(parts[1])
-                    tl_y = float(parts[2])
-                    w = float(parts[3])
-                    h = float(parts[4])
-                    
-                    # 4. 執行轉換計算
-                    x_center = tl_x + (w / 2)
-                    y_center = tl_y + (h / 2)
-                    
-                    # 歸一化
-                    x_center_norm = x_center / image_width
-                    y_center_norm = y_center / image_height
-                    w_norm = w / image_width
-                    h_norm = h / image_height
-                    
-                    # 格式化為 YOLO 字串
-                    yolo_line = f"{class_label} {x_center_norm:.6f} {y_center_norm:.6f} {w_norm:.6f} {h_norm:.6f}"
-                    yolo_labels.append(yolo_line)
-                    
-        except Exception as e:
-            print(f"錯誤：處理 {gt_txt_path} 時發生問題: {e}。跳過此檔案。")
-            continue
+    # 6. 打包格式：所有標籤存成單一檔案，切分與訓練時直接載入
+    if label_format in ("packed", "both"):
+        store_path = label_store_path(output_dir)
+        LabelStore.from_arrays(packed_names, packed_labels, packed_sizes).save(store_path)
+        print(f"已將 {len(packed_names)} 張圖片的標籤打包至 {store_path}")
+    elif os.path.exists(label_store_path(output_dir)):
+        # 只寫 .txt 時移除舊的打包檔，避免切分與訓練優先讀到過期標籤
+        os.remove(label_store_path(output_dir))
+        print(f"已移除過期的打包標籤 {label_store_path(output_dir)}")
+
+    print(f"轉換完成！共轉換 {converted} 個檔案，YOLO 格式的標籤檔已儲存在 '{output_dir}'。")
 
-        # 5. 寫入新的 YOLO 格式 txt 檔案
-        output_txt_path = os.path.join(OUTPUT_DIR, filename)
-        try:
-            with open(output_txt_path, 'w') as f_out:
-                for line in yolo_labels:
-                    f_out.write(line + "\n")
-        except Exception as e:
-            print(f"錯誤：無法寫入 {output_txt_path}: {e}。")
 
-print(f"轉換完成！YOLO 格式的標籤檔已儲存在 '{OUTPUT_DIR}'。")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from box_ops import box_iou
+from image_io import read_image_size
+from label_store import LabelStore, label_store_path
+
+# COCO 風格 mAP50:95：IoU 門檻 0.50:0.05:0.95，召回率以 101 點內插
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_POINTS = np.linspace(0.0, 1.0, 101)
+
+# --- 設定 ---
+# 1. 要評估的提交 CSV (例如以驗證集圖片執行 inference.py 的輸出)
+EVAL_CSV_FILE = "submissions/val.csv"
+# 2. GT 來源 (擇一)：原始標籤資料夾 (imgXXXX.txt，每行 <class>,<x>,<y>,<w>,<h> 像素座標)，
+#    或 YOLO 標籤資料夾 (有打包檔時直接使用；否則圖片尺寸取自 EVAL_IMAGE_DIR)
+GT_DIR = "../data/CVPDL_hw2/CVPDL_hw2/train"
+EVAL_LABELS_DIR = None   # e.g., "../data/datasets/labels/val"
+EVAL_IMAGE_DIR = None    # e.g., "../data/datasets/images/val"
+# 3. 每張圖片最多計入的預測數 (None 表示全部) 與配對的行程數
+EVAL_MAX_DETS = None
+EVAL_WORKERS = os.cpu_count() or 4
+EVAL_OUTPUT_FILE = None  # e.g., "submissions/val_metrics.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# --- 結束設定 ---
+
+
+def match_image(pred, gt, iou_thresholds=IOU_THRESHOLDS):
+    """
+    單張圖片的 COCO 貪婪配對：預測依信心值由高到低，各自配給 IoU 最大且尚未被配對的同類別 GT。
+    pred 為 (N, 6) x1 y1 x2 y2 conf cls (需已依 conf 由高到低排序)，gt 為 (M, 5) cls x1 y1 x2 y2。
+    回傳 (N, T) bool (每個 IoU 門檻是否為 TP)。
+    配對只取決於排在前面的預測，因此任一前綴 (提高 conf 門檻或降低 max_det) 的結果即為對應的前綴列。
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    tp = np.zeros((len(pred), len(thresholds)), dtype=bool)
+    if len(pred) == 0 or len(gt) == 0:
+        return tp
+    iou = box_iou(pred[:, :4], gt[:, 1:])
+    iou[pred[:, 5][:, None] != gt[:, 0][None, :]] = 0.0
+    # 只保留 IoU 達最小門檻的候選配對 (擁擠圖片上數千個框時也只有 O(N) 個)，
+    # 依 (預測, IoU 由大到小, GT 索引) 排序一次，所有門檻共用
+    pred_idx, gt_idx = np.nonzero(iou >= thresholds.min())
+    values = iou[pred_idx, gt_idx]
+    order = np.lexsort((gt_idx, -values, pred_idx))
+    pairs = (pred_idx[order], gt_idx[order], values[order])
+    for t, threshold in enumerate(thresholds.tolist()):
+        tp[:, t] = greedy_match(pairs, threshold, len(pred), len(gt))
+    return tp
+
+
+def greedy_match(pairs, threshold, num_pred, num_gt):
+    """
+    依預測順序 (信心值由高到低) 的貪婪配對，回傳 (num_pred,) bool，結果與逐一處理完全相同，但以整批陣列運算完成：
+    每一輪所有未決定的預測同時選出目前 IoU 最大的可用 GT；若沒有排在更前面的未決定預測也能選到該 GT，
+    這個選擇之後不會再改變 (前面的預測只會拿走自己的候選)，可以直接確定。
+    每輪至少確定最前面的預測；擁擠場景中多個預測搶同一個 GT 時，通常數輪即可全部確定。
+    pairs 為 match_image 排序好的 (pred_idx, gt_idx, iou) 候選配對。
+    """
+    pred_idx, gt_idx, values = pairs
+    keep = values >= threshold
+    pred_idx, gt_idx = pred_idx[keep], gt_idx[keep]
+    tp = np.zeros(num_pred, dtype=bool)
+    matched = np.zeros(num_gt, dtype=bool)
+    while len(pred_idx):
+        head = np.r_[True, pred_idx[1:] != pred_idx[:-1]]  # 每個未決定預測目前最佳的可用 GT
+        best_pred, best_gt = pred_idx[head], gt_idx[head]
+        first = np.full(num_gt, num_pred)
+        np.minimum.at(first, gt_idx, pred_idx)  # 每個 GT 最前面可選到它的未決定預測
+        final = first[best_gt] == best_pred
+        tp[best_pred[final]] = True
+        matched[best_gt[final]] = True
+        # 移除已確定的預測與已被配對的 GT；沒有候選可選的預測即為 FP
+        keep = ~matched[gt_idx] & ~tp[pred_idx]
+        pred_idx, gt_idx = pred_idx[keep], gt_idx[keep]
+    return tp
+
+
+def average_precision(tp, conf, num_gt):
+    """
+    單一類別的 AP (T,)：所有圖片的預測依信心值排序後累計 precision / recall，
+    precision 取右側最大值的包絡線後於 RECALL_POINTS 取樣平均 (與 pycocotools 相同)。
+    """
+    num_thresholds = tp.shape[1]
+    if num_gt == 0:
+        return np.full(num_thresholds, np.nan)
+    if len(tp) == 0:
+        return np.zeros(num_thresholds)
+    tp = tp[np.argsort(-conf, kind="stable")]
+    ctp = np.cumsum(tp, axis=0)
+    cfp = np.cumsum(~tp, axis=0)
+    recall = ctp / num_gt
+    precision = np.maximum.accumulate((ctp / (ctp + cfp))[::-1], axis=0)[::-1]
+
+    ap = np.zeros(num_thresholds)
+    for t in range(num_thresholds):
+        idx = np.searchsorted(recall[:, t], RECALL_POINTS, side="left")
+        valid = idx < len(recall)
+        ap[t] = precision[idx[valid], t].sum() / len(RECALL_POINTS)
+    return ap
+
+
+def summarize(tp, conf, pred_cls, gt_cls):
+    """
+    由所有圖片串接後的配對結果計算每個類別的 AP 與整體 mAP。
+    只計入有 GT 的類別 (與 COCO 相同)；回傳 {"map50_95", "map50", "per_class": {cls: {"ap50_95", "ap50", "num_gt"}}}。
+    """
+    per_class = {}
+    for c in np.unique(gt_cls).tolist():
+        mask = pred_cls == c
+        ap = average_precision(tp[mask], conf[mask], int((gt_cls == c).sum()))
+        per_class[int(c)] = {"ap50_95": float(ap.mean()), "ap50": float(ap[0]), "num_gt": int((gt_cls == c).sum())}
+    return {
+        "map50_95": float(np.mean([v["ap50_95"] for v in per_class.values()])) if per_class else 0.0,
+        "map50": float(np.mean([v["ap50"] for v in per_class.values()])) if per_class else 0.0,
+        "per_class": per_class,
+    }
+
+
+def _match_sorted(pred, gt, iou_thresholds=IOU_THRESHOLDS, max_dets=None):
+    """依 conf 排序 (並截斷為 max_dets) 後配對，回傳 (tp, conf, cls)。可在工作行程中執行。"""
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 6)
+    pred = pred[np.argsort(-pred[:, 4], kind="stable")][:max_dets]
+    return match_image(pred, np.asarray(gt, dtype=np.float64).reshape(-1, 5), iou_thresholds), pred[:, 4], pred[:, 5]
+
+
+def evaluate_detections(preds, gts, iou_thresholds=IOU_THRESHOLDS, max_dets=None, num_workers=1):
+    """
+    preds / gts 為逐張圖片對應的列表：pred (N, 6) x1 y1 x2 y2 conf cls，gt (M, 5) cls x1 y1 x2 y2 (像素座標)。
+    max_dets 為每張圖片最多計入的預測數 (None 表示全部)；num_workers > 1 時逐張配對分散到多個行程。
+    回傳 summarize 的結果。
+    """
+    n = len(preds)
+    if num_workers > 1 and n > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            matched = list(pool.map(_match_sorted, preds, gts, [iou_thresholds] * n, [max_dets] * n,
+                                    chunksize=max(1, n // (num_workers * 4))))
+    else:
+        matched = [_match_sorted(pred, gt, iou_thresholds, max_dets) for pred, gt in zip(preds, gts)]
+    return summarize(
+        np.concatenate([m[0] for m in matched]) if matched else np.zeros((0, len(iou_thresholds)), dtype=bool),
+        np.concatenate([m[1] for m in matched]) if matched else np.zeros(0),
+        np.concatenate([m[2] for m in matched]) if matched else np.zeros(0),
+        np.concatenate([np.asarray(gt).reshape(-1, 5)[:, 0] for gt in gts]) if gts else np.zeros(0),
+    )
+
+
+def image_id_of(name):
+    """與 inference.collect_image_ids 相同：'imgXXXX' (或 Image_ID) -> 純數字 ID。"""
+    base = os.path.splitext(os.path.basename(str(name)))[0]
+    try:
+        return int(base.replace("img", ""))
+    except ValueError:
+        return base
+
+
+def parse_prediction_string(prediction_string):
+    """"<conf> <xmin> <ymin> <width> <height> <class> ..." -> (N, 6) x1 y1 x2 y2 conf cls。"""
+    values = np.array(prediction_string.split(), dtype=np.float64).reshape(-1, 6)
+    return np.column_stack([
+        values[:, 1], values[:, 2], values[:, 1] + values[:, 3], values[:, 2] + values[:, 4], values[:, 0], values[:, 5],
+    ])
+
+
+def load_submission(csv_file):
+    """讀取提交 CSV (Image_ID,PredictionString)，回傳 {image_id: (N, 6)}。"""
+    predictions = {}
+    with open(csv_file, "r") as f:
+        next(f, None)  # 標題列
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            image_id, _, prediction_string = line.partition(",")
+            predictions[image_id_of(image_id)] = parse_prediction_string(prediction_string.strip('"'))
+    return predictions
+
+
+def ltwh_to_gt(cls, ltwh):
+    """(N,) 類別與 (N, 4) 像素 (left, top, width, height) -> (N, 5) cls x1 y1 x2 y2。"""
+    ltwh = np.asarray(ltwh, dtype=np.float64).reshape(-1, 4)
+    return np.column_stack([np.broadcast_to(cls, len(ltwh)), ltwh[:, :2], ltwh[:, :2] + ltwh[:, 2:]])
+
+
+def load_gt_dir(gt_dir):
+    """原始標籤資料夾 (imgXXXX.txt，每行 <class>,<x>,<y>,<w>,<h>) -> {image_id: (M, 5)}，略過格式錯誤的行。"""
+    gts = {}
+    with os.scandir(gt_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".txt"):
+                continue
+            rows = []
+            with open(entry.path, "r") as f:
+                for line in f:
+                    parts = line.strip().split(",")
+                    if len(parts) == 5:
+                        rows.append(parts)
+            data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+            gts[image_id_of(entry.name)] = ltwh_to_gt(data[:, 0], data[:, 1:])
+    return gts
+
+
+def load_label_dir(label_dir, image_dir=None):
+    """
+    YOLO 標籤 -> {image_id: (M, 5)} 像素座標。
+    優先使用打包檔 (label_store.py，內含圖片尺寸)；否則逐一讀取 .txt，圖片尺寸取自 image_dir 的檔頭。
+    """
+    store_path = label_store_path(label_dir)
+    if os.path.exists(store_path):
+        store = LabelStore.load(store_path)
+        items = [(name, store.get(name), store.size_of(name)) for name in store.names]
+    else:
+        if image_dir is None:
+            raise ValueError(f"找不到打包檔 {store_path}，需要設定 EVAL_IMAGE_DIR 以讀取圖片尺寸。")
+        images = {os.path.splitext(f)[0]: os.path.join(image_dir, f)
+                  for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS)}
+        items = []
+        for f in sorted(os.listdir(label_dir)):
+            name = os.path.splitext(f)[0]
+            if not f.endswith(".txt") or name not in images:
+                continue
+            with open(os.path.join(label_dir, f), "r") as fh:
+                labels = np.array([line.split() for line in fh if line.strip()], dtype=np.float32).reshape(-1, 5)
+            items.append((name, labels, read_image_size(images[name])))
+
+    gts = {}
+    for name, labels, (img_w, img_h) in items:
+        xywh = labels[:, 1:].astype(np.float64) * np.array([img_w, img_h, img_w, img_h], dtype=np.float64)
+        gts[image_id_of(name)] = ltwh_to_gt(labels[:, 0], np.column_stack([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, 2:]]))
+    return gts
+
+
+def evaluate_submission(csv_file, gts, max_dets=None, num_workers=1):
+    """
+    以 CSV 中的圖片為評估集合：CSV 有、GT 沒有的圖片視為沒有物件 (預測全為 FP)；
+    GT 有、CSV 沒有的圖片不計入 (例如以完整訓練集標籤評估驗證集的 CSV)，只印出數量。
+    """
+    predictions = load_submission(csv_file)
+    image_ids = sorted(predictions, key=str)
+    missing = len(set(gts) - set(predictions))
+    if missing:
+        print(f"{missing} 張有 GT 的圖片不在 {csv_file} 中，不計入評估。")
+    empty = np.zeros((0, 5), dtype=np.float64)
+    result = evaluate_detections(
+        [predictions[i] for i in image_ids], [gts.get(i, empty) for i in image_ids],
+        max_dets=max_dets, num_workers=num_workers,
+    )
+    result["images"] = len(image_ids)
+    result["predictions"] = int(sum(len(p) for p in predictions.values()))
+    return result
+
+
+def main():
+    start = time.perf_counter()
+    gts = load_label_dir(EVAL_LABELS_DIR, EVAL_IMAGE_DIR) if EVAL_LABELS_DIR else load_gt_dir(GT_DIR)
+    result = evaluate_submission(EVAL_CSV_FILE, gts, EVAL_MAX_DETS, EVAL_WORKERS)
+    elapsed = time.perf_counter() - start
+
+    print(f"\n圖片數: {result['images']}，預測框數: {result['predictions']} (耗時 {elapsed:.2f} 秒)")
+    print(f"{'class':>6}{'num_gt':>9}{'AP50':>8}{'AP50:95':>9}")
+    for cls, stats in result["per_class"].items():
+        print(f"{cls:>6}{stats['num_gt']:>9}{stats['ap50']:>8.4f}{stats['ap50_95']:>9.4f}")
+    print(f"{'all':>6}{'':>9}{result['map50']:>8.4f}{result['map50_95']:>9.4f}")
+    if EVAL_OUTPUT_FILE:
+        with open(EVAL_OUTPUT_FILE, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import math
+import struct
+
+from PIL import Image
+
+# 可用 DCT 縮放直接縮小解碼的格式
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# JPEG 中帶有影像尺寸的 SOF 標記 (排除 DHT=C4, JPG=C8, DAC=CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(f):
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return width, height
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':  # 標記前可能有填充的 0xFF
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # 無長度欄位的標記
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_size(image_path):
+    """
+    只讀取檔頭取得圖片尺寸 (width, height)，不解碼像素。
+    支援 PNG / JPEG；其他格式或檔頭異常時退回 PIL (同樣只解析檔頭)。
+    """
+    with open(image_path, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        size = None
+        if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+            size = _png_size(f)
+        elif signature.startswith(b'\xff\xd8'):
+            size = _jpeg_size(f)
+    if size is not None:
+        return size
+    with Image.open(image_path) as img:
+        return img.size
+
+
+class ImageMetaCache:
+    """
+    每張圖片的尺寸 (width, height) 只取得一次，供反正規化與 CSV 輸出共用。
+    優先使用已登記的尺寸，其次為推論結果的 orig_shape，最後才讀取檔頭。
+    """
+
+    def __init__(self):
+        self._sizes = {}
+
+    def put(self, image_path, width, height):
+        self._sizes[image_path] = (int(width), int(height))
+
+    def get(self, image_path, result=None):
+        size = self._sizes.get(image_path)
+        if size is None:
+            orig_shape = getattr(result, 'orig_shape', None)
+            if orig_shape is not None:
+                size = (int(orig_shape[1]), int(orig_shape[0]))
+            else:
+                size = read_image_size(image_path)
+            self._sizes[image_path] = size
+        return size
+
+
+def reduction_factor(width, height, target_size):
+    """JPEG DCT 縮放可用的最大倍率 (1 / 2 / 4 / 8)，縮小後長邊仍不小於 target_size (letterbox 只會再縮小、不會放大)。"""
+    factor = 1
+    while factor < 8 and math.ceil(max(width, height) / (factor * 2)) >= target_size:
+        factor *= 2
+    return factor
+
+
+def imread_reduced(image_path, target_size):
+    """
+    以 OpenCV (與 Ultralytics / cv2.imread 相同的解碼器) 直接解碼到接近 target_size 的解析度 (長邊不小於 target_size)：
+    JPEG 以 IMREAD_REDUCED_COLOR_{2,4,8} (libjpeg 的 DCT 縮放) 解碼，原圖尺寸只讀檔頭。
+    回傳 (BGR 陣列, 原圖尺寸 (w, h))；無法讀取時回傳 (None, None)。
+    """
+    import cv2
+
+    factor, size = 1, None
+    if image_path.lower().endswith(JPEG_EXTENSIONS):
+        try:
+            size = read_image_size(image_path)
+            factor = reduction_factor(*size, target_size)
+        except Exception:
+            pass  # 檔頭異常時退回一般解碼
+    if factor == 1:
+        im = cv2.imread(image_path)
+        return (im, (im.shape[1], im.shape[0])) if im is not None else (None, None)
+    im = cv2.imread(image_path, getattr(cv2, f'IMREAD_REDUCED_COLOR_{factor}'))
+    if im is None:
+        return None, None
+    width, height = size
+    if (im.shape[1] > im.shape[0]) != (width > height) and width != height:
+        width, height = height, width  # cv2 依 EXIF 旋轉，檔頭的尺寸是旋轉前的
+    return im, (width, height)
@@ -1,7 +1,18 @@
-from ultralytics import YOLO
 import os
 import glob
-from PIL import Image
+
+import numpy as np
+
+from backends import DEFAULT_BACKEND, resolve_weights
+from ensemble import WBF_IOU, fusion_params, load_detector
+from image_io import ImageMetaCache, imread_reduced
+from postprocess import boxes_to_numpy, build_prediction_string, rescale_boxes
+from profiling import NULL_PROFILER, StageProfiler, run_with_cprofile
+from result_cache import ResultCache, file_digests
+from server import RemoteModel
+from tta_cascade import CascadeStats, cascade_params, iter_cascade_predictions
+import sliced_inference
+from sliced_inference import iter_sliced_predictions
 
 # --- 配置參數 ---
 # 1. 您的權重檔案路徑
@@ -19,21 +30,261 @@ OUTPUT_FILENAME = "final.csv"
 # 5. 輸出檔案名稱
 OUTPUT_CSV_FILE = os.path.join(OUTPUT_DIR, OUTPUT_FILENAME)
 
-def generate_submission_csv():
-    # 載入模型
-    print(f"正在載入模型權重: {WEIGHTS_PATH}")
-    try:
-        model = YOLO(WEIGHTS_PATH)
-    except FileNotFoundError:
-        print(f"錯誤：找不到權重檔案於 {WEIGHTS_PATH}")
-        print("請確認路徑是否正確。")
-        return
+# 6. 推論參數
+CONF_THRESHOLD = 0.3  # Confidence Threshold
+IOU_THRESHOLD = 0.7   # IoU Threshold for NMS
+IMG_SIZE = 1920
+DEVICE = 1
+USE_TTA = True        # 啟用 TTA
+
+# 7. 批次推論大小：模型只載入一次，相近長寬比的圖片分在同一批以減少 letterbox 填充
+BATCH_SIZE = 8
+
+# 8. 圖片尺寸快取：每張圖片只讀一次檔頭
+IMAGE_META = ImageMetaCache()
+
+# 9. 推論模式："full" 整張圖片推論；"sliced" 切成重疊切片推論後合併 (切片參數見 sliced_inference.py)
+INFERENCE_MODE = "full"
+
+# 10. 效能剖析 (profiling.py)：結束時一律印出各階段 p50/p95/p99 摘要；以下路徑設為 None 時不輸出
+PROFILE_REPORT = None   # 例如 "submissions/profile.json"：各階段延遲百分位數、吞吐量、峰值記憶體
+CHROME_TRACE = None     # 例如 "submissions/trace.json"：以 chrome://tracing 或 ui.perfetto.dev 開啟
+CPROFILE_OUTPUT = None  # 例如 "submissions/inference.prof"：以 cProfile 執行整個流程
+
+# 11. 結果快取 (result_cache.py)：以模型權重、推論參數與圖片內容為鍵，重新執行時只推論新的或變動過的圖片
+RESULT_CACHE_DIR = None  # 預設停用；設為例如 "inference_cache/" 啟用
+
+# 12. 多模型集成 (ensemble.py)：列出多個權重時每個批次只解碼 / letterbox 一次，各模型的結果以加權框融合 (WBF) 合併
+ENSEMBLE_WEIGHTS_PATHS = None  # 例如 [WEIGHTS_PATH, "my_yolo_experiments/experiments2/weights/best.pt"]；None 時只用 WEIGHTS_PATH
+ENSEMBLE_MODEL_WEIGHTS = None  # 每個模型的融合權重，例如 [2, 1]；None 時皆為 1
+ENSEMBLE_WBF_IOU = WBF_IOU
+
+# 13. 推論後端 (backends.py)："torch" (eager PyTorch)、"torchscript"、"onnx" (ONNX Runtime)
+# 後兩者載入權重旁的匯出檔，先執行 python3 src/backends.py 匯出；CPU 上通常明顯快於 eager
+BACKEND = DEFAULT_BACKEND
+
+# 14. 常駐推論服務 (server.py)：例如 "http://127.0.0.1:8765" 或 "unix:/tmp/hw2_yolo.sock"
+# 設定時不在本程序載入模型，改把圖片 (或切片) 送到已啟動的 python3 src/server.py；權重、後端與集成設定以服務端為準
+INFERENCE_SERVER = None
+
+# 15. 選擇性 TTA (tta_cascade.py)：先不做 TTA 推論，只有不確定的圖片 (中等信心框多、hov / person、車輛擁擠) 再以 TTA 重新推論
+TTA_CASCADE = False  # 只在 USE_TTA = True 時有效；整張與切片模式皆適用
+
+# 16. 縮小解碼 (image_io.py)：JPEG 以 DCT 縮放 (cv2.IMREAD_REDUCED_COLOR_*) 直接解碼到接近 IMG_SIZE 的解析度，偵測框再換回原圖座標
+REDUCED_DECODE = False  # 只用於整張模式 (切片需要原始解析度)；原圖長邊 >= 2 * IMG_SIZE 的 JPEG 才有效果
+
+
+def collect_image_ids(image_paths):
+    """將 'imgXXXX' 檔名轉為純數字 ID，回傳按數字排序的 (numeric_id, path) 列表。"""
+    processed_paths = []
+    for path in image_paths:
+        base_name = os.path.splitext(os.path.basename(path))[0] # e.g., 'img0001'
+        
+        # --- 關鍵修改：提取純數字 ID ---
+        # 假設格式總是 'img' + 數字
+        try:
+            # 移除 'img' 前綴並轉換為整數 (自動去除前導零)
+            numeric_id = int(base_name.replace('img', ''))
+            processed_paths.append((numeric_id, path))
+        except ValueError:
+            print(f"警告: 檔案名 {base_name} 格式不符合 'imgXXXX'，將跳過。")
+            continue
+    
+    # 按數字 ID 排序
+    processed_paths.sort(key=lambda x: x[0])
+    return processed_paths
+
+
+def group_batches_by_aspect_ratio(processed_paths, batch_size=BATCH_SIZE, image_meta=None):
+    """
+    依長寬比 (再依尺寸) 排序後切成批次，讓同一批的圖片形狀盡量一致。
+    Ultralytics 在同批圖片尺寸相同時才使用最小填充的 letterbox，否則一律補成正方形。
+    無法讀取尺寸的圖片放在最後。尺寸只讀檔頭一次，並登記於 image_meta 供後續階段共用。
+    """
+    if image_meta is None:
+        image_meta = IMAGE_META
+    keyed = []
+    for numeric_id, path in processed_paths:
+        try:
+            width, height = image_meta.get(path)
+            key = (0, round(width / height, 2), width, height, numeric_id)
+        except Exception as e:
+            print(f"警告: 無法讀取圖片 {path} 的尺寸：{e}")
+            key = (1, 0.0, 0, 0, numeric_id)
+        keyed.append((key, numeric_id, path))
+    keyed.sort(key=lambda x: x[0])
+
+    ordered = [(numeric_id, path) for _, numeric_id, path in keyed]
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+def format_prediction_string(result):
+    """
+    將單張圖片的推論結果轉為 PredictionString (conf xmin ymin width height class_index ...)。
+    整組框一次搬到主機端後以 NumPy 向量化處理 (見 postprocess.py)。
+    """
+    return build_prediction_string(boxes_to_numpy(result.boxes))
+
+
+def format_prediction_string_per_box(result):
+    """
+    逐框版本的 format_prediction_string (原始實作)，保留作為對照與基準測試用。
+    xyxy 已是原圖像素座標，不需要再開啟圖片取得尺寸。
+    """
+    prediction_string = []
+    
+    if result.boxes:
+        boxes = result.boxes
+        
+        # 假設輸出格式為：conf xmin ymin width height class_index
+        for box in boxes:
+            conf = box.conf.item()     
+            cls = int(box.cls.item())  
+            x1, y1, x2, y2 = box.xyxy[0].tolist() 
+            
+            x_min = x1
+            y_min = y1
+            width = x2 - x1
+            height = y2 - y1
+            
+            prediction_string.append(
+                f"{conf:.6f} {x_min:.2f} {y_min:.2f} {width:.2f} {height:.2f} {cls}"
+            )
+
+    return " ".join(prediction_string)
+
+
+def predict_kwargs():
+    """model.predict 共用的推論參數 (不含 source / imgsz / batch)。"""
+    return dict(
+        conf=CONF_THRESHOLD,
+        iou=IOU_THRESHOLD,
+        device=DEVICE,
+        augment=USE_TTA # <--- 啟用 TTA！
+    )
+
+
+def model_paths():
+    """推論使用的權重列表 (未設定集成時只有 WEIGHTS_PATH)。"""
+    return list(ENSEMBLE_WEIGHTS_PATHS) if ENSEMBLE_WEIGHTS_PATHS else [WEIGHTS_PATH]
+
+
+def load_model(profiler=NULL_PROFILER):
+    """單一權重時為 YOLO 模型，多個權重時為 ensemble.EnsembleModel；兩者都以 .predict 推論。"""
+    return load_detector(model_paths(), DEVICE, ENSEMBLE_MODEL_WEIGHTS, ENSEMBLE_WBF_IOU, profiler, BACKEND)
+
+
+def inference_params(fusion=None):
+    """
+    決定推論結果的參數 (結果快取的鍵之一；裝置與批次大小不影響結果，不列入)。
+    fusion 為集成參數，None 時取自本檔的設定 (使用推論服務時改用服務端回報的設定)。
+    """
+    params = dict(mode=INFERENCE_MODE, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, augment=USE_TTA)
+    params.update(fusion_params(model_paths(), ENSEMBLE_MODEL_WEIGHTS, ENSEMBLE_WBF_IOU) if fusion is None else fusion)
+    if INFERENCE_MODE == "sliced":
+        params.update(
+            tile_size=sliced_inference.TILE_SIZE,
+            tile_overlap=sliced_inference.TILE_OVERLAP,
+            merge=sliced_inference.MERGE_METHOD,
+            merge_iou=sliced_inference.MERGE_IOU,
+            include_full_frame=sliced_inference.INCLUDE_FULL_FRAME,
+            full_frame_imgsz=sliced_inference.FULL_FRAME_IMG_SIZE,
+        )
+    else:
+        params.update(imgsz=IMG_SIZE)
+        if REDUCED_DECODE:
+            params.update(reduced_decode=True)
+    return params
+
+
+def iter_full_frame_predictions(model, processed_paths, batch_size=BATCH_SIZE, profiler=NULL_PROFILER, kwargs=None):
+    """
+    整張圖片的批次推論：依長寬比分批，模型只載入一次。
+    產出 (numeric_id, (N, 6) x1 y1 x2 y2 conf cls)，順序為批次順序。
+    profiler 記錄每張圖片的模型呼叫 (predict，含讀圖) 與 Ultralytics 回報的 preprocess / forward / nms 時間。
+    kwargs 可覆寫 predict_kwargs() (例如 rescore.py 以極低門檻保存原始偵測結果)。
+    REDUCED_DECODE 時由本程序縮小解碼後以陣列推論，框換回原圖座標；無法讀取的圖片產出空結果。
+    """
+    with profiler.stage("read_sizes"):
+        batches = group_batches_by_aspect_ratio(processed_paths, batch_size)
+    print(f"共 {len(processed_paths)} 張圖片，分為 {len(batches)} 個批次 (batch_size={batch_size})。")
+
+    for batch_num, batch in enumerate(batches, start=1):
+        batch_paths = [path for _, path in batch]
+        print(f"-> 正在推論批次 {batch_num}/{len(batches)} ({len(batch_paths)} 張圖片)...")
+
+        source = batch_paths
+        if REDUCED_DECODE:
+            decoded = []
+            for path in batch_paths:
+                with profiler.stage("decode"):
+                    im, original_size = imread_reduced(path, IMG_SIZE)
+                if im is None:
+                    print(f"警告：無法讀取圖片 {path}。")
+                decoded.append((im, original_size))
+            source = [im for im, _ in decoded if im is not None]
+        else:
+            decoded = [(path, None) for path in batch_paths]  # 由 Ultralytics 讀取，座標已是原圖尺寸
+
+        # --- 進行批次推論 ---
+        results = model.predict(
+            source=source,
+            imgsz=IMG_SIZE,
+            batch=len(source),
+            stream=True,
+            verbose=False,
+            **(kwargs or predict_kwargs())
+        )
+
+        # 結果順序與輸入順序一致
+        results = iter(results) if source else iter(())
+        for (numeric_id, _), (im, original_size) in zip(batch, decoded):
+            if im is None:
+                yield numeric_id, np.zeros((0, 6), dtype=np.float32)
+                continue
+            with profiler.stage("predict"):
+                result = next(results)
+            profiler.record_ultralytics_speed(result)
+            with profiler.stage("to_numpy"):
+                data = boxes_to_numpy(result.boxes)
+                if original_size is not None:
+                    data = rescale_boxes(data, (result.orig_shape[1], result.orig_shape[0]), original_size)
+            yield numeric_id, data
+
+
+def generate_submission_csv(batch_size=BATCH_SIZE, profile_report=PROFILE_REPORT, chrome_trace=CHROME_TRACE,
+                            cache_dir=RESULT_CACHE_DIR):
+    profiler = StageProfiler()
+
+    fusion = None
+    backend = BACKEND
+    if INFERENCE_SERVER:
+        # 常駐推論服務：模型已在服務端載入，權重、後端與集成設定以服務回報的為準
+        try:
+            remote = RemoteModel(INFERENCE_SERVER)
+            health = remote.client.health()
+        except (OSError, RuntimeError) as e:
+            print(f"錯誤：無法連線到推論服務 {INFERENCE_SERVER}：{e}")
+            return
+        backend_paths, backend, fusion = health["weights"], health["backend"], health["fusion"]
+    else:
+        for weights_path in model_paths():
+            if not os.path.exists(weights_path):
+                print(f"錯誤：找不到權重檔案於 {weights_path}")
+                print("請確認路徑是否正確。")
+                return
+        try:
+            backend_paths = [resolve_weights(weights_path, BACKEND) for weights_path in model_paths()]
+        except FileNotFoundError as e:
+            print(f"錯誤：{e}")
+            return
 
     # 獲取所有圖片檔案的路徑
     # 支援常見的圖片格式
     image_paths = []
-    for ext in ['*.jpg', '*.jpeg', '*.png', '*.webp']:
-        image_paths.extend(glob.glob(os.path.join(SOURCE_DIR, ext)))
+    with profiler.stage("list_files"):
+        for ext in ['*.jpg', '*.jpeg', '*.png', '*.webp']:
+            image_paths.extend(glob.glob(os.path.join(SOURCE_DIR, ext)))
         
     if not image_paths:
         print(f"錯誤：在資料夾 {SOURCE_DIR} 中找不到任何圖片。請確認路徑。")
@@ -48,88 +299,96 @@ def generate_submission_csv():
         print(f"錯誤：無法創建輸出目錄 {OUTPUT_DIR}。原因: {e}")
         return
 
-    # 準備寫入 CSV 檔案
-    print(f"將結果寫入 {OUTPUT_CSV_FILE}...")
-    with open(OUTPUT_CSV_FILE, 'w') as f:
-        # 寫入 CSV 標題
-        f.write("Image_ID,PredictionString\n")
-
-        # 逐一處理每張圖片
-        # ⚠️ 由於 Image_ID 現在是數字，我們按數字排序以確保順序正確
-        # 為了正確排序，我們需要一個 (數字ID, 檔案路徑) 的列表
-        processed_paths = []
-        for path in image_paths:
-            base_name = os.path.splitext(os.path.basename(path))[0] # e.g., 'img0001'
-            
-            # --- 關鍵修改：提取純數字 ID ---
-            # 假設格式總是 'img' + 數字
-            try:
-                # 移除 'img' 前綴並轉換為整數 (自動去除前導零)
-                numeric_id = int(base_name.replace('img', ''))
-                processed_paths.append((numeric_id, path))
-            except ValueError:
-                print(f"警告: 檔案名 {base_name} 格式不符合 'imgXXXX'，將跳過。")
-                continue
-        
-        # 按數字 ID 排序
-        processed_paths.sort(key=lambda x: x[0])
+    # ⚠️ 由於 Image_ID 現在是數字，我們按數字排序以確保順序正確
+    processed_paths = collect_image_ids(image_paths)
 
+    # 選擇性 TTA：只有第一輪 (無 TTA) 判定為不確定的圖片才以 TTA 重新推論
+    cascade = CascadeStats() if TTA_CASCADE and USE_TTA else None
 
-        for numeric_id, image_path in processed_paths:
-            
-            # 將 Image_ID 設置為純數字
-            image_id = str(numeric_id) # e.g., '1', '2', ...
-            
-            # --- 進行推論 (不變) ---
-            results = model.predict(
-                source=image_path,
-                conf=0.3,  #Confidence Threshold 
-                iou=0.7,  #IoU Threshold for NMS
-                imgsz=1920,
-                device=1,
-                verbose=False,
-                augment=True # <--- 啟用 TTA！
-            )
-            
-            # --- 處理推論結果並格式化 PredictionString (不變) ---
-            prediction_string = []
-            
-            if results and results[0].boxes:
-                boxes = results[0].boxes
-                
-                try:
-                    img = Image.open(image_path)
-                    original_h, original_w = img.height, img.width
-                    img.close()
-                except Exception as e:
-                    print(f"無法讀取圖片 {image_path} 的大小：{e}。跳過。")
-                    continue
-                
-                # 假設輸出格式為：conf xmin ymin width height class_index
-                for box in boxes:
-                    conf = box.conf.item()     
-                    cls = int(box.cls.item())  
-                    x1, y1, x2, y2 = box.xyxy[0].tolist() 
-                    
-                    x_min = x1
-                    y_min = y1
-                    width = x2 - x1
-                    height = y2 - y1
-                    
-                    prediction_string.append(
-                        f"{conf:.6f} {x_min:.2f} {y_min:.2f} {width:.2f} {height:.2f} {cls}"
-                    )
-
-                final_prediction = " ".join(prediction_string)
-            
-            else:
-                final_prediction = ""
-            
-            # 寫入 CSV
-            f.write(f"{image_id},{final_prediction}\n") # 確保 Image_ID 是純數字
+    # 結果快取：已有結果的圖片不再推論
+    cache = None
+    pending_paths = processed_paths
+    if cache_dir:
+        cache_params = inference_params(fusion)
+        if cascade is not None:
+            cache_params.update(tta_cascade=cascade_params())
+        cache = ResultCache(cache_dir, backend_paths, cache_params)
+        with profiler.stage("hash_images"):
+            digests = dict(zip(
+                (numeric_id for numeric_id, _ in processed_paths),
+                file_digests([path for _, path in processed_paths]),
+            ))
+        pending_paths = [(numeric_id, path) for numeric_id, path in processed_paths if digests[numeric_id] not in cache]
+        print(f"結果快取 {cache_dir}：{len(processed_paths) - len(pending_paths)} 張已有結果，{len(pending_paths)} 張需要推論。")
+
+    predictions = {}
+    model = None
+    if pending_paths:
+        if INFERENCE_SERVER:
+            print(f"使用推論服務 {INFERENCE_SERVER}: {', '.join(backend_paths)} (後端: {backend})")
+            model = remote
+        else:
+            # 載入模型 (整個流程只載入一次)
+            print(f"正在載入模型權重: {', '.join(backend_paths)} (後端: {BACKEND})")
+            with profiler.stage("load_model"):
+                model = load_model(profiler)
+
+        if INFERENCE_MODE == "sliced":
+            print("使用切片推論模式 (sliced)。")
+            run = lambda items, kwargs: iter_sliced_predictions(model, items, kwargs, profiler=profiler)
+        else:
+            run = lambda items, kwargs: iter_full_frame_predictions(model, items, batch_size, profiler, kwargs)
+        if cascade is not None:
+            print("使用選擇性 TTA：先不做 TTA 推論，不確定的圖片再以 TTA 重新推論。")
+            detections = iter_cascade_predictions(run, pending_paths, predict_kwargs(), cascade)
+        else:
+            detections = run(pending_paths, predict_kwargs())
+
+        for numeric_id, data in detections:
+            # 每張圖片推論完立即寫入快取，中斷後重新執行只需處理剩下的圖片
+            if cache is not None:
+                with profiler.stage("cache_write"):
+                    cache.put(digests[numeric_id], data)
+            with profiler.stage("postprocess"):
+                predictions[numeric_id] = build_prediction_string(data)
+            profiler.add_images(1)
+
+    # 未重新推論的圖片由快取產生
+    for numeric_id, _ in processed_paths:
+        if numeric_id not in predictions:
+            with profiler.stage("cache_read"):
+                predictions[numeric_id] = build_prediction_string(cache.get(digests[numeric_id]))
+    if cache is not None:
+        cache.close()
+
+    # 準備寫入 CSV 檔案 (按數字 ID 排序)；先寫暫存檔再改名，中斷時不會留下寫到一半的 CSV
+    print(f"將結果寫入 {OUTPUT_CSV_FILE}...")
+    tmp_path = OUTPUT_CSV_FILE + ".tmp"
+    with profiler.stage("write_csv"):
+        with open(tmp_path, 'w') as f:
+            # 寫入 CSV 標題
+            f.write("Image_ID,PredictionString\n")
+            for numeric_id, _ in processed_paths:
+                # 將 Image_ID 設置為純數字
+                f.write(f"{numeric_id},{predictions[numeric_id]}\n") # 確保 Image_ID 是純數字
+        os.replace(tmp_path, OUTPUT_CSV_FILE)
+    profiler.finish()
 
     print(f"\n成功生成 {OUTPUT_CSV_FILE}。共處理 {len(processed_paths)} 張圖片。")
 
+    profiler.print_report()
+    if hasattr(model, "print_model_report"):
+        model.print_model_report()
+    if cascade is not None and cascade.images:
+        cascade.print_report()
+    if profile_report:
+        profiler.save_report(profile_report)
+    if chrome_trace:
+        profiler.save_chrome_trace(chrome_trace)
+
 if __name__ == '__main__':
     # ⚠️ 在執行前，請務必確認 WEIGHTS_PATH 和 SOURCE_DIR 正確！
-    generate_submission_csv()
\ No newline at end of file
+    if CPROFILE_OUTPUT:
+        run_with_cprofile(generate_submission_csv, CPROFILE_OUTPUT)
+    else:
+        generate_submission_csv()
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from label_store import LabelStore, label_store_path
+
+# --- 設定 ---
+# 類別數與名稱 (需與 hw2_dataset.yaml 一致)
+NUM_CLASSES = 4
+CLASS_NAMES = ["car", "hov", "person", "motorcycle"]
+# --- 結束設定 ---
+
+# names: (N,) 標籤檔的 base name (e.g., "img0001")
+# counts: (N, NUM_CLASSES) int32，每張圖片每個類別的框數
+LabelIndex = namedtuple("LabelIndex", ["names", "counts"])
+
+
+def default_cache_path(label_dir):
+    """索引快取放在標籤資料夾旁 (e.g., ../data/train_yolo_labels_index.npz)，避免混入標籤檔。"""
+    return os.path.normpath(label_dir) + "_index.npz"
+
+
+def count_classes(label_path, num_classes=NUM_CLASSES):
+    """讀取單一 YOLO 標籤檔，回傳每個類別的框數 (只解析每行第一欄)。"""
+    counts = np.zeros(num_classes, dtype=np.int32)
+    with open(label_path, "r") as f:
+        for line in f:
+            parts = line.split(maxsplit=1)
+            if not parts:
+                continue
+            cls = int(float(parts[0]))
+            if 0 <= cls < num_classes:
+                counts[cls] += 1
+    return counts
+
+
+def _scan_label_dir(label_dir):
+    """單次 os.scandir 取得所有 .txt 標籤檔的 (name, path, mtime_ns, size)。"""
+    entries = []
+    with os.scandir(label_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".txt"):
+                stat = entry.stat()
+                entries.append((os.path.splitext(entry.name)[0], entry.path, stat.st_mtime_ns, stat.st_size))
+    entries.sort()
+    return entries
+
+
+def index_from_store(store, num_classes=NUM_CLASSES):
+    """由打包標籤 (label_store.py) 直接計算類別直方圖：一次 bincount，不需讀取任何 .txt。"""
+    image_of_box = np.repeat(np.arange(len(store)), store.counts)
+    cls = store.labels[:, 0].astype(np.int64)
+    valid = (cls >= 0) & (cls < num_classes)
+    flat = np.bincount(image_of_box[valid] * num_classes + cls[valid], minlength=len(store) * num_classes)
+    return LabelIndex(names=list(store.names), counts=flat.reshape(len(store), num_classes).astype(np.int32))
+
+
+def build_label_index(label_dir, num_classes=NUM_CLASSES, cache_path=None, verbose=True):
+    """
+    建立每張圖片的類別直方圖索引，並快取到磁碟。
+    標籤資料夾有打包檔時直接由打包檔計算；否則快取中記錄每個標籤檔的 mtime / size，只重新解析有變動或新增的檔案。
+    """
+    store_path = label_store_path(label_dir)
+    if os.path.exists(store_path):
+        index = index_from_store(LabelStore.load(store_path), num_classes)
+        if verbose:
+            print(f"標籤索引：由打包標籤檔 {store_path} 計算 {len(index.names)} 張圖片")
+        return index
+
+    if cache_path is None:
+        cache_path = default_cache_path(label_dir)
+
+    entries = _scan_label_dir(label_dir)
+
+    cached = {}
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if int(data["num_classes"]) == num_classes:
+                    for name, mtime, size, row in zip(data["names"].tolist(), data["mtimes"], data["sizes"], data["counts"]):
+                        cached[name] = (int(mtime), int(size), row)
+        except Exception as e:
+            print(f"警告：無法讀取標籤索引快取 {cache_path}: {e}。將重新建立。")
+
+    names, mtimes, sizes = [], [], []
+    counts = np.zeros((len(entries), num_classes), dtype=np.int32)
+    reparsed = 0
+    for i, (name, path, mtime, size) in enumerate(entries):
+        hit = cached.get(name)
+        if hit is not None and hit[0] == mtime and hit[1] == size:
+            counts[i] = hit[2]
+        else:
+            counts[i] = count_classes(path, num_classes)
+            reparsed += 1
+        names.append(name)
+        mtimes.append(mtime)
+        sizes.append(size)
+
+    if reparsed or len(cached) != len(entries):
+        np.savez(
+            cache_path,
+            names=np.array(names, dtype=str),
+            mtimes=np.array(mtimes, dtype=np.int64),
+            sizes=np.array(sizes, dtype=np.int64),
+            counts=counts,
+            num_classes=num_classes,
+        )
+    if verbose:
+        print(f"標籤索引：{len(entries)} 個標籤檔，重新解析 {reparsed} 個 (快取: {cache_path})")
+
+    return LabelIndex(names=names, counts=counts)
+
+
+def counts_for(index, names, num_classes=NUM_CLASSES):
+    """依 names 順序取出類別直方圖；索引中沒有的圖片 (無標籤檔) 為全 0。"""
+    row_of = {name: i for i, name in enumerate(index.names)}
+    counts = np.zeros((len(names), num_classes), dtype=np.int32)
+    for i, name in enumerate(names):
+        j = row_of.get(name)
+        if j is not None:
+            counts[i] = index.counts[j]
+    return counts
+
+
+def iterative_stratified_split(counts, val_ratio, seed=42):
+    """
+    以框數為權重的多標籤迭代分層分割 (Sechidis et al., 2011)。
+    由剩餘框數最少的 (最稀有) 類別開始，將含該類別的圖片分配給該類別尚缺最多框的子集，
+    使每個類別在驗證集中的框數比例接近 val_ratio。回傳 (N,) 陣列：0 = train, 1 = val。
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.asarray(counts, dtype=np.int64)
+    n = len(counts)
+    ratios = np.array([1.0 - val_ratio, val_ratio])
+    desired_boxes = ratios[:, None] * counts.sum(axis=0)[None, :].astype(np.float64)
+    desired_images = ratios * n
+
+    assignment = np.full(n, -1, dtype=np.int64)
+    remaining = np.ones(n, dtype=bool)
+
+    def assign(i, subset):
+        assignment[i] = subset
+        desired_boxes[subset] -= counts[i]
+        desired_images[subset] -= 1
+        remaining[i] = False
+
+    def pick(scores, tie_break):
+        best = np.flatnonzero(scores == scores.max())
+        if len(best) > 1:
+            tb = tie_break[best]
+            best = best[tb == tb.max()]
+        return int(best[0]) if len(best) == 1 else int(rng.choice(best))
+
+    while True:
+        remaining_boxes = counts[remaining].sum(axis=0)
+        if not (remaining_boxes > 0).any():
+            break
+        c = int(np.argmin(np.where(remaining_boxes > 0, remaining_boxes, np.iinfo(np.int64).max)))
+        for i in rng.permutation(np.flatnonzero(remaining & (counts[:, c] > 0))):
+            assign(i, pick(desired_boxes[:, c], desired_images))
+
+    # 沒有任何框的圖片依剩餘的圖片配額分配
+    for i in rng.permutation(np.flatnonzero(remaining)):
+        assign(i, pick(desired_images, desired_images))
+
+    return assignment
+
+
+def summarize_split(counts, assignment, class_names=CLASS_NAMES):
+    """列印每個類別在 train / val 的框數與驗證集比例。"""
+    counts = np.asarray(counts)
+    train_boxes = counts[assignment == 0].sum(axis=0)
+    val_boxes = counts[assignment == 1].sum(axis=0)
+    print(f"{'class':<12}{'train':>8}{'val':>8}{'val %':>8}")
+    for c, name in enumerate(class_names):
+        total = train_boxes[c] + val_boxes[c]
+        share = val_boxes[c] / total * 100 if total else 0.0
+        print(f"{name:<12}{train_boxes[c]:>8}{val_boxes[c]:>8}{share:>7.1f}%")
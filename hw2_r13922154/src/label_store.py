@@ -0,0 +1,110 @@
+import os
+import argparse
+
+import numpy as np
+
+# 打包標籤格式 (單一 .npz 取代每張圖片一個 .txt)：
+#   names   (M,)     圖片 base name (e.g., "img0001")
+#   sizes   (M, 2)   圖片原始尺寸 (width, height)
+#   offsets (M,)     每張圖片的標籤在 labels 中的起始列
+#   counts  (M,)     每張圖片的框數
+#   labels  (N, 5)   float32 (cls, x_center, y_center, w, h)，YOLO 正規化座標
+STORE_SUFFIX = ".labels.npz"
+
+
+def label_store_path(label_dir):
+    """標籤資料夾對應的打包檔，e.g., train_yolo_labels -> train_yolo_labels.labels.npz (符號連結會先解析)"""
+    return os.path.realpath(os.path.normpath(label_dir)) + STORE_SUFFIX
+
+
+class LabelStore:
+    """打包標籤的讀寫：一個 float32 (N, 5) 陣列 + 每張圖片的 offset / count 索引 + 圖片尺寸。"""
+
+    def __init__(self, names, sizes, offsets, counts, labels):
+        self.names = list(names)
+        self.sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.float32).reshape(-1, 5)
+        self._row_of = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_arrays(cls, names, label_arrays, sizes):
+        """由每張圖片的 (n, 5) 標籤陣列建立；names / label_arrays / sizes 順序一致。"""
+        counts = np.array([len(x) for x in label_arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64) if len(counts) else np.zeros(0, np.int64)
+        labels = np.concatenate(label_arrays) if label_arrays else np.zeros((0, 5), dtype=np.float32)
+        return cls(names, sizes, offsets, counts, labels)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["names"].tolist(), data["sizes"], data["offsets"], data["counts"], data["labels"])
+
+    def save(self, path):
+        # 先寫入暫存檔再改名，避免中斷時留下損壞的打包檔
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            names=np.array(self.names, dtype=str),
+            sizes=self.sizes,
+            offsets=self.offsets,
+            counts=self.counts,
+            labels=self.labels,
+        )
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._row_of
+
+    def row_of(self, name):
+        return self._row_of.get(name, -1)
+
+    def get(self, name):
+        """回傳該圖片的 (n, 5) 標籤；不存在時回傳 None。"""
+        row = self._row_of.get(name)
+        if row is None:
+            return None
+        start = self.offsets[row]
+        return self.labels[start:start + self.counts[row]]
+
+    def size_of(self, name):
+        row = self._row_of.get(name)
+        return None if row is None else tuple(int(x) for x in self.sizes[row])
+
+    def subset(self, names):
+        """只保留 names 中 (且存在於本檔) 的圖片，依 names 順序。"""
+        keep = [n for n in names if n in self._row_of]
+        return LabelStore.from_arrays(keep, [self.get(n) for n in keep], [self.sizes[self._row_of[n]] for n in keep])
+
+
+def format_yolo_lines(labels):
+    """(n, 5) 標籤 -> YOLO .txt 的各行 (與轉換腳本相同的 .6f 格式)。"""
+    labels = np.asarray(labels, dtype=np.float64)
+    return [
+        f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+        for c, x, y, w, h in labels.tolist()
+    ]
+
+
+def export_txt(store, output_dir):
+    """將打包標籤匯出為每張圖片一個 YOLO .txt 檔 (相容舊流程)。回傳寫出的檔案數。"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in store.names:
+        with open(os.path.join(output_dir, name + ".txt"), "w") as f:
+            for line in format_yolo_lines(store.get(name)):
+                f.write(line + "\n")
+    return len(store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a packed label store back to per-image YOLO .txt files.")
+    parser.add_argument("--store", type=str, required=True, help="Path to the packed label store (e.g., train_yolo_labels.labels.npz).")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory to write the .txt label files to.")
+
+    args = parser.parse_args()
+    count = export_txt(LabelStore.load(args.store), args.output_dir)
+    print(f"Exported {count} label files to {args.output_dir}")
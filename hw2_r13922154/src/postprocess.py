@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def boxes_to_numpy(boxes):
+    """
+    將整個 Boxes 的 data (N, 6: x1 y1 x2 y2 conf cls) 一次搬到主機端。
+    取代逐框 .item() / .tolist()，整張圖片只做一次 device -> host 同步。
+    """
+    data = boxes.data
+    if hasattr(data, 'cpu'):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32)
+    return data.reshape(-1, data.shape[-1]) if data.size else np.zeros((0, 6), dtype=np.float32)
+
+
+def rescale_boxes(data, from_size, to_size):
+    """
+    將 (N, 6) 偵測結果的 xyxy 由縮小解碼後的影像尺寸 from_size (w, h) 換回原圖尺寸 to_size (w, h)。
+    尺寸相同時原樣回傳。
+    """
+    if tuple(from_size) == tuple(to_size) or len(data) == 0:
+        return data
+    data = data.copy()
+    data[:, [0, 2]] *= to_size[0] / from_size[0]
+    data[:, [1, 3]] *= to_size[1] / from_size[1]
+    return data
+
+
+def build_prediction_string(data):
+    """
+    由 boxes_to_numpy 的輸出產生 PredictionString (conf xmin ymin width height class_index ...)，
+    座標換算以陣列運算完成，輸出與逐框版本完全一致。
+    """
+    if len(data) == 0:
+        return ""
+    xyxy = data[:, :4].astype(np.float64)
+    conf = data[:, -2].astype(np.float64).tolist()
+    cls = data[:, -1].astype(np.int64).tolist()
+    x_min, y_min = xyxy[:, 0].tolist(), xyxy[:, 1].tolist()
+    width = (xyxy[:, 2] - xyxy[:, 0]).tolist()
+    height = (xyxy[:, 3] - xyxy[:, 1]).tolist()
+    return " ".join(
+        f"{c:.6f} {x:.2f} {y:.2f} {w:.2f} {h:.2f} {k}"
+        for c, x, y, w, h, k in zip(conf, x_min, y_min, width, height, cls)
+    )
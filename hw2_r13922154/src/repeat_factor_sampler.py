@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import yaml
+
+from label_index import CLASS_NAMES, build_label_index, counts_for
+
+# --- 設定 ---
+# LVIS 的 repeat factor 門檻 t：出現於少於 t 比例圖片中的類別會被重複取樣。
+# LVIS 有 1203 類時使用 0.001；本資料集只有 4 類，需較大的 t 才能影響 hov / person。
+REPEAT_THRESHOLD = 0.25
+RANDOM_SEED = 0
+# --- 結束設定 ---
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+
+def compute_repeat_factors(counts, threshold=REPEAT_THRESHOLD):
+    """
+    LVIS repeat factor sampling (Gupta et al., 2019)：
+    類別 c 的 r(c) = max(1, sqrt(t / f(c)))，f(c) 為含有 c 的圖片比例；
+    圖片 i 的 r(i) = 其所含類別 r(c) 的最大值 (無任何框時為 1)。
+    回傳 (per_image, per_class)。
+    """
+    present = np.asarray(counts) > 0
+    image_freq = present.mean(axis=0) if len(present) else np.zeros(present.shape[1])
+    with np.errstate(divide="ignore"):
+        per_class = np.maximum(1.0, np.sqrt(threshold / image_freq))
+    per_class[image_freq == 0] = 1.0
+    per_image = np.where(present, per_class[None, :], 1.0).max(axis=1) if len(present) else np.zeros(0)
+    return per_image, per_class
+
+
+def sample_repeats(repeat_factors, seed=RANDOM_SEED):
+    """隨機進位：每張圖片重複 floor(r) 次，再以 r 的小數部分為機率多取一次。"""
+    rng = np.random.default_rng(seed)
+    repeat_factors = np.asarray(repeat_factors, dtype=np.float64)
+    whole = np.floor(repeat_factors)
+    return (whole + (rng.random(len(repeat_factors)) < repeat_factors - whole)).astype(np.int64)
+
+
+def image_to_label_path(image_path):
+    """與 Ultralytics 相同的規則：把路徑中最後一個 /images/ 換成 /labels/，副檔名改為 .txt。"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return sb.join(image_path.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt"
+
+
+def list_train_images(dataset_dir):
+    """列出訓練集圖片：優先使用 manifest 模式的 train.txt，否則掃描 images/train。"""
+    manifest = os.path.join(dataset_dir, "train.txt")
+    if os.path.exists(manifest):
+        with open(manifest, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+    image_dir = os.path.join(dataset_dir, "images", "train")
+    with os.scandir(image_dir) as entries:
+        return sorted(
+            os.path.abspath(entry.path) for entry in entries
+            if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def write_repeat_factor_list(dataset_dir, output_path, threshold=REPEAT_THRESHOLD, seed=RANDOM_SEED):
+    """
+    以快取的標籤統計索引計算每張訓練圖片的 repeat factor，
+    寫出重複取樣後的圖片清單 (YOLO 可直接讀取的 .txt)。回傳寫出的行數。
+    """
+    image_paths = list_train_images(dataset_dir)
+    if not image_paths:
+        print(f"錯誤：在 {dataset_dir} 中找不到訓練圖片。")
+        return 0
+
+    label_dir = os.path.dirname(image_to_label_path(image_paths[0]))
+    index = build_label_index(label_dir)
+    counts = counts_for(index, [os.path.splitext(os.path.basename(p))[0] for p in image_paths])
+
+    per_image, per_class = compute_repeat_factors(counts, threshold)
+    repeats = sample_repeats(per_image, seed)
+
+    with open(output_path, "w") as f:
+        for path, n in zip(image_paths, repeats.tolist()):
+            for _ in range(n):
+                f.write(path + "\n")
+
+    print(f"Repeat factor sampling (t={threshold}):")
+    for name, r in zip(CLASS_NAMES, per_class.tolist()):
+        print(f"  {name:<12} r(c) = {r:.2f}")
+    class_exposure = (counts * repeats[:, None]).sum(axis=0)
+    print(f"  圖片數 {len(image_paths)} -> {int(repeats.sum())}，每 epoch 各類別框數: "
+          + ", ".join(f"{n}={int(c)}" for n, c in zip(CLASS_NAMES, class_exposure)))
+    return int(repeats.sum())
+
+
+def build_rfs_data_yaml(data_yaml, dataset_dir, output_yaml=None, threshold=REPEAT_THRESHOLD, seed=RANDOM_SEED):
+    """
+    產生一份新的資料設定檔，train 指向重複取樣後的圖片清單，其餘設定 (val, names, ...) 不變。
+    回傳新設定檔路徑；失敗時回傳原始 data_yaml。
+    """
+    list_path = os.path.abspath(os.path.join(dataset_dir, "train_rfs.txt"))
+    if write_repeat_factor_list(dataset_dir, list_path, threshold, seed) == 0:
+        return data_yaml
+
+    with open(data_yaml, "r") as f:
+        data = yaml.safe_load(f)
+    data["train"] = list_path
+
+    if output_yaml is None:
+        output_yaml = os.path.splitext(data_yaml)[0] + "_rfs.yaml"
+    with open(output_yaml, "w") as f:
+        yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+    return output_yaml
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+
+import numpy as np
+
+import inference
+from box_ops import batched_nms
+from dataset_cache import list_image_files, label_path_for, load_label_store_for, read_yolo_labels, image_stem
+from evaluate import match_image, summarize, IOU_THRESHOLDS
+from sliced_inference import iter_sliced_predictions
+
+# --- 設定 ---
+# 原始偵測結果只推論一次：以極低的 conf 與寬鬆的 NMS 保存所有候選框，之後任何 conf / iou / max_det 組合都在 CPU 上離線重算。
+# 離線結果只是直接推論的近似 (需 iou <= RAW_IOU、conf >= RAW_CONF)，不保證相同：
+#   1. 對 NMS(RAW_IOU) 的輸出再做 NMS(t) 不等於直接 NMS(t)。例如信心值 A > B > C、t=0.5、IoU(A,B)=0.52、IoU(B,C)=0.92、IoU(A,C)=0.48：
+#      直接 NMS 中 B 被 A 抑制，C 得以保留；兩階段時 C 已先被 B 抑制，而 B 之後又被 A 抑制，C 因此消失。
+#   2. RAW_MAX_DET 在第二次 NMS 之前就截斷候選框，被截掉的框在離線重算時無法復原。
+# 切片模式另受 sliced_inference.MERGE_IOU 的合併影響。
+RAW_CONF = 0.001
+RAW_IOU = 0.9
+RAW_MAX_DET = 1000
+VAL_SOURCE = "../data/datasets/images/val"       # 有標籤的驗證集 (資料夾或 val.txt 清單)
+VAL_RAW_FILE = "submissions/raw_val.npz"
+TEST_RAW_FILE = "submissions/raw_test.npz"       # 測試集 (inference.SOURCE_DIR) 的原始偵測結果
+SWEEP_CONFS = [0.001, 0.01, 0.05, 0.1, 0.2, 0.3]
+SWEEP_IOUS = [0.5, 0.6, 0.7]
+SWEEP_MAX_DETS = [300]
+SWEEP_RESULTS_FILE = "submissions/rescore_sweep.json"
+RESCORED_CSV_FILE = "submissions/rescored.csv"   # 以驗證集 mAP50:95 最佳的設定產生的提交檔
+# --- 結束設定 ---
+
+# 原始偵測結果的打包格式 (與 label_store.py 相同的 offset / count 索引)：
+#   paths   (M,)     圖片路徑
+#   sizes   (M, 2)   圖片尺寸 (width, height)
+#   offsets / counts (M,)
+#   dets    (N, 6)   float32 x1 y1 x2 y2 conf cls (原圖像素座標)，每張圖片內依 conf 由高到低
+#   params  推論參數 (JSON 字串)
+
+
+class DetectionStore:
+    def __init__(self, paths, sizes, offsets, counts, dets, params):
+        self.paths = list(paths)
+        self.sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.dets = np.asarray(dets, dtype=np.float32).reshape(-1, 6)
+        self.params = params
+
+    @classmethod
+    def from_arrays(cls, paths, det_arrays, sizes, params):
+        counts = np.array([len(x) for x in det_arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64) if len(counts) else np.zeros(0, np.int64)
+        dets = np.concatenate(det_arrays) if det_arrays else np.zeros((0, 6), dtype=np.float32)
+        return cls(paths, sizes, offsets, counts, dets, params)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["paths"].tolist(), data["sizes"], data["offsets"], data["counts"], data["dets"],
+                       json.loads(str(data["params"])))
+
+    def save(self, path):
+        # 先寫入暫存檔再改名，避免中斷時留下損壞的檔案
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            paths=np.array(self.paths, dtype=str),
+            sizes=self.sizes,
+            offsets=self.offsets,
+            counts=self.counts,
+            dets=self.dets,
+            params=json.dumps(self.params),
+        )
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, i):
+        return self.dets[self.offsets[i]:self.offsets[i] + self.counts[i]]
+
+
+def raw_predict_kwargs():
+    return dict(inference.predict_kwargs(), conf=RAW_CONF, iou=RAW_IOU, max_det=RAW_MAX_DET)
+
+
+def dump_raw_detections(model, image_source, output_path):
+    """以極低門檻推論 image_source (資料夾或 .txt 圖片清單) 並保存原始偵測結果 (沿用 inference.INFERENCE_MODE)。"""
+    image_paths = list_image_files(image_source)
+    if not image_paths:
+        print(f"錯誤：在 {image_source} 中找不到任何圖片。")
+        return None
+    items = list(enumerate(image_paths))
+    kwargs = raw_predict_kwargs()
+    print(f"正在保存 {len(image_paths)} 張圖片的原始偵測結果 ({image_source})...")
+    if inference.INFERENCE_MODE == "sliced":
+        detections = iter_sliced_predictions(model, items, kwargs)
+    else:
+        detections = inference.iter_full_frame_predictions(model, items, kwargs=kwargs)
+
+    det_arrays = [np.zeros((0, 6), dtype=np.float32)] * len(image_paths)
+    for i, data in detections:
+        det_arrays[i] = data[np.argsort(-data[:, 4], kind="stable")]
+    sizes = [inference.IMAGE_META.get(path) for path in image_paths]
+
+    params = dict(inference.inference_params(), conf=RAW_CONF, iou=RAW_IOU, max_det=RAW_MAX_DET)
+    store = DetectionStore.from_arrays(image_paths, det_arrays, sizes, params)
+    store.save(output_path)
+    print(f"已將 {len(store.dets)} 個原始偵測框寫入 {output_path}")
+    return store
+
+
+def nms_sorted(dets, iou_threshold):
+    """
+    類別感知 NMS，回傳依 conf 由高到低的保留框。
+    低分框不會抑制高分框，因此 conf 門檻與 NMS 可交換：每個 IoU 門檻只需做一次 NMS，
+    任何 conf 門檻 / max_det 的結果都是這個列表的前綴。
+    """
+    if len(dets) == 0:
+        return dets
+    return dets[batched_nms(dets[:, :4], dets[:, 4], dets[:, 5], iou_threshold)]
+
+
+def prefix_length(kept, conf_threshold, max_det):
+    return min(int(np.count_nonzero(kept[:, 4] >= conf_threshold)), max_det)
+
+
+def load_ground_truth(store):
+    """store 中每張圖片的 GT (M, 5) cls x1 y1 x2 y2 (原圖像素座標)。"""
+    label_store = load_label_store_for(store.paths)
+    gts = []
+    for i, path in enumerate(store.paths):
+        labels = label_store.get(image_stem(path)) if label_store is not None else None
+        if labels is None:
+            labels = read_yolo_labels(label_path_for(path))
+        w, h = store.sizes[i]
+        xywh = labels[:, 1:].astype(np.float64) * np.array([w, h, w, h], dtype=np.float64)
+        gts.append(np.concatenate([labels[:, :1], xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1))
+    return gts
+
+
+def sweep(store, confs=SWEEP_CONFS, ious=SWEEP_IOUS, max_dets=SWEEP_MAX_DETS):
+    """對每個 (conf, iou, max_det) 組合計算 mAP50:95 / mAP50；每個 IoU 門檻的 NMS 與 GT 配對只做一次。"""
+    gts = load_ground_truth(store)
+    gt_cls = np.concatenate([gt[:, 0] for gt in gts]) if gts else np.zeros(0)
+    results = []
+    for iou in ious:
+        kept = [nms_sorted(store.get(i), iou) for i in range(len(store))]
+        tps = [match_image(k.astype(np.float64), gt) for k, gt in zip(kept, gts)]
+        for max_det in max_dets:
+            for conf in confs:
+                lengths = [prefix_length(k, conf, max_det) for k in kept]
+                metrics = summarize(
+                    np.concatenate([tp[:n] for tp, n in zip(tps, lengths)]) if tps else np.zeros((0, len(IOU_THRESHOLDS)), bool),
+                    np.concatenate([k[:n, 4] for k, n in zip(kept, lengths)]) if kept else np.zeros(0),
+                    np.concatenate([k[:n, 5] for k, n in zip(kept, lengths)]) if kept else np.zeros(0),
+                    gt_cls,
+                )
+                results.append({"conf": conf, "iou": iou, "max_det": max_det, "detections": int(sum(lengths)),
+                                "map50_95": metrics["map50_95"], "map50": metrics["map50"]})
+    return results
+
+
+def print_sweep(results):
+    print(f"\n{'conf':>8}{'iou':>6}{'max_det':>9}{'dets':>10}{'mAP50:95':>10}{'mAP50':>8}")
+    for r in sorted(results, key=lambda r: -r["map50_95"]):
+        print(f"{r['conf']:>8g}{r['iou']:>6g}{r['max_det']:>9}{r['detections']:>10}{r['map50_95']:>10.4f}{r['map50']:>8.4f}")
+
+
+def export_csv(store, conf_threshold, iou_threshold, max_det, output_csv_file):
+    """以指定門檻從原始偵測結果產生提交 CSV (格式與 inference.py 相同)。"""
+    row_of = {path: i for i, path in enumerate(store.paths)}
+    tmp_path = output_csv_file + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("Image_ID,PredictionString\n")
+        for numeric_id, path in inference.collect_image_ids(store.paths):
+            kept = nms_sorted(store.get(row_of[path]), iou_threshold)
+            f.write(f"{numeric_id},{inference.build_prediction_string(kept[:prefix_length(kept, conf_threshold, max_det)])}\n")
+    os.replace(tmp_path, output_csv_file)
+    print(f"已以 conf={conf_threshold}, iou={iou_threshold}, max_det={max_det} 產生 {output_csv_file}")
+
+
+def check_thresholds(store, confs, ious):
+    raw = store.params
+    if min(confs) < raw["conf"] or max(ious) > raw["iou"]:
+        print(f"警告：原始偵測結果以 conf={raw['conf']}, iou={raw['iou']} 保存，"
+              f"更低的 conf 或更高的 iou 無法找回已被過濾的框。")
+
+
+def main():
+    # 原始偵測結果不存在時才推論 (刪除檔案即可重新產生)
+    missing = [(source, path) for source, path in ((VAL_SOURCE, VAL_RAW_FILE), (inference.SOURCE_DIR, TEST_RAW_FILE))
+               if not os.path.exists(path)]
+    if missing:
+        model = inference.load_model()
+        for source, path in missing:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            dump_raw_detections(model, source, path)
+
+    val_store = DetectionStore.load(VAL_RAW_FILE)
+    check_thresholds(val_store, SWEEP_CONFS, SWEEP_IOUS)
+    start = time.perf_counter()
+    results = sweep(val_store)
+    print_sweep(results)
+    print(f"\n在 {len(val_store)} 張驗證圖片上評估 {len(results)} 組設定，耗時 {time.perf_counter() - start:.2f} 秒。")
+    with open(SWEEP_RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+
+    best = max(results, key=lambda r: r["map50_95"])
+    export_csv(DetectionStore.load(TEST_RAW_FILE), best["conf"], best["iou"], best["max_det"], RESCORED_CSV_FILE)
+
+
+if __name__ == "__main__":
+    main()
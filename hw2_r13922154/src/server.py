@@ -0,0 +1,426 @@
+import os
+import json
+import time
+import queue
+import base64
+import socket
+import threading
+import http.client
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import numpy as np
+
+# --- 設定 ---
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_UNIX_SOCKET = None  # 例如 "/tmp/hw2_yolo.sock"：改以 Unix socket 提供服務 (只限本機，不佔用 TCP 埠)
+SERVER_DEVICE = "cpu"      # 常駐模型所在的裝置，例如 0
+MAX_BATCH_SIZE = 16        # 一個微批次最多的圖片 (或切片) 數
+MAX_WAIT_MS = 10.0         # 第一張圖片到達後最多等待多久湊批次 (毫秒)
+REQUEST_TIMEOUT = 600      # 客戶端等待回應的秒數
+# 客戶端可逐次覆寫的推論參數；參數不同的請求不會併入同一個批次
+REQUEST_PARAM_KEYS = ("conf", "iou", "imgsz", "augment", "max_det")
+# --- 結束設定 ---
+
+# 常駐推論服務 (HTTP，TCP 或 Unix socket)，模型、後端與集成設定取自 inference.py：
+#   GET  /health   模型、後端、預設參數與微批次統計
+#   POST /predict  {"images": [{"path": ...} | {"image": <base64 編碼的圖檔>} | {"array": <base64 BGR uint8>, "shape": [h, w, 3]}],
+#                   "params": {conf / iou / imgsz / augment / max_det，可省略}}
+#               -> {"results": [{"orig_shape": [h, w], "boxes": [[x1, y1, x2, y2, conf, cls], ...],
+#                                "prediction_string": ..., "queue_ms": ..., "batch_ms": ..., "batch_size": ...}]}
+# 同時到達的請求 (可來自多個客戶端，例如切片推論的切片批次) 由 MicroBatcher 合併成一批推論；
+# 批次內依影像尺寸分組，每張圖片的 letterbox 與單獨推論時相同，因此結果不受同批其他圖片影響。
+
+
+_STOP = object()  # close() 放入佇列的結束標記
+
+
+def _fail_futures(entries, error):
+    for entry in entries:
+        if entry is not _STOP and not entry[2].done():
+            entry[2].set_exception(error)
+
+
+class MicroBatcher:
+    """
+    動態微批次：單一背景執行緒擁有模型，從佇列取出第一張圖片後最多等待 max_wait_ms，
+    湊到 max_batch_size 張 (同一組推論參數) 就執行 run_batch(key, items)，再把結果分別交回每個 Future。
+    參數不同的圖片留到下一批，維持先到先處理。
+    """
+
+    def __init__(self, run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"images": 0, "batches": 0, "queue_s": 0.0, "batch_s": 0.0, "batch_sizes": {}}
+        self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, key, items):
+        """送出一組圖片 (同一組參數 key)，回傳對應的 Future 列表；close() 之後不再接受。"""
+        futures = []
+        now = time.perf_counter()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("micro-batcher is closed")
+            for item in items:
+                future = Future()
+                self._queue.put((key, item, future, now))
+                futures.append(future)
+        return futures
+
+    def close(self):
+        """停止接受新圖片；已送出的圖片 (含參數不同而延後的) 推論完後結束背景執行緒。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)  # 持有鎖時放入，確保之後佇列中不會再有圖片
+        self._worker.join()
+
+    def _loop(self):
+        carry = deque()  # 參數不同、留到下一批的圖片
+        batch = []
+        stopping = False  # 已收到 close()：不再等待新圖片，處理完 carry 後結束
+        try:
+            while carry or not stopping:
+                first = carry.popleft() if carry else self._queue.get()
+                if first is _STOP:
+                    stopping = True
+                    continue
+                batch = [first]
+                try:
+                    key = first[0]
+                    # 不用 deque.remove：圖片為陣列，tuple 比較會逐元素比較陣列
+                    rest = deque()
+                    for entry in carry:
+                        (batch if len(batch) < self.max_batch_size and entry[0] == key else rest).append(entry)
+                    carry = rest
+                    deadline = first[3] + self.max_wait
+                    while not stopping and len(batch) < self.max_batch_size:
+                        try:
+                            entry = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                        except queue.Empty:
+                            break
+                        if entry is _STOP:
+                            stopping = True
+                            break
+                        (batch if entry[0] == key else carry).append(entry)
+                    self._run(key, batch)
+                except Exception as e:
+                    # 任何錯誤只讓這一批失敗，背景執行緒繼續服務其他請求
+                    _fail_futures(batch, e)
+                batch = []
+        finally:
+            # 背景執行緒結束時，仍在等待的請求一律以錯誤結束，不讓呼叫端永久阻塞
+            pending = list(batch) + list(carry)
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            _fail_futures(pending, RuntimeError("micro-batcher stopped before running this image"))
+
+    def _run(self, key, batch):
+        start = time.perf_counter()
+        try:
+            outputs = self.run_batch(key, [item for _, item, _, _ in batch])
+        except Exception as e:
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        if len(outputs) != len(batch):
+            raise RuntimeError(f"run_batch returned {len(outputs)} outputs for {len(batch)} images")
+        batch_s = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats
+            stats["images"] += len(batch)
+            stats["batches"] += 1
+            stats["queue_s"] += sum(start - queued for _, _, _, queued in batch)
+            stats["batch_s"] += batch_s
+            stats["batch_sizes"][len(batch)] = stats["batch_sizes"].get(len(batch), 0) + 1
+        for (_, _, future, queued), output in zip(batch, outputs):
+            future.set_result(dict(output, queue_ms=(start - queued) * 1000, batch_ms=batch_s * 1000,
+                                   batch_size=len(batch)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, batch_sizes=dict(sorted(self._stats["batch_sizes"].items())))
+        batches, images = max(stats["batches"], 1), max(stats["images"], 1)
+        stats.update(mean_batch_size=stats["images"] / batches, mean_queue_ms=stats.pop("queue_s") * 1000 / images,
+                     mean_batch_ms=stats.pop("batch_s") * 1000 / batches)
+        return stats
+
+
+class InferenceService:
+    """常駐的模型 (YOLO 或 ensemble.EnsembleModel) 與微批次器；影像解碼與結果格式化在各請求的執行緒中平行進行。"""
+
+    def __init__(self, model, device, default_params, weights, fusion=None, backend="torch",
+                 max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.device = device
+        self.default_params = dict(default_params)
+        self.weights = list(weights)
+        self.fusion = fusion or {}
+        self.backend = backend
+        self.started = time.time()
+        self.batcher = MicroBatcher(self._run_batch, max_batch_size, max_wait_ms)
+
+    def params_key(self, params):
+        merged = dict(self.default_params)
+        merged.update({k: v for k, v in (params or {}).items() if k in REQUEST_PARAM_KEYS})
+        return json.dumps(merged, sort_keys=True)
+
+    def _run_batch(self, key, images):
+        params = json.loads(key)
+        outputs = [None] * len(images)
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        for indices in groups.values():
+            results = self.model.predict(source=[images[i] for i in indices], stream=False, verbose=False,
+                                         device=self.device, **params)
+            for i, result in zip(indices, results):
+                data = result.boxes.data
+                data = data.cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+                outputs[i] = {"data": np.asarray(data, dtype=np.float32).reshape(-1, 6),
+                              "orig_shape": [int(x) for x in result.orig_shape[:2]]}
+        return outputs
+
+    def predict(self, images, params=None):
+        futures = self.batcher.submit(self.params_key(params), images)
+        return [future.result() for future in futures]
+
+    def health(self):
+        return {"status": "ok", "weights": self.weights, "backend": self.backend, "fusion": self.fusion,
+                "device": str(self.device), "params": self.default_params,
+                "max_batch_size": self.batcher.max_batch_size, "max_wait_ms": self.batcher.max_wait * 1000,
+                "uptime_s": time.time() - self.started, "stats": self.batcher.stats()}
+
+    def close(self):
+        self.batcher.close()
+
+
+def decode_request_image(item):
+    """請求中的一張圖片 -> BGR uint8 陣列 (與 Ultralytics 讀取路徑時相同，以 OpenCV 解碼)。"""
+    import cv2
+
+    if "path" in item:
+        image = cv2.imread(item["path"])
+        if image is None:
+            raise FileNotFoundError(f"無法讀取圖片 {item['path']}")
+        return image
+    if "image" in item:
+        buffer = np.frombuffer(base64.b64decode(item["image"]), dtype=np.uint8)
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("無法解碼圖片內容")
+        return image
+    if "array" in item:
+        return np.frombuffer(base64.b64decode(item["array"]), dtype=np.uint8).reshape(item["shape"])
+    raise ValueError("每張圖片需要 'path'、'image' 或 'array'")
+
+
+def format_result(output):
+    """由 (N, 6) 結果產生與 inference.py 相同的 PredictionString。"""
+    from postprocess import build_prediction_string
+
+    data = output["data"]
+    return {"orig_shape": output["orig_shape"], "boxes": data.tolist(), "prediction_string": build_prediction_string(data),
+            "queue_ms": output["queue_ms"], "batch_ms": output["batch_ms"], "batch_size": output["batch_size"]}
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    service = None
+    verbose = False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/predict":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            images = [decode_request_image(item) for item in request["images"]]
+        except Exception as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+        try:
+            outputs = self.service.predict(images, request.get("params"))
+            results = [format_result(output) for output in outputs]
+        except Exception as e:
+            self._send_json(500, {"error": f"inference failed: {e}"})
+            return
+        self._send_json(200, {"results": results})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+class UnixThreadingHTTPServer(ThreadingHTTPServer):
+    """在 Unix domain socket 上提供相同的 HTTP 介面。"""
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)  # 上次未正常結束留下的 socket 檔
+        self.socket.bind(self.server_address)
+        self.server_name, self.server_port = "localhost", 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ("unix", 0)
+
+
+def make_server(service, host=SERVER_HOST, port=SERVER_PORT, unix_socket=SERVER_UNIX_SOCKET, verbose=False):
+    handler = type("Handler", (InferenceRequestHandler,), {"service": service, "verbose": verbose})
+    if unix_socket:
+        return UnixThreadingHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def warm_up(model, device, params):
+    """以一張空白圖片推論一次，讓第一個真正的請求不必付出初始化成本。"""
+    size = params.get("imgsz", 640)
+    model.predict(source=[np.zeros((size, size, 3), dtype=np.uint8)], stream=False, verbose=False, device=device, **params)
+
+
+def default_params():
+    """服務端的預設推論參數：inference.py 的 conf / iou / augment 與整張推論的 imgsz (客戶端可逐次覆寫)。"""
+    import inference
+
+    params = {k: v for k, v in inference.predict_kwargs().items() if k in REQUEST_PARAM_KEYS}
+    params.update(imgsz=inference.IMG_SIZE)
+    return params
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=REQUEST_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """常駐推論服務的客戶端；address 為 "http://host:port" 或 "unix:/path/to.sock"。"""
+
+    def __init__(self, address, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.address.startswith("unix:"):
+            return _UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+        url = urlparse(self.address if "://" in self.address else f"http://{self.address}")
+        return http.client.HTTPConnection(url.hostname, url.port or SERVER_PORT, timeout=self.timeout)
+
+    def _request(self, method, path, payload=None):
+        conn = self._connection()
+        try:
+            body = json.dumps(payload).encode() if payload is not None else None
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"} if body else {})
+            response = conn.getresponse()
+            data = json.loads(response.read() or b"{}")
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"推論服務錯誤 ({response.status})：{data.get('error')}")
+        return data
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def predict(self, images, params=None):
+        """images 為 /predict 的圖片項目列表 (見 image_item)；回傳每張圖片的結果 dict。"""
+        return self._request("POST", "/predict", {"images": images, "params": params or {}})["results"]
+
+
+def image_item(source):
+    """路徑送出絕對路徑 (由服務端讀檔解碼)，陣列 (例如切片) 以原始 BGR 位元組送出。"""
+    if isinstance(source, str):
+        return {"path": os.path.abspath(source)}
+    array = np.ascontiguousarray(source, dtype=np.uint8)
+    return {"array": base64.b64encode(array.tobytes()).decode("ascii"), "shape": list(array.shape)}
+
+
+class RemoteModel:
+    """
+    以常駐推論服務取代本機模型：predict() 與 YOLO.predict 的常用參數相容，
+    回傳的結果提供 boxes.data / orig_shape / speed，整張與切片推論的既有流程不需修改即可使用。
+    """
+
+    def __init__(self, address, timeout=REQUEST_TIMEOUT):
+        self.client = InferenceClient(address, timeout)
+
+    def predict(self, source, stream=False, **kwargs):
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        params = {k: v for k, v in kwargs.items() if k in REQUEST_PARAM_KEYS}
+        start = time.perf_counter()
+        outputs = self.client.predict([image_item(s) for s in sources], params) if sources else []
+        round_trip_ms = (time.perf_counter() - start) * 1000 / max(len(sources), 1)
+        results = []
+        for s, output in zip(sources, outputs):
+            data = np.asarray(output["boxes"], dtype=np.float32).reshape(-1, 6)
+            speed = {"inference": output["batch_ms"] / output["batch_size"], "round_trip": round_trip_ms}
+            results.append(SimpleNamespace(boxes=SimpleNamespace(data=data), orig_shape=tuple(output["orig_shape"]),
+                                           speed=speed, path=s if isinstance(s, str) else None,
+                                           prediction_string=output["prediction_string"]))
+        return iter(results) if stream else results
+
+
+def main():
+    # 模型、集成與後端設定取自 inference.py (ENSEMBLE_WEIGHTS_PATHS / ENSEMBLE_MODEL_WEIGHTS / BACKEND)
+    import inference
+    from backends import resolve_weights
+    from ensemble import fusion_params, load_detector
+
+    paths = inference.model_paths()
+    weights = [os.path.abspath(resolve_weights(path, inference.BACKEND)) for path in paths]
+    print(f"正在載入模型權重: {', '.join(weights)} (後端: {inference.BACKEND}, 裝置: {SERVER_DEVICE})")
+    model = load_detector(paths, SERVER_DEVICE, inference.ENSEMBLE_MODEL_WEIGHTS, inference.ENSEMBLE_WBF_IOU,
+                          backend=inference.BACKEND)
+    params = default_params()
+    warm_up(model, SERVER_DEVICE, params)
+    fusion = fusion_params(paths, inference.ENSEMBLE_MODEL_WEIGHTS, inference.ENSEMBLE_WBF_IOU)
+    service = InferenceService(model, SERVER_DEVICE, params, weights, fusion, inference.BACKEND, MAX_BATCH_SIZE, MAX_WAIT_MS)
+    server = make_server(service, SERVER_HOST, SERVER_PORT, SERVER_UNIX_SOCKET)
+    address = f"unix:{SERVER_UNIX_SOCKET}" if SERVER_UNIX_SOCKET else f"http://{SERVER_HOST}:{server.server_port}"
+    print(f"推論服務已啟動：{address} (微批次上限 {service.batcher.max_batch_size}，最長等待 {MAX_WAIT_MS} ms)。按 Ctrl+C 結束。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if SERVER_UNIX_SOCKET and os.path.exists(SERVER_UNIX_SOCKET):
+            os.remove(SERVER_UNIX_SOCKET)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+
+from box_ops import batched_nms, weighted_box_fusion
+from postprocess import boxes_to_numpy
+from profiling import NULL_PROFILER
+
+# --- 切片推論設定 ---
+TILE_SIZE = 960          # 每個切片的邊長 (像素)，同時作為切片推論的 imgsz
+TILE_OVERLAP = 0.2       # 相鄰切片的重疊比例
+TILE_BATCH_SIZE = 16     # 每次送進模型的切片數 (可跨多張圖片)
+MERGE_METHOD = "nms"     # "nms" (類別感知 NMS) 或 "wbf" (加權框融合)
+MERGE_IOU = 0.5          # 合併時的 IoU 門檻
+INCLUDE_FULL_FRAME = True  # 另以整張縮圖推論一次，補回被切片切斷的大物件
+FULL_FRAME_IMG_SIZE = 1280
+# --- 結束設定 ---
+
+
+def compute_tiles(img_w, img_h, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    計算覆蓋整張圖片的切片座標 (x0, y0, x1, y1)。
+    最後一列/行切片對齊影像邊界，圖片小於切片時只有一個切片。
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = max(1, int(tile_size * (1 - overlap)))
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, img_w), min(y0 + tile_size, img_h))
+        for y0 in starts(img_h)
+        for x0 in starts(img_w)
+    ]
+
+
+def merge_detections(parts, merge=MERGE_METHOD, iou_threshold=MERGE_IOU):
+    """合併同一張圖片所有切片 (已映射回原圖座標) 的 (N, 6) 偵測結果。"""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.zeros((0, 6), dtype=np.float32)
+    dets = np.concatenate(parts, axis=0).astype(np.float64)
+    if merge == "wbf":
+        return weighted_box_fusion(dets[:, :4], dets[:, 4], dets[:, 5], iou_threshold).astype(np.float32)
+    keep = batched_nms(dets[:, :4], dets[:, 4], dets[:, 5], iou_threshold)
+    return dets[keep].astype(np.float32)
+
+
+def iter_sliced_predictions(model, items, predict_kwargs, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                            tile_batch_size=TILE_BATCH_SIZE, merge=MERGE_METHOD, merge_iou=MERGE_IOU,
+                            include_full_frame=INCLUDE_FULL_FRAME, full_frame_imgsz=FULL_FRAME_IMG_SIZE,
+                            profiler=NULL_PROFILER):
+    """
+    切片推論：將每張圖片切成重疊的切片，跨圖片湊滿 tile_batch_size 後一起推論，
+    把框位移回整張圖片座標後合併。
+    items 為 (key, image_path) 的序列；依輸入順序產出 (key, (N, 6) x1 y1 x2 y2 conf cls)。
+    predict_kwargs 為傳給 model.predict 的其他參數 (conf, iou, device, augment, ...)。
+    profiler 記錄解碼、整張縮圖推論、每批切片推論與合併的耗時。
+    """
+    pending = []   # 尚未推論的切片: (key, x0, y0, crop)
+    parts = {}     # key -> 已映射回原圖的偵測結果列表
+    remaining = {} # key -> 尚未推論的切片數
+    order = []     # 依輸入順序等待輸出的 key
+
+    def run_batch(batch):
+        with profiler.stage("predict_tiles"):
+            results = list(model.predict(
+                source=[crop for _, _, _, crop in batch], imgsz=tile_size, batch=len(batch),
+                stream=True, verbose=False, **predict_kwargs
+            ))
+        for (key, x0, y0, _), result in zip(batch, results):
+            profiler.record_ultralytics_speed(result)
+            data = boxes_to_numpy(result.boxes)
+            if len(data):
+                data = data[:, :6].copy()
+                data[:, [0, 2]] += x0
+                data[:, [1, 3]] += y0
+                parts[key].append(data)
+            remaining[key] -= 1
+
+    def flush_finished():
+        while order and remaining[order[0]] == 0:
+            key = order.pop(0)
+            remaining.pop(key)
+            with profiler.stage("merge"):
+                merged = merge_detections(parts.pop(key), merge, merge_iou)
+            yield key, merged
+
+    for key, image_path in items:
+        with profiler.stage("decode"):
+            image = cv2.imread(image_path)
+        parts[key] = []
+        order.append(key)
+        if image is None:
+            print(f"錯誤：無法讀取圖片 {image_path}。")
+            remaining[key] = 0
+            yield from flush_finished()
+            continue
+
+        img_h, img_w = image.shape[:2]
+        if include_full_frame:
+            with profiler.stage("predict_full"):
+                full = next(iter(model.predict(source=image, imgsz=full_frame_imgsz, stream=True,
+                                               verbose=False, **predict_kwargs)))
+            data = boxes_to_numpy(full.boxes)
+            if len(data):
+                parts[key].append(data[:, :6])
+
+        tiles = compute_tiles(img_w, img_h, tile_size, overlap)
+        remaining[key] = len(tiles)
+        for x0, y0, x1, y1 in tiles:
+            pending.append((key, x0, y0, image[y0:y1, x0:x1]))
+            if len(pending) >= tile_batch_size:
+                run_batch(pending[:tile_batch_size])
+                pending = pending[tile_batch_size:]
+        yield from flush_finished()
+
+    if pending:
+        run_batch(pending)
+    yield from flush_finished()
@@ -2,6 +2,9 @@ import os
 import random
 import shutil
 
+from label_index import build_label_index, counts_for, iterative_stratified_split, summarize_split
+from label_store import LabelStore, label_store_path
+
 # --- 設定 ---
 # 1. 原始資料夾路徑
 SOURCE_IMAGE_DIR = "../data/CVPDL_hw2/CVPDL_hw2/train"
@@ -16,6 +19,19 @@ VAL_SPLIT_RATIO = 0.2
 
 # 支援的圖片副檔名
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+# 4. 分割結果的實體化方式：
+#   "copy"     - 複製檔案 (原始行為)
+#   "hardlink" - 建立硬連結，不佔額外空間；跨檔案系統時退回複製
+#   "symlink"  - 建立符號連結；不支援時退回複製
+#   "manifest" - 不複製任何檔案，只寫出 YOLO 可直接讀取的 train.txt / val.txt 清單
+SPLIT_MODE = "copy"
+
+# 5. 分割策略與隨機種子
+#   "stratified" - 依每張圖片的類別框數做迭代分層分割，確保稀有類別 (hov, person) 在驗證集中有相同比例
+#   "random"     - 以固定種子隨機打亂
+SPLIT_STRATEGY = "stratified"
+RANDOM_SEED = 42
 # --- 結束設定 ---
 
 
@@ -41,9 +57,114 @@ def create_dirs():
     print(f"- {TRAIN_LABEL_PATH}")
     print(f"- {VAL_LABEL_PATH}")
 
-def split_data():
+def place_file(src, dst, mode=SPLIT_MODE):
+    """
+    依 mode 將 src 放到 dst (複製 / 硬連結 / 符號連結)，連結失敗時退回複製
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # 例如跨檔案系統 (EXDEV)，退回複製
+    elif mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    shutil.copy(src, dst)
+
+
+def link_directory(src_dir, link_path):
+    """
+    建立指向 src_dir 的目錄符號連結 (已存在的舊連結會被取代)
+    """
+    if os.path.islink(link_path):
+        os.remove(link_path)
+    elif os.path.exists(link_path):
+        raise FileExistsError(f"{link_path} 已存在且不是符號連結")
+    os.symlink(os.path.abspath(src_dir), link_path, target_is_directory=True)
+
+
+def load_source_store():
+    """SOURCE_LABEL_DIR 若有打包檔 (label_store.py)，載入後用於標籤查詢與分割；否則回傳 None。"""
+    store_path = label_store_path(SOURCE_LABEL_DIR)
+    if not os.path.exists(store_path):
+        return None
+    print(f"使用打包標籤檔 {store_path}")
+    return LabelStore.load(store_path)
+
+
+def has_label(label_filename, store=None):
+    """優先查打包檔 (不需逐檔 stat)，否則檢查 .txt 是否存在。"""
+    if store is not None and os.path.splitext(label_filename)[0] in store:
+        return True
+    return os.path.exists(os.path.join(SOURCE_LABEL_DIR, label_filename))
+
+
+def write_subset_store(store, file_list, label_dir):
+    """寫出該子集的打包標籤 (e.g., labels/train.labels.npz)，供訓練時直接載入；沒有來源打包檔時移除舊檔。"""
+    store_path = label_store_path(label_dir)
+    if store is None:
+        if os.path.exists(store_path):
+            os.remove(store_path)
+        return
+    subset = store.subset([os.path.splitext(f)[0] for f in file_list])
+    subset.save(store_path)
+    print(f"已寫出 {len(subset)} 張圖片的打包標籤至 {store_path}")
+
+
+def write_manifest(train_files, val_files, store=None):
     """
-    執行資料分割與檔案複製
+    manifest 模式：不複製任何圖片或標籤。
+    DEST_DATASET_DIR/images/all 與 labels/all 為指向原始資料夾的符號連結，
+    train.txt / val.txt 列出 images/all 下的圖片路徑；YOLO 會把路徑中的 /images/ 換成 /labels/ 找到標籤。
+    """
+    image_link = os.path.join(DEST_DATASET_DIR, "images", "all")
+    link_directory(SOURCE_IMAGE_DIR, image_link)
+    link_directory(SOURCE_LABEL_DIR, os.path.join(DEST_DATASET_DIR, "labels", "all"))
+
+    for subset, file_list in (("train", train_files), ("val", val_files)):
+        manifest_path = os.path.join(DEST_DATASET_DIR, f"{subset}.txt")
+        count = 0
+        with open(manifest_path, "w") as f:
+            for image_filename in file_list:
+                label_filename = os.path.splitext(image_filename)[0] + ".txt"
+                if not has_label(label_filename, store):
+                    print(f"警告：找不到對應的標籤檔 {label_filename}，跳過 {image_filename}")
+                    continue
+                f.write(os.path.abspath(os.path.join(image_link, image_filename)) + "\n")
+                count += 1
+        print(f"已寫出 {count} 筆至 {manifest_path}")
+
+
+def split_file_list(image_files, strategy=SPLIT_STRATEGY, seed=RANDOM_SEED):
+    """
+    將圖片檔名分為 (train_files, val_files)。
+    stratified 策略使用快取的類別直方圖索引 (label_index.py)，結果可由 seed 重現。
+    """
+    image_files = sorted(image_files)
+    if strategy == "random":
+        random.Random(seed).shuffle(image_files)
+        val_count = int(len(image_files) * VAL_SPLIT_RATIO)
+        return image_files[val_count:], image_files[:val_count]
+
+    index = build_label_index(SOURCE_LABEL_DIR)
+    counts = counts_for(index, [os.path.splitext(f)[0] for f in image_files])
+    assignment = iterative_stratified_split(counts, VAL_SPLIT_RATIO, seed)
+    summarize_split(counts, assignment)
+
+    train_files = [f for f, a in zip(image_files, assignment) if a == 0]
+    val_files = [f for f, a in zip(image_files, assignment) if a == 1]
+    return train_files, val_files
+
+
+def split_data(mode=SPLIT_MODE, strategy=SPLIT_STRATEGY, seed=RANDOM_SEED):
+    """
+    執行資料分割與檔案複製 (或連結 / 只寫出清單，見 SPLIT_MODE)
     """
     print(f"\n正在從 {SOURCE_IMAGE_DIR} 讀取圖片...")
     
@@ -57,22 +178,22 @@ def split_data():
         print(f"錯誤：在 {SOURCE_IMAGE_DIR} 中找不到任何圖片檔案。")
         return
         
-    # 隨機打亂
-    random.shuffle(image_files)
-    
-    # 計算分割點
+    # 分割檔案列表 (分層或隨機，皆使用固定種子)
     total_files = len(image_files)
-    val_count = int(total_files * VAL_SPLIT_RATIO)
-    train_count = total_files - val_count
-    
-    # 分割檔案列表
-    val_files = image_files[:val_count]
-    train_files = image_files[val_count:]
+    print(f"分割策略: {strategy} (seed={seed})")
+    train_files, val_files = split_file_list(image_files, strategy, seed)
     
     print(f"總檔案數: {total_files}")
     print(f"訓練集大小: {len(train_files)} ({(1-VAL_SPLIT_RATIO)*100:.0f}%)")
     print(f"驗證集大小: {len(val_files)} ({VAL_SPLIT_RATIO*100:.0f}%)")
 
+    store = load_source_store()
+
+    if mode == "manifest":
+        write_manifest(train_files, val_files, store)
+        print("\n清單分割完成！請將 hw2_dataset.yaml 的 train/val 指向 train.txt / val.txt。")
+        return
+
     # 定義一個輔助函式來複製檔案
     def copy_file_pairs(file_list, dest_image_dir, dest_label_dir):
         copied_count = 0
@@ -88,30 +209,36 @@ def split_data():
             dest_image = os.path.join(dest_image_dir, image_filename)
             dest_label = os.path.join(dest_label_dir, label_filename)
             
-            # 檢查圖片和標籤是否都存在
-            if os.path.exists(src_image) and os.path.exists(src_label):
+            # 檢查圖片和標籤 (打包檔或 .txt) 是否都存在
+            label_found = has_label(label_filename, store)
+            if os.path.exists(src_image) and label_found:
                 try:
-                    # !! 使用 shutil.copy() 而不是 shutil.move() !!
-                    shutil.copy(src_image, dest_image)
-                    shutil.copy(src_label, dest_label)
+                    # !! 複製或連結，而不是 shutil.move() !!
+                    place_file(src_image, dest_image, mode)
+                    # 只有打包標籤時不放置 .txt
+                    if os.path.exists(src_label):
+                        place_file(src_label, dest_label, mode)
                     copied_count += 1
                 except Exception as e:
                     print(f"錯誤：複製 {image_filename} 時發生問題: {e}")
             else:
-                if not os.path.exists(src_label):
+                if not label_found:
                     print(f"警告：找不到對應的標籤檔 {label_filename}，跳過 {image_filename}")
                 if not os.path.exists(src_image):
                      print(f"警告：找不到圖片檔 {src_image} (這不應該發生)")
         return copied_count
 
     # 執行複製
-    print("\n正在複製訓練集檔案...")
+    print(f"\n正在處理訓練集檔案 (模式: {mode})...")
     train_copied = copy_file_pairs(train_files, TRAIN_IMAGE_PATH, TRAIN_LABEL_PATH)
     print(f"成功複製 {train_copied} 對訓練檔案。")
 
-    print("\n正在複製驗證集檔案...")
+    print(f"\n正在處理驗證集檔案 (模式: {mode})...")
     val_copied = copy_file_pairs(val_files, VAL_IMAGE_PATH, VAL_LABEL_PATH)
     print(f"成功複製 {val_copied} 對驗證檔案。")
+
+    write_subset_store(store, train_files, TRAIN_LABEL_PATH)
+    write_subset_store(store, val_files, VAL_LABEL_PATH)
     
     print("\n資料分割完成！")
     print(f"原始資料夾 {SOURCE_IMAGE_DIR} 和 {SOURCE_LABEL_DIR} 中的檔案已完整保留。")
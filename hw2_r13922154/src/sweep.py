@@ -0,0 +1,284 @@
+import os
+import json
+import math
+import time
+import fcntl
+import random
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+# --- 設定 ---
+# 預設搜尋空間：list = 從中選一個；dict 的 type 為 uniform / loguniform / int (low, high)
+DEFAULT_SEARCH_SPACE = {
+    "lr0": {"type": "loguniform", "low": 1e-3, "high": 1e-2},
+    "cls": {"type": "uniform", "low": 0.5, "high": 2.0},
+    "mixup": [0.0, 0.1, 0.2],
+    "mosaic": [0.5, 1.0],
+    "imgsz": [960, 1280, 1440],
+}
+NUM_TRIALS = 16
+MIN_EPOCHS = 5          # 第一個 rung：每個 trial 至少訓練的 epoch 數
+MAX_EPOCHS = 90         # 單一 trial 的完整訓練長度 (取代 TRAIN_ARGS["epochs"])
+REDUCTION_FACTOR = 3    # ASHA 的 eta：每個 rung 只有前 1/eta 的 trial 能繼續
+METRIC = "metrics/mAP50-95(B)"
+RANDOM_SEED = 0
+SWEEP_PROJECT = "my_yolo_experiments/sweep"  # 各 trial 的輸出與 sweep_state.json
+SWEEP_DEVICES = ["0"]   # 每個元素一個工作行程，e.g., ["0", "1"] 或 ["cpu"] * 4
+SEARCH_SPACE_FILE = None  # YAML/JSON 搜尋空間檔；None 時使用 DEFAULT_SEARCH_SPACE
+# --- 結束設定 ---
+
+
+# ---------- 搜尋空間 ----------
+
+def sample_params(space, rng):
+    params = {}
+    for key, spec in space.items():
+        if isinstance(spec, list):
+            params[key] = rng.choice(spec)
+        elif spec["type"] == "uniform":
+            params[key] = rng.uniform(spec["low"], spec["high"])
+        elif spec["type"] == "loguniform":
+            params[key] = math.exp(rng.uniform(math.log(spec["low"]), math.log(spec["high"])))
+        elif spec["type"] == "int":
+            params[key] = rng.randint(spec["low"], spec["high"])
+        else:
+            raise ValueError(f"未知的搜尋空間類型 {key}: {spec['type']}")
+    return params
+
+
+def load_search_space(path=SEARCH_SPACE_FILE):
+    if path is None:
+        return DEFAULT_SEARCH_SPACE
+    with open(path, "r") as f:
+        return yaml.safe_load(f)  # JSON 也是合法的 YAML
+
+
+# ---------- ASHA ----------
+
+def rung_milestones(min_epochs, max_epochs, eta):
+    """ASHA 的 rung：min_epochs * eta^k (小於 max_epochs)，e.g., 5, 15, 45。"""
+    milestones = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        milestones.append(epochs)
+        epochs *= eta
+    return milestones
+
+
+def asha_should_continue(rung_metrics, metric, eta):
+    """
+    非同步 successive halving (Li et al., 2020) 的停止規則：
+    trial 到達某個 rung 時，若其指標不在該 rung 已回報結果的前 1/eta，即提前終止。
+    回報數少於 eta 時資訊不足，一律繼續。
+    """
+    if len(rung_metrics) < eta:
+        return True
+    k = max(1, len(rung_metrics) // eta)
+    cutoff = sorted(rung_metrics, reverse=True)[k - 1]
+    return metric >= cutoff
+
+
+# ---------- 狀態檔 (跨行程共用，亦用於中斷後續跑) ----------
+
+@contextmanager
+def locked_state(state_path):
+    """以檔案鎖讀取並寫回 sweep 狀態 (JSON)；區塊內對 state 的修改會在離開時存檔。"""
+    with open(state_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            yield state
+            tmp_path = state_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, state_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def init_state(state_path, space, num_trials, min_epochs, max_epochs, eta, metric, seed):
+    """
+    建立或續用 sweep 狀態。已存在時沿用其設定；中斷時仍在執行的 trial 改回 pending (之後由 last.pt 續訓)。
+    num_trials 大於現有 trial 數時補上新的 trial (每個 trial 的參數由 seed 與編號決定，可重現)。
+    """
+    if not os.path.exists(state_path):
+        state = {
+            "config": {"space": space, "min_epochs": min_epochs, "max_epochs": max_epochs,
+                       "eta": eta, "metric": metric, "seed": seed},
+            "trials": [],
+        }
+        with open(state_path, "w") as f:
+            json.dump(state, f, indent=2)
+
+    with locked_state(state_path) as state:
+        config = state["config"]
+        for trial in state["trials"]:
+            if trial["status"] == "running":
+                trial["status"] = "pending"
+        for trial_id in range(len(state["trials"]), num_trials):
+            rng = random.Random(f"{config['seed']}-{trial_id}")
+            state["trials"].append({
+                "id": trial_id,
+                "name": f"trial_{trial_id:03d}",
+                "params": sample_params(config["space"], rng),
+                "status": "pending",
+                "rungs": {},
+                "best": None,
+                "epochs_done": 0,
+                "save_dir": None,
+            })
+        return config
+
+
+def claim_next_trial(state_path, device):
+    with locked_state(state_path) as state:
+        for trial in state["trials"]:
+            if trial["status"] == "pending":
+                trial["status"] = "running"
+                trial["device"] = device
+                return dict(trial)
+    return None
+
+
+def report_epoch(state_path, trial_id, epoch, metric_value):
+    """記錄一個 epoch 的驗證指標；到達 rung 時依 ASHA 規則決定是否繼續。回傳 False 表示應停止。"""
+    with locked_state(state_path) as state:
+        config = state["config"]
+        trial = state["trials"][trial_id]
+        trial["epochs_done"] = epoch
+        trial["best"] = metric_value if trial["best"] is None else max(trial["best"], metric_value)
+        if epoch not in rung_milestones(config["min_epochs"], config["max_epochs"], config["eta"]):
+            return True
+        trial["rungs"][str(epoch)] = metric_value
+        rung_metrics = [t["rungs"][str(epoch)] for t in state["trials"] if str(epoch) in t["rungs"]]
+        keep = asha_should_continue(rung_metrics, metric_value, config["eta"])
+        if not keep:
+            trial["status"] = "stopped"
+        return keep
+
+
+def finish_trial(state_path, trial_id, status=None, save_dir=None):
+    with locked_state(state_path) as state:
+        trial = state["trials"][trial_id]
+        if status is not None:
+            trial["status"] = status
+        elif trial["status"] == "running":
+            trial["status"] = "completed"
+        if save_dir is not None:
+            trial["save_dir"] = save_dir
+
+
+# ---------- 訓練 ----------
+
+def run_trial(trial, config, state_path, data_yaml, project, device):
+    """
+    以 train.py 的 TRAIN_ARGS 加上 trial 的參數訓練一個 trial。
+    每個 epoch 結束時回報驗證指標；被 ASHA 淘汰時設定 trainer.stop，Ultralytics 會在該 epoch 後結束。
+    有 last.pt 時 (中斷後續跑) 以 resume=True 接續。
+    """
+    from ultralytics import YOLO
+    from train import MODEL_CONFIG, TRAIN_ARGS, USE_MEMMAP_CACHE
+    from dataset_cache import MemmapDetectionTrainer, PackedLabelDetectionTrainer
+
+    def on_fit_epoch_end(trainer):
+        value = float(trainer.metrics.get(config["metric"], 0.0))
+        if not report_epoch(state_path, trial["id"], trainer.epoch + 1, value):
+            print(f"[{trial['name']}] ASHA 於第 {trainer.epoch + 1} 個 epoch 終止 ({config['metric']}={value:.4f})")
+            trainer.stop = True
+
+    save_dir = os.path.join(project, trial["name"])
+    last_pt = os.path.join(save_dir, "weights", "last.pt")
+    trainer_cls = MemmapDetectionTrainer if USE_MEMMAP_CACHE else PackedLabelDetectionTrainer
+
+    if os.path.exists(last_pt):
+        print(f"[{trial['name']}] 由 {last_pt} 續訓")
+        model = YOLO(last_pt)
+        model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+        model.train(resume=True, trainer=trainer_cls)
+    else:
+        model = YOLO(MODEL_CONFIG)
+        model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+        train_args = {**TRAIN_ARGS, **trial["params"], "epochs": config["max_epochs"], "device": device}
+        model.train(
+            data=data_yaml,
+            trainer=trainer_cls,
+            project=project,
+            name=trial["name"],
+            exist_ok=True,
+            **train_args
+        )
+    return save_dir
+
+
+def worker_loop(state_path, device, data_yaml, project):
+    """單一裝置上的工作行程：反覆領取 pending 的 trial 並訓練，直到沒有剩餘的 trial。"""
+    with open(state_path, "r") as f:
+        config = json.load(f)["config"]
+    done = 0
+    while True:
+        trial = claim_next_trial(state_path, device)
+        if trial is None:
+            return done
+        print(f"[{trial['name']}] 於裝置 {device} 開始：{trial['params']}")
+        try:
+            save_dir = run_trial(trial, config, state_path, data_yaml, project, device)
+            finish_trial(state_path, trial["id"], save_dir=save_dir)
+        except Exception as e:
+            print(f"[{trial['name']}] 失敗：{e}")
+            finish_trial(state_path, trial["id"], status="failed")
+        done += 1
+
+
+def print_leaderboard(state_path, top=10):
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    metric = state["config"]["metric"]
+    trials = sorted(state["trials"], key=lambda t: -1 if t["best"] is None else t["best"], reverse=True)
+    print(f"\n--- Sweep 排行 ({metric}) ---")
+    for t in trials[:top]:
+        best = "n/a" if t["best"] is None else f"{t['best']:.4f}"
+        print(f"{t['name']}  {t['status']:<10} epochs={t['epochs_done']:<4} best={best}  {t['params']}")
+    return trials[0] if trials else None
+
+
+def run_sweep(project=SWEEP_PROJECT, devices=SWEEP_DEVICES, space=None, num_trials=NUM_TRIALS, min_epochs=MIN_EPOCHS,
+              max_epochs=MAX_EPOCHS, eta=REDUCTION_FACTOR, metric=METRIC, seed=RANDOM_SEED):
+    """在 devices 上 (每個元素一個工作行程) 執行 ASHA sweep；狀態存於 project/sweep_state.json，可中斷後續跑。"""
+    from train import DATA_YAML, DATASET_DIR, USE_REPEAT_FACTOR_SAMPLING
+    from repeat_factor_sampler import build_rfs_data_yaml
+
+    project = os.path.abspath(project)
+    os.makedirs(project, exist_ok=True)
+    state_path = os.path.join(project, "sweep_state.json")
+    config = init_state(state_path, space or load_search_space(), num_trials, min_epochs, max_epochs, eta, metric, seed)
+    print(f"Sweep 狀態檔：{state_path}")
+    print(f"Rungs (epochs)：{rung_milestones(config['min_epochs'], config['max_epochs'], config['eta'])}，"
+          f"最多 {config['max_epochs']} epochs，eta={config['eta']}，工作行程：{devices}")
+
+    # 與 train.py 相同的資料設定 (repeat factor sampling 清單只在主行程產生一次)
+    data_yaml = build_rfs_data_yaml(DATA_YAML, DATASET_DIR) if USE_REPEAT_FACTOR_SAMPLING else DATA_YAML
+    data_yaml = os.path.abspath(data_yaml)
+
+    start = time.time()
+    # spawn：每個工作行程各自初始化 CUDA
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(devices), mp_context=context) as pool:
+        futures = [pool.submit(worker_loop, state_path, device, data_yaml, project) for device in devices]
+        finished = sum(f.result() for f in futures)
+    print(f"\nSweep 完成 {finished} 個 trial，耗時 {(time.time() - start) / 3600:.2f} 小時。")
+
+    best = print_leaderboard(state_path)
+    if best is not None and best["best"] is not None:
+        best_path = os.path.join(project, "best_params.json")
+        with open(best_path, "w") as f:
+            json.dump(best["params"], f, indent=2)
+        print(f"最佳參數已寫入 {best_path}")
+    return best
+
+
+if __name__ == "__main__":
+    run_sweep()
@@ -1,10 +1,58 @@
 from ultralytics import YOLO
 
+from dataset_cache import MemmapDetectionTrainer, PackedLabelDetectionTrainer
+from repeat_factor_sampler import build_rfs_data_yaml
+
+# --- 資料設定 ---
+DATA_YAML = 'hw2_dataset.yaml'
+DATASET_DIR = "../data/datasets"  # 與 split_dataset.py 的 DEST_DATASET_DIR 相同
+
+# 長尾處理：以 LVIS repeat factor sampling 提高稀有類別 (hov, person) 每 epoch 的出現次數
+USE_REPEAT_FACTOR_SAMPLING = False  # 預設使用原始 train 清單；設為 True 改用重複取樣後的 train_rfs.txt
+
+# 預先縮放到 imgsz 的 memmap 影像快取 (dataset_cache.py)：訓練時不再解碼 PNG，第一次使用時自動建立
+# 注意：1440px 每張約 6 MB，請確認磁碟空間
+USE_MEMMAP_CACHE = False
+# ----------------
+
+# --- 模型與訓練參數 (sweep.py 會以搜尋空間覆寫其中的鍵) ---
+MODEL_CONFIG = 'yolo11x.yaml'
+
+TRAIN_ARGS = dict(
+    epochs=300,                
+    imgsz=1440,                 
+    batch=4,
+    device=0,  # 使用 GPU，請確認你的 GPU ID
+    lr0=0.006,
+    
+    # --- 2. 啟用 Focal Loss 的新方法 ---
+    # 移除舊的 FocalLossTrainer，直接設定 fl_gamma 參數
+    # fl_gamma > 0.0 即會啟用 Focal Loss。常見值為 1.5 或 2.0
+    dfl=1.5,
+    # ------------------------------------
+    
+    # data augmentation
+    
+    # hsv_h=0.015,
+    # hsv_s=0.7,
+    # hsv_v=0.4,
+    # mosaic=1.0,
+    mixup=0.1,
+    
+    cls=1.5, # 分類損失的權重
+    weight_decay=0.001,
+    cos_lr=True,
+    
+    # 從頭開始訓練，不載入預訓練權重
+    pretrained=False, 
+)
+# ----------------
+
 def main():
     # --- 1. 更改模型：從 YOLO('yolov8m.yaml') 改為 YOLOv10('yolov10m.yaml') ---
     print("正在從 yolov10x.yaml 載入模型架構 (從頭開始訓練)...")
     # 你可以根據需求選擇 yolov10n, yolov10s, yolov10m, yolov10b, yolov10l, yolov10x
-    model = YOLO('yolo11x.yaml')
+    model = YOLO(MODEL_CONFIG)
 
     # --- 自訂你的輸出路徑 ---
     OUTPUT_PROJECT_FOLDER = "my_yolo_experiments"
@@ -14,33 +62,17 @@ def main():
     # --- Early Stopping 設定 ---
     PATIENCE_EPOCHS = 30 
     
+    data_yaml = DATA_YAML
+    if USE_REPEAT_FACTOR_SAMPLING:
+        data_yaml = build_rfs_data_yaml(DATA_YAML, DATASET_DIR)
+        print(f"使用 repeat factor sampling 資料設定檔：{data_yaml}")
+    
     print(f"開始訓練... 實驗將儲存在：{OUTPUT_PROJECT_FOLDER}/{EXPERIMENT_NAME}")
     
     results = model.train(
-        data='hw2_dataset.yaml',  
-        epochs=300,                
-        imgsz=1440,                 
-        batch=4,
-        device=0,  # 使用 GPU，請確認你的 GPU ID
-        lr0=0.006,
-        
-        # --- 2. 啟用 Focal Loss 的新方法 ---
-        # 移除舊的 FocalLossTrainer，直接設定 fl_gamma 參數
-        # fl_gamma > 0.0 即會啟用 Focal Loss。常見值為 1.5 或 2.0
-        dfl=1.5,
-        # ------------------------------------
-        
-        # data augmentation
-        
-        # hsv_h=0.015,
-        # hsv_s=0.7,
-        # hsv_v=0.4,
-        # mosaic=1.0,
-        mixup=0.1,
-        
-        cls=1.5, # 分類損失的權重
-        weight_decay=0.001,
-        cos_lr=True,
+        data=data_yaml,  
+        # 標籤優先讀取打包檔 (label_store.py)；memmap 快取另外跳過每個 epoch 的 PNG 解碼
+        trainer=MemmapDetectionTrainer if USE_MEMMAP_CACHE else PackedLabelDetectionTrainer,
         
         # --- Early Stopping 設定 ---
         patience=PATIENCE_EPOCHS,
@@ -50,8 +82,7 @@ def main():
         name=EXPERIMENT_NAME,
         # -------------------------------
         
-        # 從頭開始訓練，不載入預訓練權重
-        pretrained=False, 
+        **TRAIN_ARGS
     )
     print("訓練完成！")
     
@@ -0,0 +1,111 @@
+import time
+from collections import Counter
+
+import numpy as np
+
+# --- 設定 ---
+# 第一輪不做 TTA；符合任一條件的圖片視為「不確定」，以 TTA 重新推論並取代第一輪的結果
+MID_CONF_RANGE = (0.3, 0.6)   # 介於此範圍的框視為中等信心 (下限與 inference.CONF_THRESHOLD 相同)
+MID_CONF_SHARE = 0.3          # 信心值 >= 下限的框中，中等信心框的比例超過此值即升級
+RARE_CLASSES = (1, 2)         # hov、person；出現信心值 >= RARE_MIN_CONF 的稀有類別框即升級
+RARE_MIN_CONF = 0.3
+CROWD_MIN_BOXES = 80          # 信心值 >= MID_CONF_RANGE 下限的框數達到此值 (擁擠的路口) 即升級
+# --- 結束設定 ---
+
+
+def cascade_params():
+    """影響升級判斷的參數 (併入結果快取的鍵)。"""
+    return dict(mid_conf_range=list(MID_CONF_RANGE), mid_conf_share=MID_CONF_SHARE, rare_classes=list(RARE_CLASSES),
+                rare_min_conf=RARE_MIN_CONF, crowd_min_boxes=CROWD_MIN_BOXES)
+
+
+def uncertainty_reasons(data):
+    """
+    由第一輪 (無 TTA) 的 (N, 6) 偵測結果判斷是否需要 TTA，回傳原因列表 (空列表表示確定)：
+    empty (沒有信心值達下限的框)、mid_conf (中等信心框比例過高)、rare_class、crowd。
+    """
+    conf, cls = data[:, 4], data[:, 5]
+    low, high = MID_CONF_RANGE
+    confident = conf >= low
+    reasons = []
+    if not confident.any():
+        reasons.append("empty")
+    elif np.count_nonzero(conf[confident] < high) / np.count_nonzero(confident) > MID_CONF_SHARE:
+        reasons.append("mid_conf")
+    if RARE_CLASSES and np.isin(cls[conf >= RARE_MIN_CONF], RARE_CLASSES).any():
+        reasons.append("rare_class")
+    if np.count_nonzero(confident) >= CROWD_MIN_BOXES:
+        reasons.append("crowd")
+    return reasons
+
+
+class CascadeStats:
+    """記錄兩輪推論的圖片數與耗時，估計相較於全部圖片都做 TTA 節省的時間。"""
+
+    def __init__(self):
+        self.images = 0
+        self.escalated = 0
+        self.reasons = Counter()
+        self.base_s = 0.0
+        self.tta_s = 0.0
+
+    def report(self):
+        report = {"images": self.images, "escalated": self.escalated, "reasons": dict(self.reasons),
+                  "base_s": self.base_s, "tta_s": self.tta_s, "full_tta_s": None, "saved_s": None}
+        if self.escalated:
+            # 升級圖片的 TTA 平均耗時即為「每張都做 TTA」時每張圖片的成本
+            report["full_tta_s"] = self.tta_s / self.escalated * self.images
+            report["saved_s"] = report["full_tta_s"] - self.base_s - self.tta_s
+        return report
+
+    def print_report(self):
+        report = self.report()
+        share = report["escalated"] / max(report["images"], 1)
+        reasons = "、".join(f"{k}: {v}" for k, v in sorted(report["reasons"].items())) or "-"
+        print("\n--- 選擇性 TTA ---")
+        print(f"升級為 TTA：{report['escalated']}/{report['images']} 張圖片 ({share:.1%}；{reasons})")
+        print(f"無 TTA 推論：{report['base_s']:.2f} 秒，TTA 推論：{report['tta_s']:.2f} 秒")
+        if report["saved_s"] is not None:
+            print(f"估計全部圖片都做 TTA：{report['full_tta_s']:.2f} 秒，"
+                  f"節省：{report['saved_s']:.2f} 秒 ({report['saved_s'] / report['full_tta_s']:.1%})")
+
+
+def _timed(iterator):
+    """逐項產出 (取得該項花費的秒數, 項目)；只計算產生器內部的推論時間，不含呼叫端的後處理。"""
+    iterator = iter(iterator)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield time.perf_counter() - start, item
+
+
+def iter_cascade_predictions(run, items, params, stats=None):
+    """
+    信心值門控的選擇性 TTA：items 為 (key, image_path)，run(items, params) 產出 (key, (N, 6) 偵測結果)
+    (即 inference.iter_full_frame_predictions 或 sliced_inference.iter_sliced_predictions)。
+    第一輪以 augment=False 推論全部圖片，確定的圖片立即產出；不確定的圖片第二輪以 augment=True 推論，
+    以 TTA 的結果取代第一輪。產出順序因此與輸入順序不同。
+    """
+    stats = CascadeStats() if stats is None else stats
+    paths = dict(items)
+    escalate = []
+    for seconds, (key, data) in _timed(run(items, dict(params, augment=False))):
+        stats.base_s += seconds
+        stats.images += 1
+        reasons = uncertainty_reasons(data)
+        if reasons:
+            escalate.append((key, paths[key]))
+            stats.reasons.update(reasons)
+            continue
+        yield key, data
+
+    stats.escalated = len(escalate)
+    if not escalate:
+        return
+    print(f"\n-> {len(escalate)}/{stats.images} 張圖片升級為 TTA 推論...")
+    for seconds, (key, data) in _timed(run(escalate, dict(params, augment=True))):
+        stats.tta_s += seconds
+        yield key, data